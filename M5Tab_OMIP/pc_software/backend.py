@@ -2,25 +2,54 @@ import sys
 import json
 import threading
 import time
-import serial
-import serial.tools.list_ports
 import io
 import os
 import base64
 import queue
-from typing import Optional
-from pynput import keyboard
-from PIL import Image
+import struct
+from typing import TYPE_CHECKING, Optional
 import binascii
 
+# Joy-Con 側 (リポジトリ直下の pc_software/) と共通のアクションエンジンを使う
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'pc_software'))
+# Electron は起動のたびにこのプロセスを立ち上げるので、PIL と pynput は使うときに読み込む
+import startup_timing
+import serial
+import serial.tools.list_ports
+
 import omip_pb2
+from event_pump import EventPump
+from command_dispatcher import CommandCancelled, CommandDispatcher
+from omip_decoder import INPUT_ANALOG, INPUT_DIGITAL, INPUT_ENCODER, InputDecoder
+from ipc_codec import CODECS, PROTOCOL_VERSION, FrameError, JsonCodec
+from action_engine import cancel_gestures, set_timer_wheel
+from output_backend import create_output_backend
+from output_worker import OutputWorker
+from timer_wheel import TimerWheel
+from omip_config import OmipConfig
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+startup_timing.mark('imports')
 
-CONFIG_FILE = "gui_config.json"
 CHUNK_SIZE = 190
 ACK_READY = b"\x06"
 ACK_ERROR = b"\x15"
 ACK_TIMEOUT_SEC = 2.0
 
+# ワーカーで実行するコマンド -> 直列に実行するリソース (None は他と並行に実行してよい)
+# ここに無いコマンドは短時間で終わるので stdin のスレッドでそのまま実行する
+POOLED_COMMANDS = {
+    'connect': 'device',
+    'disconnect': 'device',
+    'send_image': 'device',
+    'get_ports': None,
+    'get_config': 'config',
+    'save_config': 'config',
+    'save_page': 'config',
+}
+
 class BackendService:
     def __init__(self):
         self.serial_connection = None
@@ -28,55 +57,70 @@ class BackendService:
         self.reader_thread = None
         self.serial_lock = threading.Lock()
         self.ack_queue: "queue.Queue[bytes]" = queue.Queue()
-        self.keyboard = keyboard.Controller()
-        self.page_configs = {str(p): [{'icon': None, 'action': ''} for _ in range(18)] for p in range(1, 6)}
+        self.decoder = InputDecoder()  # シリアル読み取りスレッドだけが使うのでレコードを使い回す
+        self.input_codec = JsonCodec()   # hello で binary に切り替わる
+        self.output_codec = JsonCodec()  # hello の応答を書いた後に切り替わる (ライタースレッドだけが触る)
+        self.events = EventPump(self._write_responses)  # stdout への書き込みは専用スレッドで行う
+        self.dispatcher = CommandDispatcher()  # 時間のかかるコマンドを stdin の読み取りから切り離す
+        # 注入は専用スレッドで行い、シリアル読み取りを止めない (バックエンドの作成もそのスレッドで行う)
+        self.output = OutputWorker(backend_factory=create_output_backend).start()
+        self.timer_wheel = TimerWheel()  # 長押し・ダブルタップ・連射・マクロ
+        self.timer_wheel.start_thread()
+        set_timer_wheel(self.timer_wheel)
+        self.config = None  # ページ設定・エンコーダー設定とコンパイル済みアクション (OmipConfig)
         self.current_page = 1
+        self.actions_ready = threading.Event()
         self.load_config()
+        # アクションのコンパイルは pynput の import を含むので、最初のコマンドを待たせないよう別スレッドで行う
+        threading.Thread(target=self._warm_up, name='warm-up', daemon=True).start()
+        startup_timing.mark('service_ready')
 
-    def send_response(self, data):
+    def _warm_up(self):
         try:
-            message = json.dumps(data)
-            print(message, flush=True)
-        except TypeError as e:
-            print(json.dumps({'error': f'Failed to serialize response: {e}'}), flush=True)
+            self.config.compile_actions([str(self.current_page)])
+        finally:
+            self.actions_ready.set()
 
-    def load_config(self):
-        try:
-            if os.path.exists(CONFIG_FILE):
-                with open(CONFIG_FILE, 'r') as f:
-                    loaded_data = json.load(f)
-                    self.page_configs = {k: v for k, v in loaded_data.items()}
-        except Exception as e:
-            self.send_response({'type': 'error', 'message': f'Error loading config: {e}'})
+    def send_response(self, data):
+        self.events.send(data)
 
-    def save_config(self):
-        try:
-            with open(CONFIG_FILE, 'w') as f:
-                json.dump(self.page_configs, f, indent=4)
-        except Exception as e:
-            self.send_response({'type': 'error', 'message': f'Error saving config: {e}'})
+    def _write_responses(self, batch):
+        chunks = []
+        for data in batch:
+            codec = self.output_codec
+            try:
+                chunks.append(codec.encode(data))
+            except (TypeError, ValueError, struct.error) as e:
+                chunks.append(codec.encode({'error': f'Failed to serialize response: {e}'}))
+            if 'command' in data:
+                startup_timing.mark('first_command')
+            if data.get('command') == 'hello' and data.get('status') == 'success':
+                self.output_codec = CODECS[data['protocol']]()
+        sys.stdout.buffer.write(b''.join(chunks))
+        sys.stdout.buffer.flush()
+
+    def load_config(self):
+        """設定のストアを開く。ここではインデックスとエンコーダー設定だけを読み、ページは使うときに読む。"""
+        self.config = OmipConfig(report=lambda message: self.send_response({'type': 'error', 'message': message}))
 
-    def _execute_action(self, action_string):
-        if not action_string:
+    def _execute_action(self, action, pressed=True):
+        if not action:
             return
-        keys = action_string.lower().split('+')
         try:
-            for key in keys:
-                special_key = getattr(keyboard.Key, key, None)
-                if special_key:
-                    self.keyboard.press(special_key)
-                else:
-                    self.keyboard.press(key)
-            for key in reversed(keys):
-                special_key = getattr(keyboard.Key, key, None)
-                if special_key:
-                    self.keyboard.release(special_key)
-                else:
-                    self.keyboard.release(key)
+            if action.tap_on_press:
+                if not pressed:
+                    return
+                action.tap(self.output)
+            elif pressed:
+                action.press(self.output)
+            else:
+                action.release(self.output)
+            self.output.flush()
         except Exception as e:
             self.send_response({'type': 'error', 'message': f'Failed to execute key combo: {e}'})
 
     def _serial_reader(self):
+        self.actions_ready.wait()
         while not self.stop_thread:
             try:
                 if self.serial_connection and self.serial_connection.is_open:
@@ -95,25 +139,42 @@ class BackendService:
                     length = length_byte[0]
                     data = self.serial_connection.read(length)
                     if len(data) == length:
-                        wrapper_msg = omip_pb2.WrapperMessage()
-                        wrapper_msg.ParseFromString(data)
-                        
-                        if wrapper_msg.HasField("input_digital"):
-                            port_id = wrapper_msg.input_digital.port_id
-                            state = wrapper_msg.input_digital.state
+                        kind, msg = self.decoder.decode(data)
+
+                        if kind == INPUT_DIGITAL:
+                            port_id = msg.port_id
+                            state = msg.state
                             self.send_response({
                                 'type': 'device_event', 'event': 'input_digital',
                                 'port_id': port_id, 'state': state
                             })
-                            if state and 0 <= port_id < 18:
-                                action = self.page_configs.get(str(self.current_page), [])[port_id].get('action')
-                                self._execute_action(action)
-
-                        elif wrapper_msg.HasField("input_analog"):
+                            if 0 <= port_id < 18:
+                                actions = self.config.actions_for_page(str(self.current_page))
+                                if actions:
+                                    self._execute_action(actions[port_id], state)
+
+                        elif kind == INPUT_ENCODER:
+                            port_id = msg.port_id
+                            steps = msg.steps
                             self.send_response({
+                                'type': 'device_event', 'event': 'input_encoder',
+                                'port_id': port_id, 'steps': steps
+                            })
+                            binding = self.config.encoder_bindings.get(port_id)
+                            if binding:
+                                try:
+                                    binding.steps(self.output, steps)
+                                    self.output.flush()
+                                except Exception as e:
+                                    self.send_response({'type': 'error', 'message': f'Failed to execute encoder action: {e}'})
+
+                        elif kind == INPUT_ANALOG:
+                            # アナログ値はポートごとに最新値だけをまとめて送る (デジタル入力は上で必ず送る)
+                            port_id = msg.port_id
+                            value = msg.value
+                            self.events.send_analog(port_id, value, {
                                 'type': 'device_event', 'event': 'input_analog',
-                                'port_id': wrapper_msg.input_analog.port_id,
-                                'value': wrapper_msg.input_analog.value
+                                'port_id': port_id, 'value': value
                             })
                 else:
                     time.sleep(0.1)
@@ -157,14 +218,14 @@ class BackendService:
             if byte == ACK_ERROR:
                 raise RuntimeError("Device reported an error while receiving image data.")
 
-    def _image_to_jpeg_bytes(self, image: Image.Image) -> bytes:
+    def _image_to_jpeg_bytes(self, image: "Image.Image") -> bytes:
         if image.mode != 'RGB':
             image = image.convert('RGB')
         jpeg_buffer = io.BytesIO()
         image.save(jpeg_buffer, format='JPEG', quality=85)
         return jpeg_buffer.getvalue()
 
-    def send_image_to_device(self, screen_id: int, *, file_path: Optional[str] = None, data_url: Optional[str] = None, clear: bool = False) -> None:
+    def send_image_to_device(self, screen_id: int, *, file_path: Optional[str] = None, data_url: Optional[str] = None, clear: bool = False, job=None) -> None:
         if screen_id is None:
             raise ValueError("screen_id is required.")
         if not self.serial_connection or not self.serial_connection.is_open:
@@ -188,6 +249,7 @@ class BackendService:
                 self._wait_for_ack()
             return
 
+        Image = startup_timing.import_module('PIL.Image')
         image_data: bytes
         try:
             if file_path:
@@ -236,18 +298,57 @@ class BackendService:
                 self._wait_for_ack()
 
             offset += len(chunk)
+            if job is not None and offset < total_size:
+                job.check()  # チャンクの区切りでキャンセルを受け付ける
 
-    def run_command(self, command):
+    def dispatch(self, command):
+        """時間のかかるコマンドはワーカーで実行し、それ以外は stdin のスレッドでそのまま実行する"""
         cmd_type = command.get('type')
+        if cmd_type in POOLED_COMMANDS:
+            self.dispatcher.submit(command.get('id'), POOLED_COMMANDS[cmd_type], self._run_job, command)
+        else:
+            self.run_command(command)
+
+    def _run_job(self, job, command):
+        try:
+            job.check()  # 待っている間にキャンセルされた
+            self.run_command(command, job)
+        except CommandCancelled as e:
+            self._reply(command, {'command': command.get('type'), 'status': 'cancelled', 'message': str(e)})
+            raise
+        except Exception as e:
+            self._reply(command, {'command': command.get('type'), 'status': 'error', 'message': str(e)})
+
+    def _reply(self, command, data):
+        # 要求に id があれば応答に付けて返す (応答は要求と違う順番で届くことがある)
+        request_id = command.get('id')
+        if request_id is not None:
+            data['id'] = request_id
+        self.send_response(data)
 
-        if cmd_type == 'get_ports':
+    def run_command(self, command, job=None):
+        cmd_type = command.get('type')
+
+        def reply(data):
+            self._reply(command, data)
+
+        if cmd_type == 'hello':
+            protocol = command.get('protocol', JsonCodec.name)
+            if protocol not in CODECS:
+                reply({'command': 'hello', 'status': 'error', 'message': f'Unsupported protocol: {protocol}', 'protocols': list(CODECS)})
+                return
+            # 応答は JSON の行で返し、以降の stdin/stdout をこのプロトコルで読み書きする
+            self.input_codec = CODECS[protocol]()
+            reply({'command': 'hello', 'status': 'success', 'protocol': protocol, 'version': PROTOCOL_VERSION})
+
+        elif cmd_type == 'get_ports':
             ports = [port.device for port in serial.tools.list_ports.comports()]
-            self.send_response({'command': 'get_ports', 'status': 'success', 'ports': ports})
+            reply({'command': 'get_ports', 'status': 'success', 'ports': ports})
         
         elif cmd_type == 'connect':
             port = command.get('port')
             if not port:
-                self.send_response({'command': 'connect', 'status': 'error', 'message': 'Port not specified'})
+                reply({'command': 'connect', 'status': 'error', 'message': 'Port not specified'})
                 return
             try:
                 self.serial_connection = serial.Serial(port, 115200, timeout=1)
@@ -255,9 +356,9 @@ class BackendService:
                 self.reader_thread = threading.Thread(target=self._serial_reader)
                 self.reader_thread.daemon = True
                 self.reader_thread.start()
-                self.send_response({'command': 'connect', 'status': 'success', 'port': port})
+                reply({'command': 'connect', 'status': 'success', 'port': port})
             except serial.SerialException as e:
-                self.send_response({'command': 'connect', 'status': 'error', 'message': str(e)})
+                reply({'command': 'connect', 'status': 'error', 'message': str(e)})
 
         elif cmd_type == 'disconnect':
             if self.reader_thread:
@@ -267,19 +368,67 @@ class BackendService:
             if self.serial_connection and self.serial_connection.is_open:
                 self.serial_connection.close()
             self.serial_connection = None
-            self.send_response({'command': 'disconnect', 'status': 'success'})
+            reply({'command': 'disconnect', 'status': 'success'})
 
         elif cmd_type == 'set_page':
             self.current_page = command.get('page', 1)
-            self.send_response({'command': 'set_page', 'status': 'success', 'page': self.current_page})
+            cancel_gestures(None)  # 前のページで押したままの連射などを止める
+            reply({'command': 'set_page', 'status': 'success', 'page': self.current_page})
 
         elif cmd_type == 'get_config':
-            self.send_response({'command': 'get_config', 'status': 'success', 'config': self.page_configs})
+            reply({'command': 'get_config', 'status': 'success', 'config': self.config.get_page_configs(), 'encoders': self.config.encoder_configs})
 
         elif cmd_type == 'save_config':
-            self.page_configs = command.get('config', self.page_configs)
-            self.save_config()
-            self.send_response({'command': 'save_config', 'status': 'success'})
+            self.actions_ready.wait()  # 起動時のコンパイルが新しい設定を上書きしないように
+            if 'config' in command:
+                # エラーがあれば保存しない (force: true ならそのまま保存し、エラーのあるアクションには何も割り当てない)
+                errors = self.config.save_config(dict(command['config']), bool(command.get('force')))
+            else:
+                errors = []
+            if errors:
+                reply({'command': 'save_config', 'status': 'error', 'message': 'Invalid actions in config', 'errors': errors})
+            else:
+                reply({'command': 'save_config', 'status': 'success'})
+
+        elif cmd_type == 'save_page':
+            # 1ページだけの編集 (ページ数が多くても保存の手間が変わらない)
+            self.actions_ready.wait()
+            page = str(command.get('page', self.current_page))
+            cells = command.get('cells')
+            errors = self.config.save_page(page, cells, bool(command.get('force'))) if isinstance(cells, list) else ['cells must be a list']
+            if errors:
+                reply({'command': 'save_page', 'status': 'error', 'page': page, 'message': 'Invalid actions in config', 'errors': errors})
+            else:
+                reply({'command': 'save_page', 'status': 'success', 'page': page})
+
+        elif cmd_type == 'get_event_stats':
+            reply({'command': 'get_event_stats', 'status': 'success', 'stats': self.events.stats()})
+
+        elif cmd_type == 'set_analog_window':
+            window_ms = command.get('window_ms')
+            if not isinstance(window_ms, (int, float)) or window_ms < 0:
+                reply({'command': 'set_analog_window', 'status': 'error', 'message': 'window_ms must be a non-negative number'})
+                return
+            self.events.analog_window = window_ms / 1000.0
+            reply({'command': 'set_analog_window', 'status': 'success', 'window_ms': window_ms})
+
+        elif cmd_type == 'cancel':
+            target = command.get('target')
+            if target is None:
+                reply({'command': 'cancel', 'status': 'error', 'message': 'target is required'})
+            elif self.dispatcher.cancel(target):
+                reply({'command': 'cancel', 'status': 'success', 'target': target})
+            else:
+                reply({'command': 'cancel', 'status': 'error', 'message': f'No in-flight request: {target}', 'target': target})
+
+        elif cmd_type == 'get_startup_report':
+            reply({'command': 'get_startup_report', 'status': 'success', 'report': startup_timing.report()})
+
+        elif cmd_type == 'get_command_stats':
+            reply({'command': 'get_command_stats', 'status': 'success', 'stats': self.dispatcher.stats()})
+
+        elif cmd_type == 'get_output_stats':
+            reply({'command': 'get_output_stats', 'status': 'success', 'stats': self.output.stats()})
 
         elif cmd_type == 'send_image':
             screen_id = command.get('screen_id')
@@ -287,31 +436,45 @@ class BackendService:
             data_url = command.get('data_url')
             clear_flag = command.get('clear')
             if screen_id is None:
-                self.send_response({'command': 'send_image', 'status': 'error', 'message': 'screen_id is required'})
+                reply({'command': 'send_image', 'status': 'error', 'message': 'screen_id is required'})
                 return
             try:
                 self.send_image_to_device(
                     int(screen_id),
                     file_path=file_path,
                     data_url=data_url,
-                    clear=bool(clear_flag)
+                    clear=bool(clear_flag),
+                    job=job
                 )
-                self.send_response({'command': 'send_image', 'status': 'success', 'screen_id': int(screen_id)})
+                reply({'command': 'send_image', 'status': 'success', 'screen_id': int(screen_id)})
+            except CommandCancelled:
+                raise
             except Exception as e:
-                self.send_response({'command': 'send_image', 'status': 'error', 'message': str(e)})
+                reply({'command': 'send_image', 'status': 'error', 'message': str(e)})
 
         else:
-            self.send_response({'command': cmd_type, 'status': 'error', 'message': f'Unknown command: {cmd_type}'})
+            reply({'command': cmd_type, 'status': 'error', 'message': f'Unknown command: {cmd_type}'})
 
     def start(self):
-        for line in sys.stdin:
+        stdin = sys.stdin.buffer
+        while True:
             try:
-                command = json.loads(line)
-                self.run_command(command)
+                command = self.input_codec.read(stdin)
+                if command is None:
+                    break
+                self.dispatch(command)
             except json.JSONDecodeError:
                 self.send_response({'error': 'Invalid JSON'})
+            except FrameError as e:
+                self.send_response({'error': f'Invalid frame: {e}'})
+                break
             except Exception as e:
                 self.send_response({'error': str(e)})
+        self.dispatcher.cancel_all()
+        self.dispatcher.shutdown()
+        self.output.close()
+        self.config.close()
+        self.events.close()
 
 if __name__ == "__main__":
     service = BackendService()
@@ -0,0 +1,193 @@
+# OMIP Input Decoder Parity Check / Benchmark
+#
+# omip_decoder.InputDecoder と omip_pb2 のデコード結果が一致することを確認し (境界値の網羅的な確認は
+# pc_software/test_omip_decoder.py のテスト)、
+# 両者の処理時間を比較するためのツールです。
+#
+# 使用法:
+#   python bench_decoder.py                 # 生成した入力ストリームで確認する
+#   python bench_decoder.py capture.bin     # listen_inputs.py <ポート> capture.bin で記録したストリームで確認する
+#   python bench_decoder.py capture.bin --repeat 50
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+import omip_pb2
+
+# デコーダーは Joy-Con 側 (リポジトリ直下の pc_software/) と共通
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'pc_software'))
+from omip_decoder import INPUT_ANALOG, INPUT_DIGITAL, INPUT_ENCODER, InputDecoder
+
+FIELDS = {
+    INPUT_DIGITAL: ('device_id', 'port_id', 'state'),
+    INPUT_ANALOG: ('device_id', 'port_id', 'value'),
+    INPUT_ENCODER: ('device_id', 'port_id', 'steps'),
+}
+
+
+def read_capture(path):
+    """シリアルの記録 ('~' + 長さ + ペイロードの並び。ACK などの他のバイトは読み飛ばす) からペイロードを取り出す"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    frames = []
+    pos = 0
+    while pos + 1 < len(data):
+        if data[pos:pos + 1] != b'~':
+            pos += 1
+            continue
+        length = data[pos + 1]
+        payload = data[pos + 2:pos + 2 + length]
+        if len(payload) < length:
+            break
+        frames.append(payload)
+        pos += 2 + length
+    return frames
+
+
+def synthetic_stream(count, seed=0):
+    """実機の入力に近い割合のメッセージと、境界値・他の種類のメッセージを混ぜたストリームを作る"""
+    rng = random.Random(seed)
+    frames = []
+    for _ in range(count):
+        r = rng.random()
+        if r < 0.45:
+            msg = omip_pb2.WrapperMessage(input_analog=omip_pb2.InputAnalog(
+                device_id=rng.choice((0, 1)), port_id=18, value=rng.random()))
+        elif r < 0.75:
+            msg = omip_pb2.WrapperMessage(input_digital=omip_pb2.InputDigital(
+                device_id=rng.choice((0, 1)), port_id=rng.randrange(21), state=rng.random() < 0.5))
+        elif r < 0.97:
+            msg = omip_pb2.WrapperMessage(input_encoder=omip_pb2.InputEncoder(
+                device_id=0, port_id=rng.randrange(4), steps=rng.choice((-3, -1, 1, 2, 5))))
+        else:
+            msg = omip_pb2.WrapperMessage(feedback_image=omip_pb2.FeedbackImage(
+                screen_id=rng.randrange(18), total_size=0, is_last_chunk=True))
+        frames.append(msg.SerializeToString())
+    return frames
+
+
+def edge_cases():
+    """既定値の省略・大きな値・負の値・NaN・未知のフィールド・複数の oneof など"""
+    P = omip_pb2
+    frames = [
+        P.WrapperMessage(input_digital=P.InputDigital()).SerializeToString(),
+        P.WrapperMessage(input_analog=P.InputAnalog()).SerializeToString(),
+        P.WrapperMessage(input_encoder=P.InputEncoder()).SerializeToString(),
+        P.WrapperMessage(input_digital=P.InputDigital(device_id=0xFFFFFFFF, port_id=300, state=True)).SerializeToString(),
+        P.WrapperMessage(input_analog=P.InputAnalog(port_id=18, value=-1.5e30)).SerializeToString(),
+        P.WrapperMessage(input_analog=P.InputAnalog(port_id=18, value=float('nan'))).SerializeToString(),
+        P.WrapperMessage(input_encoder=P.InputEncoder(port_id=1, steps=-2147483648)).SerializeToString(),
+        P.WrapperMessage(input_encoder=P.InputEncoder(port_id=1, steps=2147483647)).SerializeToString(),
+        b'',
+        b'\x0a\x02\x10\x05\x12\x05\x10\x12\x1d\x00\x00\x80\x3f',  # input_digital の後に input_analog (後勝ち)
+        b'\x0a\x04\x10\x05\x20\x01',                              # 未知のフィールド 4
+        b'\x0a\x04\x10\x05\x18\x02',                              # bool に 2
+        b'\x0a\x0b\x10\xff\xff\xff\xff\xff\xff\xff\xff\xff\x01',   # 10バイトの varint
+        b'\x0a\x02\x10\x05\x0a\x02\x18\x01',                      # 同じ oneof が2回 (マージされる)
+    ]
+    big = P.WrapperMessage(input_digital=P.InputDigital(port_id=7, state=True)).SerializeToString()
+    frames.append(big[:1] + bytes([big[1] | 0x80, 0x00]) + big[2:])  # 長さを2バイトの varint で表したもの
+    return frames
+
+
+def canonical(kind, msg):
+    if kind not in FIELDS:
+        return kind, msg.SerializeToString() if kind else b''
+    values = []
+    for name in FIELDS[kind]:
+        value = getattr(msg, name)
+        if isinstance(value, float) and math.isnan(value):
+            value = 'nan'
+        values.append(value)
+    return kind, tuple(values)
+
+
+def reference(data):
+    wrapper = omip_pb2.WrapperMessage()
+    wrapper.ParseFromString(data)
+    kind = wrapper.WhichOneof('message_type')
+    return canonical(kind, getattr(wrapper, kind) if kind in FIELDS else wrapper)
+
+
+def check_parity(frames):
+    decoder = InputDecoder()
+    mismatches = 0
+    for data in frames:
+        try:
+            expected = reference(data)
+        except Exception as e:
+            expected = ('error', type(e).__name__)
+        try:
+            actual = canonical(*decoder.decode(data))
+        except Exception as e:
+            actual = ('error', type(e).__name__)
+        if actual != expected:
+            mismatches += 1
+            print(f"不一致: {data.hex()} protobuf={expected} fast={actual}")
+    return mismatches, decoder
+
+
+def bench(frames, repeat):
+    def protobuf_path():
+        for data in frames:
+            wrapper = omip_pb2.WrapperMessage()
+            wrapper.ParseFromString(data)
+            if wrapper.HasField('input_digital'):
+                wrapper.input_digital.port_id
+            elif wrapper.HasField('input_encoder'):
+                wrapper.input_encoder.port_id
+            elif wrapper.HasField('input_analog'):
+                wrapper.input_analog.port_id
+
+    decoder = InputDecoder()
+
+    def fast_path():
+        for data in frames:
+            kind, msg = decoder.decode(data)
+            if kind == INPUT_DIGITAL:
+                msg.port_id
+            elif kind == INPUT_ENCODER:
+                msg.port_id
+            elif kind == INPUT_ANALOG:
+                msg.port_id
+
+    results = {}
+    for name, fn in (('protobuf', protobuf_path), ('fast', fast_path)):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = best / len(frames) * 1e9
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='omip_decoder と omip_pb2 のパリティ確認とベンチマーク')
+    parser.add_argument('capture', nargs='?', help='listen_inputs.py <ポート> <記録ファイル> で記録したファイル')
+    parser.add_argument('--count', type=int, default=20000, help='記録が無い場合に生成するメッセージ数')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    frames = read_capture(args.capture) if args.capture else synthetic_stream(args.count)
+    if not frames:
+        print("フレームがありません。")
+        return 1
+    print(f"フレーム数: {len(frames)} (+ 境界値 {len(edge_cases())})")
+
+    mismatches, decoder = check_parity(frames + edge_cases())
+    print(f"パリティ: 不一致 {mismatches} 件 (高速パス {decoder.fast} / protobuf {decoder.fallback})")
+
+    results = bench(frames, args.repeat)
+    print(f"protobuf: {results['protobuf']:.0f} ns/フレーム")
+    print(f"fast:     {results['fast']:.0f} ns/フレーム ({results['protobuf'] / results['fast']:.1f} 倍)")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""
+BackendService のコマンドをワーカースレッドで並行に実行するディスパッチャー。
+
+- 時間のかかるコマンド (画像の送信など) を実行している間も、他のコマンドの読み取りと応答を止めない。
+- 同じリソース (シリアルデバイス・設定ファイルなど) を使うジョブはリソースごとの FIFO に並べ、1つずつ実行する。
+  リソースを指定しないジョブはすぐにワーカーへ渡すので、完了の順番は要求の順番と一致しない。
+- cancel(request_id) はジョブのフラグを立てるだけ。まだ始まっていないジョブは開始時に、
+  実行中のジョブは job.check() を呼んだ所で CommandCancelled になる。
+"""
+import collections
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MAX_WORKERS = 4
+
+
+class CommandCancelled(Exception):
+    pass
+
+
+class Job:
+    __slots__ = ('request_id', 'resource', 'fn', 'args', 'cancel_event')
+
+    def __init__(self, request_id, resource, fn, args):
+        self.request_id = request_id
+        self.resource = resource
+        self.fn = fn
+        self.args = args
+        self.cancel_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def check(self):
+        """キャンセルされていれば CommandCancelled を送出する"""
+        if self.cancel_event.is_set():
+            raise CommandCancelled(f'Request {self.request_id} was cancelled')
+
+
+class CommandDispatcher:
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='command')
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._resources = {}  # resource -> 待っているジョブの deque (先頭が実行中)
+        self._jobs = {}       # request_id -> 実行中または待っているジョブ
+        self.completed = 0
+        self.cancelled = 0
+
+    def submit(self, request_id, resource, fn, *args):
+        """fn(job, *args) をワーカーで実行する。同じ resource のジョブは投入順に1つずつ実行する。"""
+        job = Job(request_id, resource, fn, args)
+        with self._lock:
+            if request_id is not None:
+                self._jobs[request_id] = job
+            if resource is None:
+                self._executor.submit(self._run, job)
+            else:
+                waiting = self._resources.setdefault(resource, collections.deque())
+                waiting.append(job)
+                if len(waiting) == 1:
+                    self._executor.submit(self._run, job)
+        return job
+
+    def cancel(self, request_id):
+        """実行中または待っているジョブをキャンセルする。見つからなければ False。"""
+        with self._lock:
+            job = self._jobs.get(request_id)
+        if job is None:
+            return False
+        job.cancel()
+        return True
+
+    def cancel_all(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            job.cancel()
+
+    def in_flight(self):
+        with self._lock:
+            return [job.request_id for job in self._jobs.values()]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._jobs),
+                'waiting': {str(resource): len(waiting) - 1 for resource, waiting in self._resources.items()},
+                'completed': self.completed,
+                'cancelled': self.cancelled,
+            }
+
+    def shutdown(self, wait=True):
+        if wait:
+            # 待っているジョブは前のジョブの完了時に投入されるので、リソースの列が空になるまで待つ
+            with self._idle:
+                while self._resources:
+                    self._idle.wait()
+        self._executor.shutdown(wait=wait)
+
+    def _run(self, job):
+        try:
+            job.fn(job, *job.args)
+        except CommandCancelled:
+            with self._lock:
+                self.cancelled += 1
+        except Exception as e:
+            print(f"Command job failed: {e}", file=sys.stderr)
+        finally:
+            with self._lock:
+                self.completed += 1
+                if job.request_id is not None and self._jobs.get(job.request_id) is job:
+                    del self._jobs[job.request_id]
+                if job.resource is not None:
+                    waiting = self._resources[job.resource]
+                    waiting.popleft()
+                    if waiting:
+                        self._executor.submit(self._run, waiting[0])
+                    else:
+                        del self._resources[job.resource]
+                        self._idle.notify_all()
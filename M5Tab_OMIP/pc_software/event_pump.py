@@ -0,0 +1,113 @@
+"""
+BackendService から Electron UI へのメッセージ送信を専用スレッドで行うポンプ。
+
+- 通常のメッセージ (デジタル入力・コマンドの応答・エラーなど) は有限長の FIFO に入れ、
+  順番通りに必ず送る。FIFO が一杯のときは送信側を待たせ、捨てることはない。
+- アナログ入力はポートごとに「最新値だけ」を保持し、analog_window 秒に1回まとめて送る。
+  ウィンドウ内で上書きされた値は coalesced、最後に送った値と同じため送らなかった値は dropped として数える。
+- 書き込みは溜まっているメッセージをまとめて1回の write + flush で行う。
+"""
+import sys
+import threading
+import time
+
+DEFAULT_ANALOG_WINDOW_SEC = 0.05
+DEFAULT_MAX_QUEUE = 1024
+
+
+class EventPump:
+    def __init__(self, write_batch, analog_window=DEFAULT_ANALOG_WINDOW_SEC, max_queue=DEFAULT_MAX_QUEUE):
+        self.write_batch = write_batch  # write_batch([メッセージ, ...]) (ライタースレッドから呼ばれる)
+        self.analog_window = analog_window
+        self.max_queue = max_queue
+        self._queue = []
+        self._analog = {}        # port_id -> 未送信の最新メッセージ
+        self._analog_sent = {}   # port_id -> 最後に送った値
+        self._analog_due = None  # 未送信のアナログ値を送る時刻
+        self._cond = threading.Condition()
+        self._closed = False
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.stalls = 0          # FIFO が一杯で送信側を待たせた回数
+        self.max_depth = 0
+        self._thread = threading.Thread(target=self._run, name='event-pump', daemon=True)
+        self._thread.start()
+
+    def send(self, message):
+        """順序を保って必ず送るメッセージ"""
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                self.stalls += 1
+                while len(self._queue) >= self.max_queue and not self._closed:
+                    self._cond.wait()
+            self._queue.append(message)
+            if len(self._queue) > self.max_depth:
+                self.max_depth = len(self._queue)
+            self._cond.notify_all()
+
+    def send_analog(self, port_id, value, message):
+        """ポートごとに最新値だけを送るメッセージ"""
+        with self._cond:
+            if port_id in self._analog:
+                self.coalesced += 1
+            self._analog[port_id] = (value, message)
+            if self._analog_due is None:
+                self._analog_due = time.monotonic() + self.analog_window
+                self._cond.notify_all()
+
+    def stats(self):
+        return {
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'dropped': self.dropped,
+            'stalls': self.stalls,
+            'depth': len(self._queue),
+            'max_depth': self.max_depth,
+            'capacity': self.max_queue,
+            'analog_window_ms': self.analog_window * 1000,
+        }
+
+    def close(self, timeout=1.0):
+        """溜まっているメッセージを送り切ってから停止する"""
+        with self._cond:
+            self._closed = True
+            self._analog_due = time.monotonic()
+            self._cond.notify_all()
+        self._thread.join(timeout=timeout)
+
+    def _take_analog(self):
+        batch = []
+        for port_id, (value, message) in self._analog.items():
+            if self._analog_sent.get(port_id) == value:
+                self.dropped += 1
+                continue
+            self._analog_sent[port_id] = value
+            batch.append(message)
+        self._analog.clear()
+        self._analog_due = None
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    analog_ready = self._analog_due is not None and now >= self._analog_due
+                    if self._queue or analog_ready:
+                        break
+                    if self._closed:
+                        return
+                    self._cond.wait(None if self._analog_due is None else self._analog_due - now)
+                batch = self._queue
+                self._queue = []
+                if analog_ready:
+                    batch.extend(self._take_analog())
+                self._cond.notify_all()  # 待っている送信側を起こす
+            if not batch:
+                continue
+            try:
+                self.write_batch(batch)
+                self.sent += len(batch)
+            except Exception as e:
+                print(f"Failed to write backend events: {e}", file=sys.stderr)
@@ -1,26 +1,45 @@
+import collections
 import io
-import json
 import os
 import queue
 import serial
 import serial.tools.list_ports
+import sys
 import threading
 import time
 import tkinter as tk
 from tkinter import ttk
 
 from PIL import Image, ImageTk
-from pynput import keyboard
 from tkinterdnd2 import DND_FILES, TkinterDnD
 
 import omip_pb2
+from thumbnail_cache import ThumbnailLoader
+
+# Joy-Con 側 (リポジトリ直下の pc_software/) と共通のアクションエンジンとデコーダーを使う
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'pc_software'))
+from omip_decoder import INPUT_ANALOG, INPUT_DIGITAL, INPUT_ENCODER, InputDecoder
+from action_engine import (
+    ENCODERS_KEY, GESTURE_FIELDS, MappingError, cancel_gestures, compile_action, compile_encoder_bindings,
+    compile_page_actions, set_timer_wheel,
+)
+from output_backend import create_output_backend
+from output_worker import OutputWorker
+from profile_store import ProfileStore
+from timer_wheel import TimerWheel
 
 # --- Constants ---
 CHUNK_SIZE = 190
 ACK_READY = b"\x06"
 ACK_ERROR = b"\x15"
 ACK_TIMEOUT_SEC = 2.0
-CONFIG_FILE = "gui_config.json"
+CONFIG_FILE = "gui_config.json"  # 以前の形式 (初回起動時に CONFIG_STORE_DIR へ取り込む)
+CONFIG_STORE_DIR = "gui_config.d"  # ページごと (とエンコーダー設定) に1ファイルずつ保存する (backend.py と共通)
+THUMBNAIL_CACHE_DIR = "thumbnail_cache"
+PAGE_CACHE_SIZE = 3  # サムネイルの PhotoImage を保持しておくページ数
+DEVICE_MESSAGE_EVENT = "<<DeviceMessage>>"
+MESSAGE_BATCH_SIZE = 64  # 1回の起床で処理するメッセージ数の上限 (残りは他のイベントを処理してから)
+FALLBACK_POLL_MS = 20    # スレッド非対応の Tcl で使うポーリング間隔
 
 
 class App(TkinterDnD.Tk):
@@ -34,14 +53,36 @@ class App(TkinterDnD.Tk):
         self.serial_thread = None
         self.stop_thread = False
         self.serial_queue = queue.Queue()
+        # キューにメッセージが入ったら Tk のループを起こす。event_generate は Tk のループが処理するまで
+        # 呼び出し元を待たせるので、シリアルの読み取りスレッドではなく専用のスレッドから呼ぶ
+        # (GUI スレッドが ACK を待っている間に読み取りスレッドが止まらないように)。
+        self.wake_event = threading.Event()
+        self.closing = False
+        self.bind(DEVICE_MESSAGE_EVENT, lambda e: self._process_queue())
+        self.event_driven = bool(self.tk.call('info', 'exists', 'tcl_platform(threaded)'))
+        if self.event_driven:
+            threading.Thread(target=self._waker, name='tk-waker', daemon=True).start()
+        self.decoder = InputDecoder(reuse=False)  # レコードを GUI スレッドへ渡すので使い回さない
         self.ack_queue = queue.Queue()
-        self.keyboard = keyboard.Controller()
+        self.output = OutputWorker(create_output_backend()).start()
+        self.timer_wheel = TimerWheel()  # 長押し・ダブルタップ・連射・マクロ
+        self.timer_wheel.start_thread()
+        set_timer_wheel(self.timer_wheel)
 
         # --- Data Structure for Page Configurations ---
-        self.page_configs = {p: [{'icon': None, 'image': None, 'action': ''} for _ in range(18)] for p in range(1, 6)}
+        self.store = None  # ページ -> セルの一覧、ENCODERS_KEY -> エンコーダー設定 (ProfileStore)
+        self.page_configs = {}  # ページ -> セルの一覧 (ページを初めて使うときにストアから読む)
+        # サムネイルは表示するページの分だけバックグラウンドで読み込み、最近表示したページの分だけ保持する
+        self.thumbnails = ThumbnailLoader(THUMBNAIL_CACHE_DIR, on_result=self._wake)
+        self.page_images = collections.OrderedDict()  # page -> {index: (path, PhotoImage)}
+        self.thumbnails_requested = set()  # 読み込み中の (page, index, path)
+        self.page_actions = {}  # ページ -> コンパイル済みアクション (ページを初めて使うときにコンパイルする)
+        self.encoder_configs = {}  # port_id -> エンコーダー設定 (ストアの "encoders")
+        self.encoder_bindings = {}
 
         # --- Load Config ---
         self.load_config()
+        self._compile_actions()
 
         # --- Top Frame for Connection UI ---
         connection_frame = ttk.Frame(self, padding="10")
@@ -137,27 +178,36 @@ class App(TkinterDnD.Tk):
         self.status_label.pack(side="bottom", fill="x")
 
         self.update_page_display() # Initial page load
-        self._process_queue() # Start queue processor
-
-    def _execute_action(self, action_string):
-        print(f"アクションを実行します: {action_string}")
-        # Simple parsing for now, e.g., "ctrl+c"
-        keys = action_string.lower().split('+')
+        if not self.event_driven:
+            print("Tcl がスレッドに対応していないため、キューをポーリングします。")
+            self._poll_queue()
+
+    def _compile_actions(self):
+        self.encoder_bindings, errors = compile_encoder_bindings(self.encoder_configs)
+        for error in errors:
+            print(f"不正なアクション設定: {error}")
+
+    def _page_actions(self, page):
+        actions = self.page_actions.get(page)
+        if actions is None:
+            compiled, errors = compile_page_actions({page: self._page_config(page)})
+            for error in errors:
+                print(f"不正なアクション設定: {error}")
+            actions = self.page_actions[page] = compiled[page]
+        return actions
+
+    def _execute_action(self, action, pressed=True):
         try:
-            for key in keys:
-                # Map string to pynput Key object if necessary
-                special_key = getattr(keyboard.Key, key, None)
-                if special_key:
-                    self.keyboard.press(special_key)
-                else:
-                    self.keyboard.press(key)
-            # Release in reverse order
-            for key in reversed(keys):
-                special_key = getattr(keyboard.Key, key, None)
-                if special_key:
-                    self.keyboard.release(special_key)
-                else:
-                    self.keyboard.release(key)
+            if action.tap_on_press:
+                if not pressed:
+                    return
+                print(f"アクションを実行します: {action.source}")
+                action.tap(self.output)
+            elif pressed:
+                action.press(self.output)
+            else:
+                action.release(self.output)
+            self.output.flush()
         except Exception as e:
             print(f"キーの組み合わせの実行に失敗しました: {e}")
 
@@ -189,59 +239,141 @@ class App(TkinterDnD.Tk):
 
                     data = self.serial_connection.read(length)
                     if len(data) == length:
-                        wrapper_msg = omip_pb2.WrapperMessage()
-                        wrapper_msg.ParseFromString(data)
-                        self.serial_queue.put(wrapper_msg)
+                        self.serial_queue.put(self.decoder.decode(data))
+                        self._wake()
                 else:
                     time.sleep(0.1) # Avoid busy-waiting if disconnected
             except serial.SerialException as e:
                 print(f"シリアルリーダーのスレッドでエラーが発生しました: {e}")
                 self.stop_thread = True # Stop thread on error
                 self.serial_queue.put("serial_error")
+                self._wake()
             except Exception as e:
                 print(f"リーダーのスレッドでエラーが発生しました: {e}")
         print("シリアルリーダーのスレッドが停止しました。")
 
+    def _page_thumbnails(self, page):
+        """page のサムネイルを返す。足りない分はローダーに依頼し、届いたときにセルへ反映する。"""
+        images = self.page_images.get(page)
+        if images is None:
+            images = self.page_images[page] = {}
+            while len(self.page_images) > PAGE_CACHE_SIZE:
+                evicted, _ = self.page_images.popitem(last=False)
+                self.thumbnails_requested = {r for r in self.thumbnails_requested if r[0] != evicted}
+        else:
+            self.page_images.move_to_end(page)
+        missing = []
+        for index, cell in enumerate(self._page_config(page)):
+            path = cell['icon']
+            if not path:
+                images.pop(index, None)
+            elif (index not in images or images[index][0] != path) and (page, index, path) not in self.thumbnails_requested:
+                missing.append((index, path))
+                self.thumbnails_requested.add((page, index, path))
+        if missing:
+            self.thumbnails.request(page, missing)
+        return images
+
+    def _apply_thumbnails(self):
+        while self.thumbnails.results:
+            page, index, path, image = self.thumbnails.results.popleft()
+            self.thumbnails_requested.discard((page, index, path))
+            images = self.page_images.get(page)
+            if images is None or self._page_config(page)[index]['icon'] != path:
+                continue  # ページが LRU から外れたか、アイコンが変わった
+            if image is None:
+                images.pop(index, None)
+                continue
+            images[index] = (path, ImageTk.PhotoImage(image))
+            if page == self.page_number:
+                self._show_cell_image(index, images[index][1])
+
+    def _show_cell_image(self, index, photo):
+        row, col = divmod(index, 6)
+        icon = self.grid_cells[row][col]['icon']
+        icon.config(image=photo if photo else '')
+        icon.image = photo  # Keep the image reference to prevent garbage collection
+
+    def _wake(self):
+        """どのスレッドからでも呼べる。Tk のループに _process_queue を実行させる。"""
+        self.wake_event.set()
+
+    def _waker(self):
+        while True:
+            self.wake_event.wait()
+            self.wake_event.clear()
+            if self.closing:
+                return
+            try:
+                self.event_generate(DEVICE_MESSAGE_EVENT, when="tail")
+            except (tk.TclError, RuntimeError):
+                if self.closing:
+                    return  # ウィンドウが破棄された
+                # mainloop() がまだ始まっていない ("main thread is not in main loop") など。
+                # 起こす要求を残したまま、少し待ってから送り直す
+                self.wake_event.set()
+                time.sleep(FALLBACK_POLL_MS / 1000)
+
+    def _poll_queue(self):
+        self._process_queue()
+        self.after(FALLBACK_POLL_MS, self._poll_queue)
+
     def _process_queue(self):
+        self._apply_thumbnails()
         try:
-            while not self.serial_queue.empty():
-                msg = self.serial_queue.get_nowait()
+            for _ in range(MESSAGE_BATCH_SIZE):
+                item = self.serial_queue.get_nowait()
 
-                if msg == "serial_error":
+                if item == "serial_error":
                     self.disconnect()
                     self.set_status("ステータス: デバイスが切断されたか、エラーが発生しました。")
                     break
 
-                if msg.HasField("input_digital"):
-                    port_id = msg.input_digital.port_id
-                    state = msg.input_digital.state
+                kind, msg = item
+                if kind == INPUT_DIGITAL:
+                    port_id = msg.port_id
+                    state = msg.state
                     print(f"InputDigital 受信: ポート={port_id}, 状態={state}")
                     
-                    if state: # Only act on press, not release
-                        if 0 <= port_id < 18:
+                    if 0 <= port_id < 18:
+                        if state:
                             row, col = divmod(port_id, 6)
                             self._flash_cell(row, col)
-                            action = self.page_configs[self.page_number][port_id]['action']
-                            if action:
-                                self._execute_action(action)
-                        elif port_id == 19: # Next page
-                            self.next_page()
-                        elif port_id == 20: # Prev page
-                            self.prev_page()
+                        action = self._page_actions(self.page_number)[port_id]
+                        if action:
+                            # 通常のアクションは押したときだけ、長押しなどは離したときも渡す
+                            self._execute_action(action, state)
+                    elif state and port_id == 19: # Next page
+                        self.next_page()
+                    elif state and port_id == 20: # Prev page
+                        self.prev_page()
                 
-                elif msg.HasField("input_analog"):
-                    port_id = msg.input_analog.port_id
-                    value = msg.input_analog.value
+                elif kind == INPUT_ENCODER:
+                    port_id = msg.port_id
+                    steps = msg.steps
+                    binding = self.encoder_bindings.get(port_id)
+                    if binding:
+                        try:
+                            binding.steps(self.output, steps)
+                            self.output.flush()
+                        except Exception as e:
+                            print(f"エンコーダーのアクションの実行に失敗しました: {e}")
+
+                elif kind == INPUT_ANALOG:
+                    port_id = msg.port_id
+                    value = msg.value
                     print(f"InputAnalog 受信: ポート={port_id}, 値={value:.2f}")
 
                     if port_id == 18: # Volume slider
                         # Assuming the scale is 0-100
                         self.volume_scale.set(value * 100)
 
+            else:
+                # 溜まっている分は、再描画などの他のイベントを処理してから続ける
+                if self.event_driven and not self.serial_queue.empty():
+                    self.after_idle(self._process_queue)
         except queue.Empty:
             pass
-        finally:
-            self.after(100, self._process_queue) # Poll queue every 100ms
 
     def open_action_dialog(self, row, col):
         dialog = tk.Toplevel(self)
@@ -254,7 +386,7 @@ class App(TkinterDnD.Tk):
         
         action_var = tk.StringVar()
         cell_index = row * 6 + col
-        current_action = self.page_configs[self.page_number][cell_index]['action']
+        current_action = self._page_config(self.page_number)[cell_index]['action']
         action_var.set(current_action)
         
         entry = ttk.Entry(dialog, textvariable=action_var, width=40)
@@ -263,7 +395,14 @@ class App(TkinterDnD.Tk):
 
         def save_action():
             new_action = action_var.get()
-            self.page_configs[self.page_number][cell_index]['action'] = new_action
+            try:
+                compiled = compile_action(new_action)
+            except MappingError as e:
+                self.set_status(f"エラー: 不正なアクションです ({e})")
+                return
+            self._page_config(self.page_number)[cell_index]['action'] = new_action
+            self._page_actions(self.page_number)[cell_index] = compiled
+            self.save_config(self.page_number)
             self.update_page_display()
             dialog.destroy()
 
@@ -285,10 +424,12 @@ class App(TkinterDnD.Tk):
             self.update_page_display()
 
     def update_page_display(self):
+        cancel_gestures(None)  # 前のページで押したままの連射などを止める
         self.page_label.config(text=f"ページ {self.page_number} / {self.total_pages}")
         print(f"Loading page {self.page_number}")
 
-        config = self.page_configs[self.page_number]
+        config = self._page_config(self.page_number)
+        images = self._page_thumbnails(self.page_number)
         for r in range(3):
             for c in range(6):
                 cell_index = r * 6 + c
@@ -296,13 +437,9 @@ class App(TkinterDnD.Tk):
                 cell_ui = self.grid_cells[r][c]
 
                 cell_ui['action'].config(text=cell_config['action'] or f"ポート {cell_index}")
-                if cell_config['image']:
-                    cell_ui['icon'].config(image=cell_config['image'])
-                    # Keep the image reference to prevent garbage collection
-                    cell_ui['icon'].image = cell_config['image'] 
-                else:
-                    cell_ui['icon'].config(image='')
-                    cell_ui['icon'].image = None
+                image = images.get(cell_index)
+                # 読み込み中のセルは空にしておき、届いたときに _apply_thumbnails で表示する
+                self._show_cell_image(cell_index, image[1] if image and image[0] == cell_config['icon'] else None)
         
         # Sync icons to device if connected
         if self.serial_connection and self.serial_connection.is_open:
@@ -310,7 +447,7 @@ class App(TkinterDnD.Tk):
 
     def sync_page_to_device(self):
         self.set_status(f"ページ {self.page_number} をデバイスに同期中...")
-        config = self.page_configs[self.page_number]
+        config = self._page_config(self.page_number)
         for i, cell_config in enumerate(config):
             icon_path = cell_config.get('icon')
             if icon_path and os.path.exists(icon_path):
@@ -389,14 +526,13 @@ class App(TkinterDnD.Tk):
             return
 
         try:
-            image = Image.open(filepath)
-            image = image.resize((80, 80), Image.Resampling.LANCZOS) # Smaller resize
-            photo = ImageTk.PhotoImage(image)
-            
-            # Save image and path to the data structure
+            with Image.open(filepath) as image:
+                image.verify()  # 読めない画像は設定しない (サムネイルの作成はローダーで行う)
+
+            # Save the path to the data structure
             cell_index = row * 6 + col
-            self.page_configs[self.page_number][cell_index]['icon'] = filepath
-            self.page_configs[self.page_number][cell_index]['image'] = photo
+            self._page_config(self.page_number)[cell_index]['icon'] = filepath
+            self.save_config(self.page_number)
 
             # Update the entire page display to reflect the new icon
             self.update_page_display()
@@ -494,64 +630,50 @@ class App(TkinterDnD.Tk):
         self.status_label.config(text=message)
         self.update_idletasks() # Force GUI update
 
-    def save_config(self):
-        print("設定を保存しています...")
-        save_data = {}
-        for page_num, configs in self.page_configs.items():
-            save_data[page_num] = []
-            for config in configs:
-                # Only save the file path (icon) and the action string
-                save_data[page_num].append({
-                    'icon': config['icon'],
-                    'action': config['action']
-                })
-        try:
-            with open(CONFIG_FILE, 'w') as f:
-                json.dump(save_data, f, indent=4)
-            print("設定を保存しました。")
-        except Exception as e:
-            print(f"設定の保存中にエラー: {e}")
-            self.set_status(f"エラー: 設定を保存できませんでした。")
+    def save_config(self, page):
+        """1ページ分を保存する。ファイルへの書き込みはストアのスレッドで後からまとめて行う。"""
+        cells = []
+        for config in self._page_config(page):
+            # Only save the file path (icon), the action and its gesture options
+            cell = {'icon': config['icon'], 'action': config['action']}
+            cell.update((name, config[name]) for name in GESTURE_FIELDS if name in config)
+            cells.append(cell)
+        self.store.put(str(page), cells)
 
     def load_config(self):
+        """設定のストアを開く。ここではインデックスとエンコーダー設定だけを読み、ページは表示するときに読む。"""
         print("設定を読み込んでいます...")
         try:
-            with open(CONFIG_FILE, 'r') as f:
-                loaded_data = json.load(f)
-            
-            for page_num_str, configs in loaded_data.items():
-                page_num = int(page_num_str)
-                if page_num not in self.page_configs:
-                    continue
-                
-                for i, config in enumerate(configs):
-                    if i < len(self.page_configs[page_num]):
-                        self.page_configs[page_num][i]['action'] = config.get('action', '')
-                        icon_path = config.get('icon')
-                        if icon_path and os.path.exists(icon_path):
-                            self.page_configs[page_num][i]['icon'] = icon_path
-                            try:
-                                image = Image.open(icon_path)
-                                image = image.resize((80, 80), Image.Resampling.LANCZOS)
-                                photo = ImageTk.PhotoImage(image)
-                                self.page_configs[page_num][i]['image'] = photo
-                            except Exception as e:
-                                print(f"画像 {icon_path} の読み込みエラー: {e}")
-                                self.page_configs[page_num][i]['image'] = None # Clear if image fails to load
-                        else:
-                            self.page_configs[page_num][i]['icon'] = None
-                            self.page_configs[page_num][i]['image'] = None
-
+            self.store = ProfileStore(CONFIG_STORE_DIR, legacy_file=CONFIG_FILE)
             print("設定を読み込みました。")
-        except FileNotFoundError:
-            print("設定ファイルが見つかりません。デフォルトで起動します。")
         except Exception as e:
             print(f"設定の読み込み中にエラー: {e}")
-            self.set_status("エラー: 設定を読み込めませんでした。")
+            self.store = ProfileStore(CONFIG_STORE_DIR)
+        self.encoder_configs = self.store.get(ENCODERS_KEY, {})
+
+    def _page_config(self, page):
+        configs = self.page_configs.get(page)
+        if configs is not None:
+            return configs
+        configs = self.page_configs[page] = [{'icon': None, 'action': ''} for _ in range(18)]
+        for i, config in enumerate(self.store.get(str(page), [])[:len(configs)]):
+            configs[i]['action'] = config.get('action', '')
+            for name in GESTURE_FIELDS:
+                if name in config:
+                    configs[i][name] = config[name]
+            # サムネイルはページを表示するときに読み込む
+            icon_path = config.get('icon')
+            if icon_path and os.path.exists(icon_path):
+                configs[i]['icon'] = icon_path
+        return configs
 
     def on_closing(self):
-        self.save_config()
+        self.store.close()  # 保存していない変更を書き出す
         self.disconnect()
+        self.closing = True
+        self._wake()  # waker スレッドを終わらせる
+        self.thumbnails.close()
+        self.output.close()
         self.destroy()
 
 if __name__ == "__main__":
@@ -0,0 +1,95 @@
+"""
+BackendService と Electron UI の間の stdin/stdout のエンコード。
+
+- json (既定): 1行に1つの JSON オブジェクト。
+- binary: 長さ付きのフレーム。ヘッダーは <ペイロード長 (uint32 LE)><種類 (uint8)>。
+  デバイスイベント (入力デジタル・アナログ・エンコーダー) は固定長の構造体で、
+  それ以外のメッセージは空白を省いた UTF-8 の JSON で送る。
+
+切り替えは UI が JSON で {"type": "hello", "protocol": "binary"} を送ったときだけ行う。
+backend は hello の行を読んだ直後から stdin をフレームとして読み、
+hello の応答 (JSON の行) を書いた直後から stdout をフレームで書く。
+UI は hello の応答を受け取るまで次のコマンドを送らない。
+"""
+import json
+import struct
+
+PROTOCOL_VERSION = 1
+
+HEADER = struct.Struct('<IB')
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+KIND_JSON = 1
+KIND_INPUT_DIGITAL = 2
+KIND_INPUT_ANALOG = 3
+KIND_INPUT_ENCODER = 4
+
+# デバイスイベントの種類 -> (event 名, 値のキー, ペイロードの構造体)
+_DEVICE_EVENTS = {
+    KIND_INPUT_DIGITAL: ('input_digital', 'state', struct.Struct('<I?')),
+    KIND_INPUT_ANALOG: ('input_analog', 'value', struct.Struct('<If')),
+    KIND_INPUT_ENCODER: ('input_encoder', 'steps', struct.Struct('<Ii')),
+}
+_DEVICE_EVENT_KINDS = {event: (kind, key, packer) for kind, (event, key, packer) in _DEVICE_EVENTS.items()}
+
+
+class FrameError(Exception):
+    """フレームの境界が分からなくなり、以降のストリームを読めないエラー"""
+
+
+class JsonCodec:
+    name = 'json'
+
+    def encode(self, message):
+        return (json.dumps(message) + '\n').encode('utf-8')
+
+    def read(self, stream):
+        """1行読んでコマンドを返す。EOF なら None。"""
+        line = stream.readline()
+        if not line:
+            return None
+        return json.loads(line)
+
+
+class BinaryCodec:
+    name = 'binary'
+
+    def encode(self, message):
+        if message.get('type') == 'device_event' and len(message) == 4:
+            entry = _DEVICE_EVENT_KINDS.get(message.get('event'))
+            if entry is not None:
+                kind, key, packer = entry
+                if key in message:
+                    payload = packer.pack(message['port_id'], message[key])
+                    return HEADER.pack(len(payload), kind) + payload
+        payload = json.dumps(message, separators=(',', ':')).encode('utf-8')
+        return HEADER.pack(len(payload), KIND_JSON) + payload
+
+    def decode(self, kind, payload):
+        if kind == KIND_JSON:
+            return json.loads(payload)
+        entry = _DEVICE_EVENTS.get(kind)
+        if entry is None:
+            raise ValueError(f'Unknown frame kind: {kind}')
+        event, key, packer = entry
+        port_id, value = packer.unpack(payload)
+        return {'type': 'device_event', 'event': event, 'port_id': port_id, key: value}
+
+    def read(self, stream):
+        """1フレーム読んでメッセージを返す。EOF (途中で切れたフレームを含む) なら None。"""
+        header = stream.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return None
+        length, kind = HEADER.unpack(header)
+        if length > MAX_FRAME_SIZE:
+            raise FrameError(f'Frame too large: {length} bytes')
+        payload = stream.read(length)
+        if len(payload) < length:
+            return None
+        return self.decode(kind, payload)
+
+
+CODECS = {
+    JsonCodec.name: JsonCodec,
+    BinaryCodec.name: BinaryCodec,
+}
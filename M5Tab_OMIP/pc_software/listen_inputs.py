@@ -1,7 +1,7 @@
 # OMIP Device Input Listener
 #
 # このスクリプトは、OMIP互換デバイスから送信される入力イベント
-# (InputDigital, InputAnalogなど)を継続的に待ち受け、受信した内容を
+# (InputDigital, InputAnalog, InputEncoder)を継続的に待ち受け、受信した内容を
 # コンソールに表示するためのテストツールです。
 
 import serial
@@ -17,10 +17,12 @@ except ImportError:
 
 def main():
     if len(sys.argv) < 2:
-        print("使用法: python listen_inputs.py <シリアルポート名>")
+        print("使用法: python listen_inputs.py <シリアルポート名> [記録ファイル]")
         print("例: python listen_inputs.py COM3")
+        print("記録ファイルを指定すると、受信したフレームをそのまま保存します (bench_decoder.py で使えます)。")
         return
     port = sys.argv[1]
+    record = open(sys.argv[2], 'wb') if len(sys.argv) > 2 else None
 
     try:
         ser = serial.Serial(port, 115200, timeout=0.1) # タイムアウトを短くしてCtrl+Cに反応しやすくする
@@ -48,6 +50,9 @@ def main():
                     print(f"警告: データ長が{data_size}バイトであるべきところ、{len(response_data)}バイトしか受信できませんでした。")
                     continue
 
+                if record:
+                    record.write(b'~' + size_byte + response_data)
+
                 # 受信データをデコード
                 wrapper = omip_pb2.WrapperMessage()
                 try:
@@ -61,6 +66,9 @@ def main():
                     elif msg_type == "input_analog":
                         msg = wrapper.input_analog
                         print(f"[InputAnalog]  Port: {msg.port_id}, Value: {msg.value:.4f}")
+                    elif msg_type == "input_encoder":
+                        msg = wrapper.input_encoder
+                        print(f"[InputEncoder] Port: {msg.port_id}, Steps: {msg.steps:+d}")
                     else:
                         print(f"[受信] 未対応のメッセージタイプ: {msg_type}")
 
@@ -81,6 +89,8 @@ def main():
         if 'ser' in locals() and ser.is_open:
             ser.close()
             print(f"{port}をクローズしました。")
+        if record:
+            record.close()
 
 if __name__ == "__main__":
     main()
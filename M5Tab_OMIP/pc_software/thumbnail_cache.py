@@ -0,0 +1,108 @@
+"""
+設定ツールのセルに表示するサムネイルをバックグラウンドで読み込むローダー。
+
+- 読み込みはページ単位で依頼し、最後に依頼されたページ (表示中のページ) から順に処理する。
+- 縮小した画像は元ファイルの内容のハッシュをキーにディスクへ保存し、次回からは縮小済みの PNG を読むだけにする。
+  ハッシュはパス・更新時刻・サイズが同じ間はメモリ上で使い回す。
+- PhotoImage は Tk のスレッドでしか作れないため、ワーカーは PIL の Image を results キューに入れ、
+  on_result (任意) を呼んで GUI に知らせるだけにする。
+"""
+import collections
+import hashlib
+import os
+import threading
+
+from PIL import Image
+
+THUMBNAIL_SIZE = (80, 80)
+CACHE_VERSION = 1  # 縮小方法を変えたときに古いキャッシュを使わないようにする
+
+
+class ThumbnailLoader:
+    def __init__(self, cache_dir, size=THUMBNAIL_SIZE, on_result=None):
+        self.cache_dir = cache_dir
+        self.size = size
+        self.on_result = on_result  # ワーカースレッドから引数なしで呼ばれる
+        self.results = collections.deque()  # (page, index, path, Image or None)
+        self._pending = collections.OrderedDict()  # page -> [(index, path), ...] (末尾が最新の依頼)
+        self._hashes = {}  # (path, mtime_ns, size) -> ハッシュ
+        self._cond = threading.Condition()
+        self._closed = False
+        self.disk_hits = 0
+        self.generated = 0
+        self._thread = threading.Thread(target=self._run, name='thumbnail-loader', daemon=True)
+        self._thread.start()
+
+    def request(self, page, items):
+        """page のサムネイル [(index, path), ...] の読み込みを依頼する。そのページを最優先にする。"""
+        with self._cond:
+            waiting = self._pending.pop(page, [])
+            waiting.extend(items)
+            self._pending[page] = waiting
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._pending.clear()
+            self._cond.notify()
+        self._thread.join(timeout=1.0)
+
+    def _file_hash(self, path):
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size)
+        digest = self._hashes.get(key)
+        if digest is None:
+            h = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 16), b''):
+                    h.update(block)
+            digest = self._hashes[key] = h.hexdigest()
+        return digest
+
+    def load(self, path):
+        """縮小済みの画像を返す (ワーカースレッドで呼ばれる)"""
+        name = f"{self._file_hash(path)}_{self.size[0]}x{self.size[1]}_v{CACHE_VERSION}.png"
+        cached = os.path.join(self.cache_dir, name)
+        if os.path.exists(cached):
+            try:
+                with Image.open(cached) as img:
+                    img.load()
+                    self.disk_hits += 1
+                    return img.copy()
+            except OSError:
+                pass  # 壊れたキャッシュは作り直す
+        with Image.open(path) as img:
+            if img.mode not in ('RGB', 'RGBA'):
+                img = img.convert('RGBA')
+            thumb = img.resize(self.size, Image.Resampling.LANCZOS)
+        self.generated += 1
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = f"{cached}.{os.getpid()}.tmp"
+            thumb.save(tmp, format='PNG')
+            os.replace(tmp, cached)
+        except OSError as e:
+            print(f"サムネイルのキャッシュを書き込めませんでした: {e}")
+        return thumb
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                # 最後に依頼されたページ (表示中のページ) を優先し、1枚ずつ取り出す
+                page, items = next(reversed(self._pending.items()))
+                index, path = items.pop(0)
+                if not items:
+                    del self._pending[page]
+            try:
+                image = self.load(path)
+            except Exception as e:
+                print(f"画像 {path} の読み込みエラー: {e}")
+                image = None
+            self.results.append((page, index, path, image))
+            if self.on_result is not None:
+                self.on_result()
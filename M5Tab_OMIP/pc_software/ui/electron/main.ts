@@ -3,7 +3,6 @@ import path from 'node:path';
 import fs from 'node:fs/promises';
 import { fileURLToPath } from 'node:url';
 import { spawn, ChildProcessWithoutNullStreams } from 'node:child_process';
-import readline from 'node:readline';
 import { randomUUID } from 'node:crypto';
 
 // ESM-safe __dirname replacement
@@ -17,7 +16,6 @@ process.env.VITE_PUBLIC = process.env.VITE_DEV_SERVER_URL
 
 let win: BrowserWindow | null;
 let pythonProcess: ChildProcessWithoutNullStreams | null = null;
-let stdoutReader: readline.Interface | null = null;
 
 type BackendResponse = {
   command?: string;
@@ -28,11 +26,97 @@ type BackendResponse = {
 };
 
 type PendingRequest = {
+  command: string;
   resolve: (value: BackendResponse) => void;
   reject: (error: Error) => void;
 };
 
-const pendingResponses = new Map<string, PendingRequest[]>();
+const pendingResponses = new Map<string, PendingRequest>();
+let nextRequestId = 1;
+
+// --- stdin/stdout protocol shared with backend.py (see ipc_codec.py) ---
+// Starts as JSON lines. After a successful "hello" for binary, both directions switch to
+// length-prefixed frames: <length uint32 LE><kind uint8><payload>.
+const IPC_PROTOCOL = process.env.OMIP_IPC_PROTOCOL === 'json' ? 'json' : 'binary';
+const FRAME_HEADER_SIZE = 5;
+const KIND_JSON = 1;
+const KIND_INPUT_DIGITAL = 2;
+const KIND_INPUT_ANALOG = 3;
+const KIND_INPUT_ENCODER = 4;
+
+let backendProtocol: 'json' | 'binary' = 'json';
+let handshakePending = false;
+let queuedCommands: object[] = [];
+
+function decodeFrame(kind: number, payload: Buffer): BackendResponse | null {
+  switch (kind) {
+    case KIND_JSON:
+      return JSON.parse(payload.toString('utf8'));
+    case KIND_INPUT_DIGITAL:
+      return { type: 'device_event', event: 'input_digital', port_id: payload.readUInt32LE(0), state: payload.readUInt8(4) !== 0 };
+    case KIND_INPUT_ANALOG:
+      return { type: 'device_event', event: 'input_analog', port_id: payload.readUInt32LE(0), value: payload.readFloatLE(4) };
+    case KIND_INPUT_ENCODER:
+      return { type: 'device_event', event: 'input_encoder', port_id: payload.readUInt32LE(0), steps: payload.readInt32LE(4) };
+    default:
+      console.warn(`Unknown backend frame kind: ${kind}`);
+      return null;
+  }
+}
+
+function encodeFrame(command: object): Buffer {
+  const payload = Buffer.from(JSON.stringify(command), 'utf8');
+  const header = Buffer.alloc(FRAME_HEADER_SIZE);
+  header.writeUInt32LE(payload.length, 0);
+  header.writeUInt8(KIND_JSON, 4);
+  return Buffer.concat([header, payload]);
+}
+
+// Splits stdout chunks into lines (json) or frames (binary). The hello reply is still a JSON
+// line, so the bytes after it are read as frames once the handshake completes.
+class BackendStdoutDecoder {
+  private buffer: Buffer = Buffer.alloc(0);
+
+  constructor(private readonly onMessage: (message: BackendResponse | string) => void) {}
+
+  push(chunk: Buffer) {
+    this.buffer = this.buffer.length ? Buffer.concat([this.buffer, chunk]) : chunk;
+    let offset = 0;
+    while (offset < this.buffer.length) {
+      if (backendProtocol === 'binary') {
+        if (this.buffer.length - offset < FRAME_HEADER_SIZE) {
+          break;
+        }
+        const length = this.buffer.readUInt32LE(offset);
+        const end = offset + FRAME_HEADER_SIZE + length;
+        if (this.buffer.length < end) {
+          break;
+        }
+        const kind = this.buffer.readUInt8(offset + 4);
+        try {
+          const message = decodeFrame(kind, this.buffer.subarray(offset + FRAME_HEADER_SIZE, end));
+          if (message) {
+            this.onMessage(message);
+          }
+        } catch (error) {
+          console.warn('Failed to decode backend frame:', error);
+        }
+        offset = end;
+      } else {
+        const newline = this.buffer.indexOf(0x0a, offset);
+        if (newline < 0) {
+          break;
+        }
+        const line = this.buffer.toString('utf8', offset, newline).trim();
+        offset = newline + 1;
+        if (line.length > 0) {
+          this.onMessage(line);
+        }
+      }
+    }
+    this.buffer = offset >= this.buffer.length ? Buffer.alloc(0) : this.buffer.subarray(offset);
+  }
+}
 
 const VITE_DEV_SERVER_URL = process.env.VITE_DEV_SERVER_URL;
 const ICON_TARGET_SIZE = 160;
@@ -76,16 +160,13 @@ function startPythonBackend() {
     return;
   }
 
-  stdoutReader = readline.createInterface({ input: pythonProcess.stdout });
+  backendProtocol = 'json';
+  queuedCommands = [];
+  const decoder = new BackendStdoutDecoder(handleBackendMessage);
 
-  stdoutReader.on('line', (line) => {
-    const trimmed = line.trim();
-    if (trimmed.length > 0) {
-      handleBackendMessage(trimmed);
-    }
-  });
+  pythonProcess.stdout.on('data', (chunk: Buffer) => decoder.push(chunk));
 
-  stdoutReader.on('error', (err) => {
+  pythonProcess.stdout.on('error', (err) => {
     console.error('Failed to read Python stdout:', err);
     win?.webContents.send('from-backend-error', `Stdout error: ${err instanceof Error ? err.message : String(err)}`);
   });
@@ -98,8 +179,7 @@ function startPythonBackend() {
 
   pythonProcess.on('close', (code, signal) => {
     console.log(`Python process closed (code=${code}, signal=${signal ?? 'n/a'})`);
-    stdoutReader?.close();
-    stdoutReader = null;
+    handshakePending = false;
     rejectAllPending(`Python process closed (code=${code}, signal=${signal ?? 'n/a'})`);
     pythonProcess = null;
   });
@@ -107,67 +187,99 @@ function startPythonBackend() {
   pythonProcess.on('error', (error) => {
     console.error('Failed to launch Python backend:', error);
     win?.webContents.send('from-backend-error', `Python spawn error: ${error instanceof Error ? error.message : String(error)}`);
-    stdoutReader?.close();
-    stdoutReader = null;
+    handshakePending = false;
     rejectAllPending(`Python backend launch error: ${error instanceof Error ? error.message : String(error)}`);
     pythonProcess = null;
   });
+
+  if (IPC_PROTOCOL === 'binary') {
+    // Hold other commands until the backend answers the handshake.
+    handshakePending = true;
+    pythonProcess.stdin.write(JSON.stringify({ type: 'hello', protocol: IPC_PROTOCOL }) + '\n');
+  }
 }
 
 function sendToPython(command: object) {
   if (!pythonProcess || !pythonProcess.stdin) {
     throw new Error('Python process not running.');
   }
-  pythonProcess.stdin.write(JSON.stringify(command) + '\n');
+  if (handshakePending) {
+    queuedCommands.push(command);
+    return;
+  }
+  if (backendProtocol === 'binary') {
+    pythonProcess.stdin.write(encodeFrame(command));
+  } else {
+    pythonProcess.stdin.write(JSON.stringify(command) + '\n');
+  }
 }
 
-function handleBackendMessage(raw: string) {
-  win?.webContents.send('from-backend', raw);
+function completeHandshake(response: BackendResponse) {
+  if (response.status === 'success' && response.protocol === 'binary') {
+    backendProtocol = 'binary';
+  } else {
+    console.warn('Backend declined binary protocol; staying on JSON lines.', response.message ?? '');
+  }
+  handshakePending = false;
+  const queued = queuedCommands;
+  queuedCommands = [];
+  for (const command of queued) {
+    sendToPython(command);
+  }
+}
 
+function handleBackendMessage(message: BackendResponse | string) {
   let parsed: BackendResponse;
-  try {
-    parsed = JSON.parse(raw);
-  } catch (error) {
-    console.warn('Failed to parse backend message as JSON:', raw, error);
+  if (typeof message === 'string') {
+    try {
+      parsed = JSON.parse(message);
+    } catch (error) {
+      console.warn('Failed to parse backend message as JSON:', message, error);
+      win?.webContents.send('from-backend', message);
+      return;
+    }
+  } else {
+    parsed = message;
+  }
+
+  if (parsed.command === 'hello' && handshakePending) {
+    completeHandshake(parsed);
     return;
   }
 
+  // In binary mode pass the decoded object through instead of re-serializing it.
+  win?.webContents.send('from-backend', message);
+
   if (parsed.command) {
     fulfillPendingResponse(parsed);
   }
 }
 
 function fulfillPendingResponse(response: BackendResponse) {
-  if (!response.command) {
+  // Responses carry the id of their request and may arrive in any order.
+  const id = typeof response.id === 'string' ? response.id : null;
+  const pending = id ? pendingResponses.get(id) : undefined;
+  if (!id || !pending) {
     return;
   }
+  pendingResponses.delete(id);
 
-  const queue = pendingResponses.get(response.command);
-  if (!queue?.length) {
-    return;
-  }
-
-  const { resolve, reject } = queue.shift()!;
   if (response.status && response.status !== 'success') {
     const message =
       typeof response.message === 'string'
         ? response.message
         : `Backend command "${response.command}" failed`;
-    reject(new Error(message));
+    // Validation failures (save_page / save_config) list what was wrong with each entry.
+    const details = Array.isArray(response.errors) ? `: ${response.errors.join('; ')}` : '';
+    pending.reject(new Error(message + details));
   } else {
-    resolve(response);
-  }
-
-  if (queue.length === 0) {
-    pendingResponses.delete(response.command);
+    pending.resolve(response);
   }
 }
 
 function rejectAllPending(message: string) {
-  for (const queue of pendingResponses.values()) {
-    for (const pending of queue) {
-      pending.reject(new Error(message));
-    }
+  for (const pending of pendingResponses.values()) {
+    pending.reject(new Error(message));
   }
   pendingResponses.clear();
 }
@@ -182,28 +294,33 @@ function requestBackend<TResult extends BackendResponse>(
       return;
     }
 
-    const queue = pendingResponses.get(expectedCommand) ?? [];
-    const pending: PendingRequest = {
+    const id = `req-${nextRequestId++}`;
+    pendingResponses.set(id, {
+      command: expectedCommand,
       resolve: (response) => resolve(response as TResult),
       reject,
-    };
-    queue.push(pending);
-    pendingResponses.set(expectedCommand, queue);
+    });
 
     try {
-      sendToPython(payload);
+      sendToPython({ ...payload, id });
     } catch (error) {
-      queue.pop();
-      if (queue.length === 0) {
-        pendingResponses.delete(expectedCommand);
-      } else {
-        pendingResponses.set(expectedCommand, queue);
-      }
+      pendingResponses.delete(id);
       reject(error as Error);
     }
   });
 }
 
+function cancelBackendRequests(command: string): number {
+  let cancelled = 0;
+  for (const [id, pending] of pendingResponses) {
+    if (pending.command === command) {
+      sendToPython({ type: 'cancel', target: id });
+      cancelled += 1;
+    }
+  }
+  return cancelled;
+}
+
 app.on('window-all-closed', () => {
   if (process.platform !== 'darwin') {
     if (pythonProcess) {
@@ -252,14 +369,13 @@ app.whenReady().then(async () => {
   });
 
   ipcMain.handle('config:save', async (event, config: any) => {
-    // This is a fire-and-forget operation from the UI's perspective,
-    // but we can still check for a backend confirmation.
-    try {
-      sendToPython({ type: 'save_config', config });
-    } catch (error) {
-      console.error('Failed to send save_config to backend', error);
-      throw error;
-    }
+    // The backend rejects configs with invalid actions; the error reaches the renderer as a rejected invoke.
+    await requestBackend({ type: 'save_config', config }, 'save_config');
+  });
+
+  ipcMain.handle('config:save_page', async (event, page: number | string, cells: unknown[]) => {
+    // Saving a single page keeps the cost of an edit independent of the number of pages.
+    await requestBackend({ type: 'save_page', page: String(page), cells }, 'save_page');
   });
 
   ipcMain.handle('config:set_page', async (event, page: number) => {
@@ -377,4 +493,6 @@ app.whenReady().then(async () => {
     await requestBackend(command, 'send_image');
   });
 
+  ipcMain.handle('image:cancel_uploads', async () => cancelBackendRequests('send_image'));
+
 });
@@ -8,8 +8,16 @@ import { useCallback, useEffect, useRef, useState } from 'react';
 interface CellConfig {
   icon: string | null;
   action: string;
+  // Optional long-press / double-tap / turbo settings, edited in gui_config.json and kept as-is
+  long_press?: string;
+  double_tap?: string;
+  turbo?: number;
+  long_press_ms?: number;
+  double_tap_ms?: number;
 }
 
+const GESTURE_FIELDS = ['long_press', 'double_tap', 'turbo', 'long_press_ms', 'double_tap_ms'] as const;
+
 interface PageConfigs {
   [page: string]: CellConfig[];
 }
@@ -29,10 +37,16 @@ const sanitizePageConfigs = (config: PageConfigs): PageConfigs => {
       const cell = cells?.[index];
       const icon = typeof cell?.icon === 'string' ? cell.icon : null;
       const safeIcon = icon && (icon.startsWith('data:') || isLikelyAbsolutePath(icon)) ? icon : null;
-      return {
+      const sanitizedCell: CellConfig = {
         icon: safeIcon,
         action: typeof cell?.action === 'string' ? cell.action : '',
       };
+      for (const field of GESTURE_FIELDS) {
+        if (cell?.[field] !== undefined) {
+          Object.assign(sanitizedCell, { [field]: cell[field] });
+        }
+      }
+      return sanitizedCell;
     });
   }
   return sanitized;
@@ -49,6 +63,7 @@ function App() {
   const [pageConfigs, setPageConfigs] = useState<PageConfigs>({});
   const [editingCell, setEditingCell] = useState<{page: number, index: number} | null>(null);
   const [editingAction, setEditingAction] = useState<string>('');
+  const [saveError, setSaveError] = useState<string | null>(null);
   const [hasIpc, setHasIpc] = useState<boolean>(() => typeof window !== 'undefined' && Boolean(window.ipcRenderer));
   const warnedMessages = useRef<Set<string>>(new Set());
   const portStatusMessage = hasIpc
@@ -75,14 +90,29 @@ const createUploadPayload = useCallback((screenId: number, cell: CellConfig, tar
   return { screenId, page: targetPage, clear: true };
 }, []);
 
+// Bumped whenever a running icon sync should stop (a newer sync, a page change or a disconnect).
+const syncGenerationRef = useRef(0);
+
+const cancelIconSync = useCallback(async () => {
+  syncGenerationRef.current += 1;
+  if (hasIpc && window.ipcRenderer) {
+    // Drop uploads still queued in the backend so they do not hold up the next page or the disconnect.
+    await window.ipcRenderer.invoke('image:cancel_uploads');
+  }
+}, [hasIpc]);
+
 const syncPageIcons = useCallback(
   async (targetPage: number, override?: CellConfig[]) => {
       if (!hasIpc || !isConnected || !window.ipcRenderer) {
         return;
       }
+      const generation = ++syncGenerationRef.current;
       const configs = override ?? pageConfigs[targetPage] ?? [];
       const totalCells = Math.max(configs.length, 18);
       for (let index = 0; index < totalCells; index += 1) {
+        if (syncGenerationRef.current !== generation) {
+          return;
+        }
         const cell = configs[index] ?? { icon: null, action: '' };
         const payload = createUploadPayload(index, cell, targetPage);
         if (!payload) {
@@ -91,6 +121,9 @@ const syncPageIcons = useCallback(
         try {
           await window.ipcRenderer.invoke('image:upload', payload);
         } catch (err) {
+          if (syncGenerationRef.current !== generation) {
+            return; // Cancelled
+          }
           console.error(`Failed to upload image for screen ${index} on page ${targetPage}:`, err);
         }
       }
@@ -203,11 +236,12 @@ const syncPageIcons = useCallback(
 
     // Listener for backend events
     const handleBackendEvent = (_event: unknown, raw: unknown) => {
-      if (typeof raw !== 'string') {
+      // JSON lines arrive as strings; the binary protocol delivers decoded objects.
+      if (typeof raw !== 'string' && (typeof raw !== 'object' || raw === null)) {
         return;
       }
       try {
-        const response = JSON.parse(raw);
+        const response = typeof raw === 'string' ? JSON.parse(raw) : (raw as Record<string, any>);
         if (response.type === 'device_event') {
           if (response.event === 'input_digital' && response.state === true) {
             const portId = response.port_id;
@@ -238,6 +272,18 @@ const syncPageIcons = useCallback(
     void syncPageIcons(page);
   }, [isConnected, page, syncPageIcons]);
 
+  useEffect(() => {
+    if (!isConnected) {
+      return;
+    }
+    // Leaving a page: its remaining icons are no longer worth sending.
+    return () => {
+      cancelIconSync().catch((err: Error) => {
+        console.error('Failed to cancel icon uploads:', err);
+      });
+    };
+  }, [isConnected, page, cancelIconSync]);
+
   const handleConnect = async () => {
     if (!hasIpc) {
       warnOnce('ipcRenderer not available; cannot connect to device.');
@@ -259,6 +305,7 @@ const syncPageIcons = useCallback(
       return;
     }
     try {
+      await cancelIconSync();
       await window.ipcRenderer!.invoke('serial:disconnect');
       setIsConnected(false);
     } catch (err) {
@@ -267,6 +314,28 @@ const syncPageIcons = useCallback(
   };
 
 
+  // The backend validates each page before storing it. On rejection, put the page back the way it was so
+  // the grid does not show an edit that will be gone after a reload.
+  const savePage = (targetPage: number, cells: CellConfig[], previousCells: CellConfig[] | undefined) => {
+    setSaveError(null);
+    window.ipcRenderer!.invoke('config:save_page', targetPage, cells).catch((err: Error) => {
+      console.error(`Failed to save page ${targetPage}:`, err);
+      setSaveError(`Page ${targetPage} was not saved: ${err.message}`);
+      setPageConfigs((current) => {
+        if (current[targetPage] !== cells) {
+          return current; // Edited again since; that save reports its own result.
+        }
+        const restored = { ...current };
+        if (previousCells) {
+          restored[targetPage] = previousCells;
+        } else {
+          delete restored[targetPage];
+        }
+        return restored;
+      });
+    });
+  };
+
   const handleIconDrop = (index: number, payload: DroppedIconPayload) => {
     const { dataUrl, filePath } = payload;
     const absolutePath = filePath && isLikelyAbsolutePath(filePath) ? filePath : null;
@@ -287,7 +356,7 @@ const syncPageIcons = useCallback(
     const sanitizedConfigs = sanitizePageConfigs(newConfigs);
     setPageConfigs(sanitizedConfigs);
     if (hasIpc) {
-      window.ipcRenderer!.invoke('config:save', sanitizedConfigs);
+      savePage(page, sanitizedConfigs[page], pageConfigs[page]);
       if (isConnected) {
         const cell = sanitizedConfigs[page]?.[index];
         const payload = cell ? createUploadPayload(index, cell, page) : null;
@@ -316,7 +385,7 @@ const syncPageIcons = useCallback(
     const sanitizedConfigs = sanitizePageConfigs(newConfigs);
     setPageConfigs(sanitizedConfigs);
     if (hasIpc) {
-      window.ipcRenderer!.invoke('config:save', sanitizedConfigs);
+      savePage(currentPage, sanitizedConfigs[currentPage], pageConfigs[currentPage]);
       if (isConnected) {
         const cell = sanitizedConfigs[currentPage]?.[index] ?? { icon: null, action: '' };
         const payload = createUploadPayload(index, cell, currentPage);
@@ -346,7 +415,7 @@ const syncPageIcons = useCallback(
     const sanitizedConfigs = sanitizePageConfigs(newConfigs);
     setPageConfigs(sanitizedConfigs);
     if (hasIpc) {
-      window.ipcRenderer!.invoke('config:save', sanitizedConfigs);
+      savePage(editingCell.page, sanitizedConfigs[editingCell.page], pageConfigs[editingCell.page]);
     }
     setEditingCell(null);
   };
@@ -436,6 +505,9 @@ const syncPageIcons = useCallback(
             <IconButton size="small" onClick={handleNextPage} disabled={page >= totalPages}>
                 <ArrowForwardIosIcon fontSize="inherit" />
             </IconButton>
+            {saveError && (
+              <Typography variant="body2" color="error">{saveError}</Typography>
+            )}
         </Stack>
       </Box>
 
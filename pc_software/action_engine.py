@@ -0,0 +1,668 @@
+"""
+マッピング文字列 ("ctrl+c" など) を読み込み時にコンパイルし、
+そのまま実行できるアクションオブジェクトに変換するエンジン。
+
+Joy-Con サーバー (main.py)、M5Tab バックエンド (backend.py)、
+M5Tab 設定GUI (gui.py) の3つのエントリーポイントで共通に使用する。
+ホットパスでは文字列の分割やキー名の解決を一切行わず、
+コンパイル済みのテーブルを引いて press/release を呼ぶだけにする。
+
+アクションには文字列のほかに、マクロ (文字列と待ち時間msのリスト) と、
+長押し・ダブルタップ・連射を持つオブジェクトを指定できる。これらの時間管理は
+set_timer_wheel() で設定した TimerWheel が行う。
+"""
+import math
+import time
+
+import startup_timing
+from mouse_motion import ACCELERATION_CURVES
+from rumble import RUMBLE_PATTERNS
+
+# 文字列をpynputのKeyオブジェクトに変換するためのマップ。
+# pynput の import は数十ミリ秒以上かかるため、最初にキー名を解決するときに作る。
+Key = None
+_key_map = None
+
+
+def _load_key_map():
+    global _key_map, Key
+    Key = startup_timing.import_module('pynput.keyboard').Key
+    _key_map = {
+        'alt': Key.alt, 'alt_l': Key.alt_l, 'alt_r': Key.alt_r,
+        'alt_gr': Key.alt_gr,
+        'backspace': Key.backspace,
+        'caps_lock': Key.caps_lock,
+        'cmd': Key.cmd, 'cmd_l': Key.cmd_l, 'cmd_r': Key.cmd_r,
+        'ctrl': Key.ctrl, 'ctrl_l': Key.ctrl_l, 'ctrl_r': Key.ctrl_r,
+        'delete': Key.delete,
+        'down': Key.down,
+        'end': Key.end,
+        'enter': Key.enter,
+        'esc': Key.esc,
+        'f1': Key.f1, 'f2': Key.f2, 'f3': Key.f3, 'f4': Key.f4,
+        'f5': Key.f5, 'f6': Key.f6, 'f7': Key.f7, 'f8': Key.f8,
+        'f9': Key.f9, 'f10': Key.f10, 'f11': Key.f11, 'f12': Key.f12,
+        'home': Key.home,
+        'left': Key.left,
+        'page_down': Key.page_down,
+        'page_up': Key.page_up,
+        'right': Key.right,
+        'shift': Key.shift, 'shift_l': Key.shift_l, 'shift_r': Key.shift_r,
+        'space': Key.space,
+        'tab': Key.tab,
+        'up': Key.up,
+        'insert': Key.insert,
+        'menu': Key.menu,
+        'num_lock': Key.num_lock,
+        'pause': Key.pause,
+        'print_screen': Key.print_screen,
+        'scroll_lock': Key.scroll_lock,
+    }
+    return _key_map
+
+
+STICK_MODES = ('none', 'mouse', '8way', 'dial', 'gyro')
+STICK_DIRECTIONS = ('up', 'up_right', 'right', 'down_right', 'down', 'down_left', 'left', 'up_left')
+DIAL_SECTORS = ('up', 'down', 'left', 'right')
+DEFAULT_MOUSE_SENSITIVITY = 25
+RUMBLE_PREFIX = 'rumble'
+DEFAULT_RUMBLE_PATTERN = 'pulse'
+
+GESTURE_FIELDS = ('long_press', 'double_tap', 'turbo', 'long_press_ms', 'double_tap_ms')
+DEFAULT_LONG_PRESS_MS = 500
+DEFAULT_DOUBLE_TAP_MS = 250
+MAX_TURBO_RATE = 50  # 連射の最大レート (回/秒)
+
+ENCODERS_KEY = 'encoders'        # gui_config.json 内のエンコーダー設定のキー
+DEFAULT_ENCODER_RATE = 40        # エンコーダー1つが出すアクションの最大レート (回/秒)
+DEFAULT_ENCODER_MAX_PENDING = 8  # 出力が追いつかないときに溜めておくステップ数の上限
+ENCODER_SPEED_SMOOTHING = 0.1    # 回転速度の平滑化の時定数 (秒)
+ENCODER_REFERENCE_SPEED = 20.0   # acceleration 1 でステップが2倍になる回転速度 (ステップ/秒)
+
+# 振動アクションの再生先 (Joy-Conサーバーが起動時に RumblePlayer を設定する)
+_rumble_player = None
+
+
+# マクロ・長押し・ダブルタップ・連射のタイマー (各エントリーポイントが起動時に設定する)
+_timer_wheel = None
+# デバイスID -> 状態を持っている GestureAction の集合 (切断時にタイマーを止めるため)
+_gesture_devices = {}
+
+
+def set_rumble_player(player):
+    global _rumble_player
+    _rumble_player = player
+
+
+def set_timer_wheel(wheel):
+    global _timer_wheel
+    _timer_wheel = wheel
+
+
+def cancel_gestures(device_id):
+    """デバイスの長押し・ダブルタップ・連射の待ち状態をすべて破棄する (切断・マッピング変更時)"""
+    wheel = _timer_wheel
+    if wheel is None:
+        return
+    with wheel.lock:
+        for action in _gesture_devices.pop(device_id, ()):
+            action.cancel(device_id)
+
+
+class MappingError(ValueError):
+    """マッピング文字列が解釈できない場合に送出される"""
+
+
+def resolve_key(token):
+    """キー名1つをpynputのKeyオブジェクトまたは1文字に解決する"""
+    name = token.lower()
+    key = (_key_map or _load_key_map()).get(name)
+    if key is None:
+        key = getattr(Key, name, None)
+    if isinstance(key, Key):
+        return key
+    if len(token) == 1:
+        return token
+    raise MappingError(f"Unknown key: '{token}'")
+
+
+def parse_key_sequence(action_string):
+    """"ctrl+shift+s" のような文字列を押下順のキーのタプルに変換する"""
+    text = action_string.strip()
+    if not text:
+        raise MappingError("Empty key sequence")
+    if text == '+':
+        return ('+',)
+    tokens = [t.strip() for t in text.split('+')]
+    if text.endswith('++'):
+        # "ctrl++" は ctrl と '+' の同時押しとして扱う
+        tokens = tokens[:-2] + ['+']
+    if any(not t for t in tokens):
+        raise MappingError(f"Invalid key sequence: '{action_string}'")
+    return tuple(resolve_key(t) for t in tokens)
+
+
+class KeyAction:
+    """コンパイル済みのキー操作。press/release/tap を出力先に対して即座に実行する。"""
+    __slots__ = ('source', 'keys', '_release_order')
+    tap_on_press = True  # M5Tab のポートでは押したときに tap する
+
+    def __init__(self, source, keys):
+        self.source = source
+        self.keys = keys
+        self._release_order = tuple(reversed(keys))
+
+    def press(self, output, device_id=None):
+        for key in self.keys:
+            output.press(key)
+
+    def release(self, output, device_id=None):
+        for key in self._release_order:
+            output.release(key)
+
+    def tap(self, output, device_id=None):
+        self.press(output)
+        self.release(output)
+
+    def __repr__(self):
+        return f"KeyAction({self.source!r})"
+
+
+class RumbleAction:
+    """"rumble" / "rumble:<パターン名>" で指定する、押したデバイスを振動させるアクション"""
+    __slots__ = ('source', 'pattern')
+    tap_on_press = True
+
+    def __init__(self, source, pattern):
+        self.source = source
+        self.pattern = pattern
+
+    def press(self, output, device_id=None):
+        if _rumble_player is not None and device_id is not None:
+            _rumble_player.play(device_id, self.pattern)
+
+    def release(self, output, device_id=None):
+        pass
+
+    def tap(self, output, device_id=None):
+        self.press(output, device_id)
+
+    def __repr__(self):
+        return f"RumbleAction({self.source!r})"
+
+
+class MacroAction:
+    """アクションと待ち時間の列。押したときに順番に tap し、待ち時間はタイマーホイールで待つ。"""
+    __slots__ = ('source', 'steps')
+    tap_on_press = True
+
+    def __init__(self, source, steps):
+        self.source = source
+        self.steps = steps  # ((待ち秒, None) or (0, アクション), ...)
+
+    def press(self, output, device_id=None):
+        self._run(output, device_id, 0, False)
+
+    def release(self, output, device_id=None):
+        pass
+
+    def tap(self, output, device_id=None):
+        self.press(output, device_id)
+
+    def _run(self, output, device_id, index, from_timer):
+        steps = self.steps
+        while index < len(steps):
+            wait, action = steps[index]
+            index += 1
+            if action is not None:
+                action.tap(output, device_id)
+            elif _timer_wheel is not None:
+                _timer_wheel.schedule(wait, self._run, output, device_id, index, True)
+                break
+        if from_timer:
+            output.flush()
+
+    def __repr__(self):
+        return f"MacroAction({self.source!r})"
+
+
+class _GestureState:
+    __slots__ = ('long_fired', 'consumed', 'long_timer', 'tap_timer', 'turbo_timer')
+
+    def __init__(self):
+        self.long_fired = False
+        self.consumed = False    # ダブルタップで消費した押下 (離したときに何もしない)
+        self.long_timer = None
+        self.tap_timer = None    # ダブルタップ待ちの単発タップ
+        self.turbo_timer = None
+
+
+class GestureAction:
+    """
+    長押し・ダブルタップ・連射を認識するアクション。押下と解放の両方のエッジが必要。
+    - long_press: long_press_sec 以上押し続けたら long_press を tap し、離したときの tap は行わない
+    - double_tap: 離してから double_tap_sec 以内に再び押したら double_tap を tap する
+      (単発の tap はその時間が過ぎてから行う)
+    - turbo: 押している間 action を一定間隔で tap し続ける
+    """
+    __slots__ = ('source', 'action', 'long_press', 'double_tap', 'long_press_sec', 'double_tap_sec',
+                 'turbo_interval', '_states')
+    tap_on_press = False
+
+    def __init__(self, source, action, long_press=None, double_tap=None, turbo_rate=None,
+                 long_press_sec=DEFAULT_LONG_PRESS_MS / 1000, double_tap_sec=DEFAULT_DOUBLE_TAP_MS / 1000):
+        self.source = source
+        self.action = action
+        self.long_press = long_press
+        self.double_tap = double_tap
+        self.long_press_sec = long_press_sec
+        self.double_tap_sec = double_tap_sec
+        self.turbo_interval = 1.0 / turbo_rate if turbo_rate else None
+        self._states = {}  # デバイスID -> _GestureState
+
+    def press(self, output, device_id=None):
+        wheel = _timer_wheel
+        if wheel is None:
+            # タイマーが無い環境では通常のアクションとして振る舞う
+            if self.action:
+                self.action.press(output, device_id)
+            return
+        with wheel.lock:
+            state = self._states.get(device_id)
+            if state is None:
+                state = self._states[device_id] = _GestureState()
+                _gesture_devices.setdefault(device_id, set()).add(self)
+
+            if state.tap_timer is not None:
+                # 単発タップの待ち中に押された -> ダブルタップ
+                state.tap_timer.cancel()
+                state.tap_timer = None
+                state.consumed = True
+                self.double_tap.tap(output, device_id)
+                return
+
+            state.consumed = False
+            state.long_fired = False
+            if self.turbo_interval is not None:
+                self.action.tap(output, device_id)
+                state.turbo_timer = wheel.schedule(self.turbo_interval, self._repeat, output, device_id, state)
+            elif self.long_press is not None:
+                state.long_timer = wheel.schedule(self.long_press_sec, self._fire_long, output, device_id, state)
+
+    def release(self, output, device_id=None):
+        wheel = _timer_wheel
+        if wheel is None:
+            if self.action:
+                self.action.release(output, device_id)
+            return
+        with wheel.lock:
+            state = self._states.get(device_id)
+            if state is None or state.consumed:
+                return
+            if state.turbo_timer is not None:
+                state.turbo_timer.cancel()
+                state.turbo_timer = None
+                return
+            if state.long_timer is not None:
+                state.long_timer.cancel()
+                state.long_timer = None
+            if state.long_fired:
+                return
+            if self.double_tap is not None:
+                state.tap_timer = wheel.schedule(self.double_tap_sec, self._fire_tap, output, device_id, state)
+            elif self.action:
+                self.action.tap(output, device_id)
+
+    def tap(self, output, device_id=None):
+        self.press(output, device_id)
+        self.release(output, device_id)
+
+    def cancel(self, device_id):
+        state = self._states.pop(device_id, None)
+        if state is None:
+            return
+        for timer in (state.long_timer, state.tap_timer, state.turbo_timer):
+            if timer is not None:
+                timer.cancel()
+
+    # --- タイマーホイールから呼ばれる ---
+    def _fire_long(self, output, device_id, state):
+        state.long_timer = None
+        state.long_fired = True
+        self.long_press.tap(output, device_id)
+        output.flush()
+
+    def _fire_tap(self, output, device_id, state):
+        state.tap_timer = None
+        if self.action:
+            self.action.tap(output, device_id)
+            output.flush()
+
+    def _repeat(self, output, device_id, state):
+        if state.turbo_timer is None:
+            return
+        self.action.tap(output, device_id)
+        output.flush()
+        state.turbo_timer = _timer_wheel.schedule(self.turbo_interval, self._repeat, output, device_id, state)
+
+    def __repr__(self):
+        return f"GestureAction({self.source!r})"
+
+
+def _parse_rumble_action(action_string):
+    name, _, pattern = action_string.strip().partition(':')
+    if name.strip().lower() != RUMBLE_PREFIX:
+        return None
+    pattern = pattern.strip() or DEFAULT_RUMBLE_PATTERN
+    if pattern not in RUMBLE_PATTERNS:
+        raise MappingError(f"Unknown rumble pattern: '{pattern}'")
+    return RumbleAction(action_string, pattern)
+
+
+def _compile_macro(steps):
+    compiled = []
+    for i, step in enumerate(steps):
+        if isinstance(step, bool) or not isinstance(step, (str, int, float)):
+            raise MappingError(f"Macro step {i} must be an action string or a wait in ms")
+        if isinstance(step, str):
+            action = compile_action(step)
+            if action is None:
+                raise MappingError(f"Macro step {i} is empty")
+            compiled.append((0, action))
+        elif step < 0:
+            raise MappingError(f"Macro step {i}: wait must not be negative")
+        elif step > 0:
+            compiled.append((step / 1000.0, None))
+    if not compiled:
+        return None
+    return MacroAction(repr(steps), tuple(compiled))
+
+
+def _positive_number(spec, name, default):
+    value = spec.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+        raise MappingError(f"'{name}' must be a positive number")
+    return value
+
+
+def _compile_gesture(spec):
+    unknown = [k for k in spec if k != 'action' and k not in GESTURE_FIELDS]
+    if unknown:
+        raise MappingError(f"Unknown action option: '{unknown[0]}'")
+    parts = {}
+    for name in ('action', 'long_press', 'double_tap'):
+        value = spec.get(name)
+        if value is not None and not isinstance(value, (str, list)):
+            raise MappingError(f"'{name}' must be an action string or a macro list")
+        parts[name] = compile_action(value)
+    turbo = _positive_number(spec, 'turbo', None) if spec.get('turbo') is not None else None
+    if turbo is not None:
+        if turbo > MAX_TURBO_RATE:
+            raise MappingError(f"'turbo' must be at most {MAX_TURBO_RATE} per second")
+        if parts['action'] is None:
+            raise MappingError("'turbo' requires an action")
+        if parts['long_press'] or parts['double_tap']:
+            raise MappingError("'turbo' cannot be combined with long_press or double_tap")
+    if not (turbo or parts['long_press'] or parts['double_tap']):
+        return parts['action']
+    return GestureAction(
+        repr(spec), parts['action'], parts['long_press'], parts['double_tap'], turbo,
+        _positive_number(spec, 'long_press_ms', DEFAULT_LONG_PRESS_MS) / 1000.0,
+        _positive_number(spec, 'double_tap_ms', DEFAULT_DOUBLE_TAP_MS) / 1000.0,
+    )
+
+
+def compile_action(action_string):
+    """
+    マッピングをアクションにコンパイルする。未設定(空文字/None)の場合はNoneを返す。
+    文字列のほか、マクロのリストと、長押し・ダブルタップ・連射を指定するオブジェクトを受け付ける。
+    """
+    if action_string is None:
+        return None
+    if isinstance(action_string, list):
+        return _compile_macro(action_string)
+    if isinstance(action_string, dict):
+        return _compile_gesture(action_string)
+    if not isinstance(action_string, str):
+        raise MappingError(f"Action must be a string, a macro list or an object, got {type(action_string).__name__}")
+    if not action_string.strip():
+        return None
+    rumble_action = _parse_rumble_action(action_string)
+    if rumble_action is not None:
+        return rumble_action
+    return KeyAction(action_string, parse_key_sequence(action_string))
+
+
+def _compile_into(errors, where, action_string):
+    try:
+        return compile_action(action_string)
+    except MappingError as e:
+        errors.append(f"{where}: {e}")
+        return None
+
+
+# --- Joy-Con マッピング ---
+class StickBinding:
+    """スティック1本分のコンパイル済み設定"""
+    __slots__ = ('mode', 'sensitivity', 'curve_exponent', 'directions', 'dials')
+
+    def __init__(self, mode='none', sensitivity=DEFAULT_MOUSE_SENSITIVITY, directions=None, dials=None, curve_exponent=1.0):
+        self.mode = mode
+        self.sensitivity = sensitivity
+        self.curve_exponent = curve_exponent  # mouse: 加速カーブの指数 (1.0 = 線形)
+        self.directions = directions or {}  # 8way: 方向 -> アクション
+        self.dials = dials or {}            # dial: セクター -> (increase, decrease)
+
+
+class JoyConBindings:
+    """Joy-Con 1台分のコンパイル済みマッピング"""
+    __slots__ = ('buttons', 'sticks')
+
+    def __init__(self, buttons=None, sticks=None):
+        self.buttons = buttons or {}  # ボタン名 -> アクション
+        self.sticks = sticks or {}    # 'stick_l' / 'stick_r' -> StickBinding
+
+
+EMPTY_JOYCON_BINDINGS = JoyConBindings()
+NO_STICK = StickBinding()
+
+
+def _compile_stick(errors, where, stick_config):
+    # 設定の形式をチェック（古い形式は文字列、新しい形式は辞書）
+    if isinstance(stick_config, str):
+        stick_config = {'mode': stick_config}
+    elif not isinstance(stick_config, dict):
+        errors.append(f"{where}: stick config must be a string or an object")
+        return NO_STICK
+
+    mode = stick_config.get('mode', 'none')
+    if mode not in STICK_MODES:
+        errors.append(f"{where}: unknown stick mode '{mode}'")
+        return NO_STICK
+
+    sensitivity = stick_config.get('sensitivity', DEFAULT_MOUSE_SENSITIVITY)
+    if not isinstance(sensitivity, (int, float)) or isinstance(sensitivity, bool):
+        errors.append(f"{where}: sensitivity must be a number")
+        sensitivity = DEFAULT_MOUSE_SENSITIVITY
+
+    # 加速カーブはプリセット名か指数を直接指定する
+    curve = stick_config.get('curve', 'linear')
+    if isinstance(curve, str) and curve in ACCELERATION_CURVES:
+        curve_exponent = ACCELERATION_CURVES[curve]
+    elif isinstance(curve, (int, float)) and not isinstance(curve, bool) and curve > 0:
+        curve_exponent = float(curve)
+    else:
+        errors.append(f"{where}: unknown acceleration curve '{curve}'")
+        curve_exponent = 1.0
+
+    directions = {}
+    for direction, action_string in (stick_config.get('mappings') or {}).items():
+        if direction not in STICK_DIRECTIONS:
+            errors.append(f"{where}.mappings: unknown direction '{direction}'")
+            continue
+        action = _compile_into(errors, f"{where}.mappings.{direction}", action_string)
+        if action:
+            directions[direction] = action
+
+    dials = {}
+    for sector, dial_config in (stick_config.get('dials') or {}).items():
+        if sector not in DIAL_SECTORS:
+            errors.append(f"{where}.dials: unknown sector '{sector}'")
+            continue
+        if not isinstance(dial_config, dict):
+            errors.append(f"{where}.dials.{sector}: must be an object")
+            continue
+        increase = _compile_into(errors, f"{where}.dials.{sector}.increase", dial_config.get('increase'))
+        decrease = _compile_into(errors, f"{where}.dials.{sector}.decrease", dial_config.get('decrease'))
+        if increase or decrease:
+            dials[sector] = (increase, decrease)
+
+    return StickBinding(mode, sensitivity, directions, dials, curve_exponent)
+
+
+def compile_joycon_mapping(device_mapping, where='mapping'):
+    """Joy-Con 1台分のマッピング辞書をコンパイルし、(JoyConBindings, エラー一覧) を返す"""
+    errors = []
+    if not isinstance(device_mapping, dict):
+        return EMPTY_JOYCON_BINDINGS, [f"{where}: mapping must be an object"]
+
+    buttons = {}
+    sticks = {}
+    for name, value in device_mapping.items():
+        if name in ('stick_l', 'stick_r'):
+            sticks[name] = _compile_stick(errors, f"{where}.{name}", value)
+            continue
+        action = _compile_into(errors, f"{where}.{name}", value)
+        if action:
+            buttons[name] = action
+    return JoyConBindings(buttons, sticks), errors
+
+
+# --- M5Tab ページ設定 ---
+def compile_page_actions(page_configs, port_count=18):
+    """
+    M5Tab のページ設定 ({ページ: [{'action': ...}, ...]}) をコンパイルし、
+    (ページ -> port_id で引けるアクションのリスト, エラー一覧) を返す。
+    """
+    errors = []
+    compiled = {}
+    for page, cells in page_configs.items():
+        table = [None] * port_count
+        for port_id, cell in enumerate(cells[:port_count]):
+            action_string = cell.get('action') if isinstance(cell, dict) else None
+            if isinstance(cell, dict) and any(name in cell for name in GESTURE_FIELDS):
+                # 長押し・ダブルタップ・連射はセルに直接書く
+                action_string = dict({n: cell[n] for n in GESTURE_FIELDS if n in cell}, action=action_string)
+            table[port_id] = _compile_into(errors, f"page {page} port {port_id}", action_string)
+        compiled[page] = table
+    return compiled, errors
+
+
+# --- M5Tab エンコーダー ---
+class EncoderBinding:
+    """
+    エンコーダー1つ分のコンパイル済み設定と状態。
+    受け取ったステップは回転速度に応じて加速し、未処理のステップとして溜める。
+    アクションは最大 max_rate 回/秒でタイマーホイールから出し、溜まりすぎた分は
+    max_pending に切り詰める (速く回しても注入が溢れない)。
+    """
+    __slots__ = ('source', 'increase', 'decrease', 'acceleration', 'interval', 'max_pending',
+                 '_pending', '_speed', '_last', '_timer', 'coalesced')
+
+    def __init__(self, source, increase, decrease, acceleration=0.0,
+                 max_rate=DEFAULT_ENCODER_RATE, max_pending=DEFAULT_ENCODER_MAX_PENDING):
+        self.source = source
+        self.increase = increase
+        self.decrease = decrease
+        self.acceleration = acceleration
+        self.interval = 1.0 / max_rate
+        self.max_pending = max_pending
+        self._pending = 0.0   # 未処理のステップ (加速後、小数を含む)
+        self._speed = 0.0     # 平滑化した回転速度 (ステップ/秒)
+        self._last = None
+        self._timer = None
+        self.coalesced = 0    # 切り詰めたステップ数
+
+    def steps(self, output, steps, now=None, device_id=None):
+        """InputEncoder のステップを受け取る (入力スレッドから呼ばれる、待たない)"""
+        wheel = _timer_wheel
+        if wheel is None:
+            self._apply(output, steps, time.monotonic() if now is None else now, device_id)
+            return
+        with wheel.lock:
+            self._apply(output, steps, wheel.clock() if now is None else now, device_id)
+
+    def _apply(self, output, steps, now, device_id):
+        if not steps:
+            return
+        if self._last is not None:
+            dt = max(now - self._last, 1e-3)
+            weight = min(1.0, dt / ENCODER_SPEED_SMOOTHING)
+            self._speed += (abs(steps) / dt - self._speed) * weight
+        self._last = now
+
+        if self._pending and (self._pending > 0) != (steps > 0):
+            self._pending = 0.0  # 回転方向が変わったら溜まっている分は捨てる
+        self._pending += steps * (1.0 + self.acceleration * self._speed / ENCODER_REFERENCE_SPEED)
+        if abs(self._pending) > self.max_pending:
+            self.coalesced += int(abs(self._pending) - self.max_pending)
+            self._pending = math.copysign(self.max_pending, self._pending)
+
+        if self._timer is None:
+            self._drain(output, device_id, False)
+
+    def _drain(self, output, device_id, from_timer):
+        self._timer = None
+        pending = self._pending
+        if abs(pending) < 1.0:
+            return
+        action = self.increase if pending > 0 else self.decrease
+        self._pending -= math.copysign(1.0, pending)
+        if action:
+            action.tap(output, device_id)
+            if from_timer:
+                output.flush()
+        if abs(self._pending) >= 1.0:
+            if _timer_wheel is None:
+                # タイマーが無い環境では残りをまとめて出す
+                self._drain(output, device_id, from_timer)
+            else:
+                self._timer = _timer_wheel.schedule(self.interval, self._drain, output, device_id, True)
+
+    def __repr__(self):
+        return f"EncoderBinding({self.source!r})"
+
+
+def compile_encoder_bindings(encoder_configs):
+    """
+    エンコーダー設定 ({port_id: {'increase', 'decrease', 'acceleration', 'max_rate', 'max_pending'}}) を
+    コンパイルし、(port_id -> EncoderBinding, エラー一覧) を返す。
+    """
+    errors = []
+    bindings = {}
+    if not isinstance(encoder_configs, dict):
+        return bindings, [f"{ENCODERS_KEY}: must be an object"]
+    for port, config in encoder_configs.items():
+        where = f"encoder {port}"
+        try:
+            port_id = int(port)
+        except (TypeError, ValueError):
+            errors.append(f"{where}: port must be a number")
+            continue
+        if not isinstance(config, dict):
+            errors.append(f"{where}: must be an object")
+            continue
+        increase = _compile_into(errors, f"{where}.increase", config.get('increase'))
+        decrease = _compile_into(errors, f"{where}.decrease", config.get('decrease'))
+        try:
+            acceleration = config.get('acceleration', 0.0)
+            if isinstance(acceleration, bool) or not isinstance(acceleration, (int, float)) or acceleration < 0:
+                raise MappingError("'acceleration' must be a non-negative number")
+            max_rate = _positive_number(config, 'max_rate', DEFAULT_ENCODER_RATE)
+            max_pending = _positive_number(config, 'max_pending', DEFAULT_ENCODER_MAX_PENDING)
+        except MappingError as e:
+            errors.append(f"{where}: {e}")
+            continue
+        if increase or decrease:
+            bindings[port_id] = EncoderBinding(where, increase, decrease, float(acceleration), max_rate, max_pending)
+    return bindings, errors
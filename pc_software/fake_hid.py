@@ -0,0 +1,188 @@
+"""
+実機なしで Joy-Con を N 台つないだ状態を再現する、hidapi (hid モジュール) 互換の偽バックエンド。
+
+install() で sys.modules['hid'] を置き換えると、main.py のディスカバリーと入力ループは
+この模擬デバイスを本物の Joy-Con と同じように列挙・オープン・読み取りする。
+main.py は --fake-hid N を指定したときだけ install() する (--ingest-process の入力プロセスにも渡す)。
+
+- 各デバイスは実機と同じ間隔 (REPORT_INTERVAL) で 0x30 の標準入力レポートを生成する。
+  レポートは経過時間から計算して作るので、読み取りが遅れると実機と同じように溜まり、
+  HIDRAW_BUFFER_REPORTS を超えた古いレポートは捨てられる (dropped に数える)。
+- ボタンとスティックはスクリプト (SCRIPTS) に従って動く。台ごとに位相をずらす。
+- 最後に返したレポートが生成された時刻 (time.perf_counter) を last_due に残すので、
+  呼び出し側でレポート到着から処理までのレイテンシーを測れる。
+"""
+import math
+import sys
+import time
+
+DEFAULT_COUNT = 2
+
+NINTENDO_VID = 0x057e
+JOYCON_L_PID = 0x2006
+JOYCON_R_PID = 0x2007
+
+REPORT_INTERVAL = 0.015     # 標準入力レポート (0x30) の間隔 (約 66.7 Hz)
+REPORT_LENGTH = 49
+HIDRAW_BUFFER_REPORTS = 64  # 読まれずに溜められるレポート数 (Linux hidraw のバッファと同じ)
+
+SCRIPTS = ('idle', 'buttons', 'mixed')
+BUTTON_PERIOD = 0.5  # 'buttons' / 'mixed': この間隔でボタンを1つ押す
+BUTTON_HOLD = 0.1
+STICK_PERIOD = 2.0   # 'mixed': スティックをこの周期で1周させる
+
+# (バイト位置, マスク): L は左ボタン (byte 5) と共通ボタン、R は右ボタン (byte 3) と共通ボタン
+_L_BUTTONS = [(5, 0x02), (5, 0x04), (5, 0x01), (5, 0x08), (5, 0x40), (4, 0x01)]
+_R_BUTTONS = [(3, 0x08), (3, 0x04), (3, 0x02), (3, 0x01), (3, 0x40), (4, 0x02)]
+
+_config = {'count': DEFAULT_COUNT, 'script': 'mixed'}
+_devices = []  # オープン中の FakeJoyCon (統計用)
+
+
+class HIDException(OSError):
+    pass
+
+
+def configure(count=DEFAULT_COUNT, script='mixed'):
+    if script not in SCRIPTS:
+        raise ValueError(f"Unknown fake Joy-Con script: '{script}'")
+    _config['count'] = count
+    _config['script'] = script
+
+
+def install(count=None, script=None):
+    """sys.modules['hid'] をこのモジュールに置き換える (hid を import する前に呼ぶ)"""
+    if count is not None or script is not None:
+        configure(DEFAULT_COUNT if count is None else count, script or _config['script'])
+    sys.modules['hid'] = sys.modules[__name__]
+
+
+def _path(index):
+    return f"fake-joycon:{index}".encode('ascii')
+
+
+def enumerate(vendor_id=0, product_id=0):
+    infos = []
+    for index in range(_config['count']):
+        pid = JOYCON_L_PID if index % 2 == 0 else JOYCON_R_PID
+        if vendor_id not in (0, NINTENDO_VID) or product_id not in (0, pid):
+            continue
+        infos.append({
+            'path': _path(index),
+            'vendor_id': NINTENDO_VID,
+            'product_id': pid,
+            'serial_number': f'FAKE{index:04d}',
+            'product_string': 'Joy-Con (L)' if pid == JOYCON_L_PID else 'Joy-Con (R)',
+            'manufacturer_string': 'Nintendo',
+            'interface_number': -1,
+        })
+    return infos
+
+
+def _encode_stick(report, offset, x, y):
+    """-1.0..1.0 を 12ビットの生データにして書き込む"""
+    x_raw = max(0, min(4095, int(2048 + x * 2047)))
+    y_raw = max(0, min(4095, int(2048 + y * 2047)))
+    report[offset] = x_raw & 0xFF
+    report[offset + 1] = (x_raw >> 8) | ((y_raw & 0x0F) << 4)
+    report[offset + 2] = y_raw >> 4
+
+
+class FakeJoyCon:
+    def __init__(self):
+        self.index = None
+        self.is_left = True
+        self.nonblocking = False
+        self.opened = False
+        self.start = 0.0
+        self.next_seq = 0
+        self.last_due = None
+        self.reports = 0
+        self.dropped = 0
+        self.writes = 0
+
+    # --- hid.device 互換 ---
+    def open_path(self, path):
+        if isinstance(path, str):
+            path = path.encode('ascii')
+        infos = {info['path']: info for info in enumerate()}
+        info = infos.get(path)
+        if info is None:
+            raise HIDException(f"No simulated Joy-Con at {path!r}")
+        self.index = int(path.rsplit(b':', 1)[1])
+        self.is_left = info['product_id'] == JOYCON_L_PID
+        # 全台が同時にレポートを出さないよう位相をずらす
+        phase = REPORT_INTERVAL * (self.index % 8) / 8
+        self.start = time.perf_counter() + phase
+        self.opened = True
+        _devices.append(self)
+
+    def set_nonblocking(self, enabled):
+        self.nonblocking = bool(enabled)
+
+    def write(self, data):
+        if not self.opened:
+            raise HIDException("device is not open")
+        self.writes += 1
+        return len(data)
+
+    def read(self, size, timeout_ms=0):
+        if not self.opened:
+            raise HIDException("device is not open")
+        now = time.perf_counter()
+        generated = int((now - self.start) / REPORT_INTERVAL) + 1 if now >= self.start else 0
+        if generated <= self.next_seq:
+            if self.nonblocking:
+                return []
+            time.sleep(self.start + self.next_seq * REPORT_INTERVAL - now)
+            generated = self.next_seq + 1
+        backlog = generated - self.next_seq
+        if backlog > HIDRAW_BUFFER_REPORTS:
+            self.dropped += backlog - HIDRAW_BUFFER_REPORTS
+            self.next_seq = generated - HIDRAW_BUFFER_REPORTS
+        seq = self.next_seq
+        self.next_seq += 1
+        self.reports += 1
+        self.last_due = self.start + seq * REPORT_INTERVAL
+        return list(self._report(seq, seq * REPORT_INTERVAL)[:size])
+
+    def close(self):
+        if self.opened:
+            self.opened = False
+            _devices.remove(self)
+
+    # --- レポートの生成 ---
+    def _report(self, seq, t):
+        report = bytearray(REPORT_LENGTH)
+        report[0] = 0x30
+        report[1] = seq & 0xFF
+        report[2] = 0x80  # バッテリー満タン
+        report[12] = 0x0C
+        script = _config['script']
+        t += self.index * 0.137  # 台ごとに動きをずらす
+        if script in ('buttons', 'mixed'):
+            step = int(t / BUTTON_PERIOD)
+            if t - step * BUTTON_PERIOD < BUTTON_HOLD:
+                buttons = _L_BUTTONS if self.is_left else _R_BUTTONS
+                offset, mask = buttons[step % len(buttons)]
+                report[offset] |= mask
+        x = y = 0.0
+        if script == 'mixed':
+            angle = 2 * math.pi * t / STICK_PERIOD
+            x, y = 0.8 * math.cos(angle), 0.8 * math.sin(angle)
+        _encode_stick(report, 6 if self.is_left else 9, x, y)
+        _encode_stick(report, 9 if self.is_left else 6, 0.0, 0.0)
+        return report
+
+
+device = FakeJoyCon
+
+
+def stats():
+    """オープン中の全デバイスの合計"""
+    return {
+        'devices': len(_devices),
+        'reports': sum(d.reports for d in _devices),
+        'dropped': sum(d.dropped for d in _devices),
+        'writes': sum(d.writes for d in _devices),
+    }
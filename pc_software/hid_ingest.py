@@ -0,0 +1,295 @@
+"""
+Joy-Con の HID 読み取り・デコード・キー注入を Web サーバーとは別のプロセスで動かす (main.py --ingest-process)。
+
+Web サーバー側 (FastAPI・Socket.IO) の GC やハンドラーの遅れが入力のジッターにならないよう、
+入力プロセスは自分のイベントループで main.py と同じ処理経路 (joycon_pipeline: scan_and_manage_joycons, マウス移動,
+タイマーホイール, 振動, 出力ワーカー) を動かす。入力プロセスは joycon_pipeline だけを読み込み、
+server.py (FastAPI・Socket.IO のサーバー) は読み込まない (spawn が読み込み直す main.py は起動の処理を main() に置いている)。
+2つのプロセスは共有メモリのリングバッファでつながる。
+
+- 入力プロセス → サーバー: デバイスの追加・削除、バッテリー・ボタン・スティックの更新、Joy-Con の InputEvent、
+  1秒ごとの統計。サーバーはそれを自分の TelemetryPublisher / InputEventPublisher に渡し、これまで通り Socket.IO で配信する。
+- サーバー → 入力プロセス: テレメトリーと入力イベントの購読状況、マッピングの変更、振動、レイテンシー計測の切り替え、停止。
+
+入力プロセスは任意で CPU を固定し (cpus)、優先度を上げられる (priority: 'high' / 'realtime')。
+"""
+import asyncio
+import ctypes
+import multiprocessing
+import os
+import sys
+import time
+
+from input_events import InputEvent
+from shm_ring import ShmRing
+
+EVENT_RING_CAPACITY = 1 << 20
+COMMAND_RING_CAPACITY = 1 << 18
+SERVER_POLL_INTERVAL = 0.004  # サーバーがイベントを取り出す間隔 (秒、UIのフレーム間隔より十分短く)
+INGEST_POLL_INTERVAL = 0.01   # 入力プロセスがコマンドを取り出す間隔 (秒)
+STATS_INTERVAL = 1.0          # 入力プロセスが統計を送る間隔 (秒)
+STOP_TIMEOUT = 3.0
+PRIORITIES = ('normal', 'high', 'realtime')
+REALTIME_PRIORITY = 10  # SCHED_FIFO の優先度 (1-99)
+
+
+# --- 入力プロセスのスケジューリング ---
+def _set_windows_scheduling(cpus, priority):
+    kernel32 = ctypes.windll.kernel32
+    process = kernel32.GetCurrentProcess()
+    if cpus:
+        mask = 0
+        for cpu in cpus:
+            mask |= 1 << cpu
+        if not kernel32.SetProcessAffinityMask(process, ctypes.c_size_t(mask)):
+            print(f"Failed to set CPU affinity to {sorted(cpus)}")
+    if priority != 'normal':
+        priority_class = 0x80 if priority == 'high' else 0x100  # HIGH / REALTIME_PRIORITY_CLASS
+        if not kernel32.SetPriorityClass(process, priority_class):
+            print(f"Failed to set process priority to {priority}")
+
+
+def apply_scheduling(cpus=None, priority='normal'):
+    """現在のプロセスの CPU と優先度を設定する。権限が無いなどで失敗しても続行する。"""
+    if sys.platform == 'win32':
+        _set_windows_scheduling(cpus, priority)
+        return
+    if cpus:
+        try:
+            os.sched_setaffinity(0, cpus)
+        except (AttributeError, OSError) as e:
+            print(f"Failed to set CPU affinity to {sorted(cpus)}: {e}")
+    try:
+        if priority == 'high':
+            os.nice(-10)
+        elif priority == 'realtime':
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(REALTIME_PRIORITY))
+    except (AttributeError, OSError) as e:
+        print(f"Failed to set process priority to {priority}: {e}")
+
+
+# --- 入力プロセス側 ---
+class RingTelemetry:
+    """入力プロセスで joycon_pipeline.telemetry の代わりに使う。更新をそのままリングに書く。"""
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.tracer = None
+        self._subscriptions = frozenset()  # サーバーの (ストリーム, デバイスID or '*')
+
+    def set_subscriptions(self, keys):
+        self._subscriptions = keys
+
+    def wants(self, stream, device_id):
+        return (stream, device_id) in self._subscriptions or (stream, '*') in self._subscriptions
+
+    def add_device(self, device_id, info):
+        self.ring.put(('add', device_id, info))
+
+    def remove_device(self, device_id):
+        self.ring.put(('remove', device_id))
+
+    def update_battery(self, device_id, level, charging):
+        # デバイスリストにも載るので購読に関係なく送る (変わったときだけ呼ばれる)
+        self.ring.put(('battery', device_id, level, charging))
+
+    def update_input(self, device_id, buttons):
+        if self.wants('input', device_id):
+            self.ring.put(('input', device_id, buttons))
+
+    def update_stick(self, device_id, x, y):
+        if self.wants('stick', device_id):
+            self.ring.put(('stick', device_id, x, y))
+
+
+class RingInputEvents:
+    """入力プロセスで joycon_pipeline.input_events の代わりに使う。サーバーで購読されている source のイベントだけをリングに書く。"""
+
+    def __init__(self, ring):
+        self.ring = ring
+        self._sources = frozenset()
+
+    def set_sources(self, sources):
+        self._sources = sources
+
+    def wants(self, source):
+        return source in self._sources
+
+    def publish(self, event):
+        if event.source in self._sources:
+            self.ring.put(('input_event', event.source, event.device, event.control, event.kind, event.value))
+
+
+def _handle_command(pipeline, telemetry, command):
+    """サーバーからのコマンドを1つ処理する。停止なら False を返す。"""
+    kind = command[0]
+    if kind == 'stop':
+        return False
+    if kind == 'subscriptions':
+        telemetry.set_subscriptions(command[1])
+    elif kind == 'input_sources':
+        pipeline.input_events.set_sources(command[1])
+    elif kind == 'mapping':
+        _, device_id, mapping = command
+        bindings, errors = pipeline.compile_joycon_mapping(mapping, where=device_id)
+        for error in errors:
+            print(f"Invalid mapping entry: {error}")
+        pipeline.apply_mapping(device_id, bindings)
+    elif kind == 'rumble':
+        _, device_id, pattern = command
+        pipeline.play_rumble(device_id, pattern)
+    elif kind == 'latency':
+        _, enabled, reset = command
+        if enabled is not None:
+            pipeline.set_latency_tracing(enabled)
+        if reset:
+            pipeline.latency_tracer.reset()
+    return True
+
+
+async def _serve_commands(pipeline, telemetry, commands, events):
+    parent = multiprocessing.parent_process()
+    next_stats = 0.0
+    while True:
+        for command in commands.poll():
+            if not _handle_command(pipeline, telemetry, command):
+                return
+        now = time.monotonic()
+        if now >= next_stats:
+            next_stats = now + STATS_INTERVAL
+            events.put(('stats', {
+                'latency': pipeline.latency_tracer.snapshot(),
+                'output': pipeline.output.stats(),
+                'devices': len(pipeline.state.joycon_devices),
+                'commands': commands.stats(),
+                'counters': pipeline.counters.export(),
+                'loop_lag': pipeline.lag_monitor.export(),
+            }))
+        if parent is not None and not parent.is_alive():
+            print("Server process exited; stopping HID ingest.")
+            return
+        await asyncio.sleep(INGEST_POLL_INTERVAL)
+
+
+async def _run_pipeline(pipeline, telemetry, commands, events):
+    pipeline.load_mapping()
+    pipeline.start()
+    lag_task = asyncio.create_task(pipeline.lag_monitor.run())
+    try:
+        await _serve_commands(pipeline, telemetry, commands, events)
+    finally:
+        lag_task.cancel()
+        await pipeline.shutdown()
+
+
+def run_ingest(event_ring_name, command_ring_name, options):
+    """入力プロセスのエントリーポイント"""
+    apply_scheduling(options.get('cpus'), options.get('priority', 'normal'))
+    if options.get('fake_hid') is not None:
+        import fake_hid
+        fake_hid.install(options['fake_hid'])  # joycon_pipeline が hid を読み込む前に
+        print(f"Using {options['fake_hid']} simulated Joy-Con(s) instead of hidapi")
+    import joycon_pipeline as pipeline
+    from hid_log import HidRecorder
+    from output_backend import create_output_backend
+
+    events = ShmRing.attach(event_ring_name)
+    commands = ShmRing.attach(command_ring_name)
+    telemetry = pipeline.telemetry = RingTelemetry(events)
+    pipeline.input_events = RingInputEvents(events)
+    pipeline.set_output(backend_factory=lambda: create_output_backend(options.get('output')))
+    if options.get('record'):
+        pipeline.state.hid_recorder = HidRecorder(options['record'])
+        print(f"Recording raw HID reports to {options['record']}")
+    if options.get('trace_latency'):
+        pipeline.set_latency_tracing(True)
+    if options.get('lag_budget') is not None:
+        pipeline.lag_monitor.budget = options['lag_budget']
+    print(f"HID ingest process started (pid {os.getpid()})")
+    try:
+        asyncio.run(_run_pipeline(pipeline, telemetry, commands, events))
+    finally:
+        events.close()
+        commands.close()
+
+
+# --- サーバー側 ---
+class IngestProcess:
+    def __init__(self, output=None, record=None, trace_latency=False, cpus=None, priority='normal', lag_budget=None,
+                 fake_hid=None):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: '{priority}'")
+        self.options = {
+            'output': output,
+            'record': record,
+            'trace_latency': trace_latency,
+            'cpus': set(cpus) if cpus else None,
+            'priority': priority,
+            'lag_budget': lag_budget,
+            'fake_hid': fake_hid,  # 模擬 Joy-Con の台数 (main.py --fake-hid)
+        }
+        self.process = None
+        self.events = None
+        self.commands = None
+        self.stats = {}  # 入力プロセスから最後に届いた統計
+        self.events_received = 0
+
+    def start(self):
+        self.events = ShmRing.create(EVENT_RING_CAPACITY)
+        self.commands = ShmRing.create(COMMAND_RING_CAPACITY)
+        context = multiprocessing.get_context('spawn')
+        self.process = context.Process(
+            target=run_ingest, name='hid-ingest', daemon=True,
+            args=(self.events.name, self.commands.name, self.options),
+        )
+        self.process.start()
+        return self
+
+    def send(self, *command):
+        if self.commands is None or not self.commands.put(command):
+            print(f"Failed to send {command[0]} to the HID ingest process")
+
+    async def run(self, telemetry, input_events):
+        """入力プロセスからのイベントを TelemetryPublisher と InputEventPublisher に渡す"""
+        handlers = {
+            'add': telemetry.add_device,
+            'remove': telemetry.remove_device,
+            'battery': telemetry.update_battery,
+            'input': telemetry.update_input,
+            'stick': telemetry.update_stick,
+            'input_event': lambda *fields: input_events.publish(InputEvent(*fields)),
+        }
+        while True:
+            for event in self.events.poll():
+                self.events_received += 1
+                if event[0] == 'stats':
+                    self.stats = event[1]
+                else:
+                    handlers[event[0]](*event[1:])
+            if not self.process.is_alive():
+                print(f"HID ingest process exited with code {self.process.exitcode}")
+                for device in telemetry.device_list():
+                    telemetry.remove_device(device['id'])
+                return
+            await asyncio.sleep(SERVER_POLL_INTERVAL)
+
+    def ring_stats(self):
+        return {
+            'events': self.events.stats() if self.events else {},
+            'commands': self.commands.stats() if self.commands else {},
+            'events_received': self.events_received,
+            'alive': self.process is not None and self.process.is_alive(),
+        }
+
+    def stop(self):
+        if self.process is not None:
+            if self.process.is_alive():
+                self.send('stop')
+                self.process.join(STOP_TIMEOUT)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join(STOP_TIMEOUT)
+        for ring in (self.events, self.commands):
+            if ring is not None:
+                ring.close()
+        self.events = self.commands = None
@@ -0,0 +1,48 @@
+"""
+Joy-Con の生HIDレポートを記録・読み込みするためのバイナリログ形式。
+
+ファイル先頭にマジック (8バイト) を置き、以降は1レポートごとに
+    開始からの経過時間 (ns, uint64) / デバイス番号 (uint8) / 種別 'L'|'R' (1バイト) / 長さ (uint8)
+のヘッダーとレポート本体を並べる。デバイス番号はデバイスパスが初めて現れた順に割り当てる。
+"""
+import struct
+import time
+
+LOG_MAGIC = b'OMIPHID1'
+_RECORD = struct.Struct('<QBcB')
+
+
+class HidRecorder:
+    def __init__(self, path):
+        self._file = open(path, 'wb')
+        self._file.write(LOG_MAGIC)
+        self._start = time.monotonic_ns()
+        self._slots = {}  # デバイスパス -> デバイス番号
+
+    def record(self, device_path, dev_type, report):
+        slot = self._slots.get(device_path)
+        if slot is None:
+            slot = self._slots[device_path] = len(self._slots)
+        data = bytes(report)
+        self._file.write(_RECORD.pack(time.monotonic_ns() - self._start, slot, dev_type.encode('ascii'), len(data)))
+        self._file.write(data)
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+def read_hid_log(path):
+    """ログを読み込み、(経過時間秒, デバイス番号, 種別, レポート) を順に返す"""
+    with open(path, 'rb') as f:
+        if f.read(len(LOG_MAGIC)) != LOG_MAGIC:
+            raise ValueError(f"{path} is not a raw HID report log")
+        while True:
+            header = f.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                return
+            timestamp_ns, slot, dev_type, length = _RECORD.unpack(header)
+            report = f.read(length)
+            if len(report) < length:
+                return  # 記録中に終了した場合の途中までのレコードは捨てる
+            yield timestamp_ns / 1e9, slot, dev_type.decode('ascii'), report
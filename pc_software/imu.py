@@ -0,0 +1,113 @@
+"""
+Joy-Con の 6軸センサー (IMU) データのデコードとフィルタリング。
+
+標準入力レポート (0x30) には 5ms 間隔の IMU サンプルが3つ入っている。
+1レポート分の3サンプルを NumPy でまとめてデコードし、ジャイロのバイアス補正と
+ローパスフィルタをベクトル演算で適用する。
+"""
+import numpy as np
+
+IMU_REPORT_OFFSET = 13       # 0x30 レポート内の IMU データの開始位置
+SAMPLES_PER_REPORT = 3
+SAMPLE_SIZE = 12             # 加速度 x,y,z + ジャイロ x,y,z (各 int16 LE)
+SAMPLE_INTERVAL_SEC = 0.005
+
+ACCEL_G_PER_COUNT = 8.0 / 32767.0      # ±8G レンジ
+GYRO_DPS_PER_COUNT = 2000.0 / 32767.0  # ±2000dps レンジ
+
+# gyro モードの sensitivity 1 あたりのカーソル速度 (ピクセル/秒 per 度/秒)
+GYRO_SENSITIVITY_SCALE = 0.5
+# これ未満の角速度 (度/秒) はセンサーのノイズとして無視する
+GYRO_DEADZONE_DPS = 1.5
+
+_IMU_END = IMU_REPORT_OFFSET + SAMPLES_PER_REPORT * SAMPLE_SIZE
+_SCALE = np.array([ACCEL_G_PER_COUNT] * 3 + [GYRO_DPS_PER_COUNT] * 3)
+
+
+def decode_imu(report):
+    """0x30 レポートから (3, 6) の配列 [加速度(G) x3, ジャイロ(dps) x3] を取り出す"""
+    raw = np.frombuffer(bytes(report[IMU_REPORT_OFFSET:_IMU_END]), dtype='<i2')
+    return raw.reshape(SAMPLES_PER_REPORT, 6) * _SCALE
+
+
+def _ema_weights(alpha, n):
+    """n サンプルへの指数移動平均を行列積1回で適用するための重みを作る"""
+    decay = 1.0 - alpha
+    weights = np.zeros((n, n))
+    for k in range(n):
+        for j in range(k + 1):
+            weights[k, j] = alpha * decay ** (k - j)
+    carry = decay ** np.arange(1, n + 1)
+    return weights, carry
+
+
+class ImuProcessor:
+    """ジャイロのバイアスを推定して補正し、ローパスフィルタを掛ける (Joy-Con 1台分)
+
+    接続直後の calibration_reports レポート分のジャイロを集め、ばらつき (標準偏差) が
+    calibration_noise_dps 未満なら静止していたとみなして平均をバイアスにする。
+    動かしていた場合はその区間を捨てて集め直す。IMU を有効にする前の全て0のサンプルは使わない。
+    """
+
+    def __init__(self, smoothing=0.5, still_threshold_dps=2.0, calibration_reports=40, bias_rate=0.02,
+                 calibration_noise_dps=1.0):
+        self.still_threshold_dps = still_threshold_dps
+        self.calibration_reports = calibration_reports
+        self.calibration_noise_dps = calibration_noise_dps
+        self.bias_rate = bias_rate
+        self.bias = np.zeros(3)
+        self._filtered = np.zeros(3)
+        self._calibrated = False
+        self._reset_window()
+        self._weights, self._carry = _ema_weights(smoothing, SAMPLES_PER_REPORT)
+
+    def process(self, report):
+        """1レポート分を処理し、(加速度 (3,3), 補正済みジャイロ (3,3)) を返す"""
+        samples = decode_imu(report)
+        accel = samples[:, :3]
+        gyro = samples[:, 3:]
+        if samples.any():  # 全て0なら IMU がまだ有効になっていない
+            self._update_bias(gyro)
+
+        corrected = gyro - self.bias
+        filtered = self._weights @ corrected + np.outer(self._carry, self._filtered)
+        self._filtered = filtered[-1]
+        return accel, filtered
+
+    def _reset_window(self):
+        self._window_reports = 0
+        self._window_sum = np.zeros(3)
+        self._window_sq_sum = np.zeros(3)
+
+    def _update_bias(self, gyro):
+        if not self._calibrated:
+            self._window_reports += 1
+            self._window_sum += gyro.sum(axis=0)
+            self._window_sq_sum += (gyro * gyro).sum(axis=0)
+            if self._window_reports < self.calibration_reports:
+                return
+            n = self._window_reports * SAMPLES_PER_REPORT
+            mean = self._window_sum / n
+            variance = self._window_sq_sum / n - mean * mean
+            if variance.max() < self.calibration_noise_dps ** 2:
+                self.bias = mean
+                self._filtered = np.zeros(3)
+                self._calibrated = True
+            self._reset_window()
+            return
+        # 以降は静止していると判断できたときだけゆっくり追従させる (温度ドリフト対策)
+        if np.abs(gyro - self.bias).max() < self.still_threshold_dps:
+            self.bias += (gyro.mean(axis=0) - self.bias) * self.bias_rate
+
+    @property
+    def calibrated(self):
+        return self._calibrated
+
+
+def gyro_velocity(gyro, sensitivity, deadzone_dps=GYRO_DEADZONE_DPS):
+    """補正済みジャイロ (3,3) からカーソル速度 (ピクセル/秒) を求める。ヨーで左右、ピッチで上下に動かす。
+    deadzone_dps 未満の角速度はノイズとして0にし、それを超えた分だけを速度にする。"""
+    rate = gyro.mean(axis=0)
+    rate = np.sign(rate) * np.maximum(np.abs(rate) - deadzone_dps, 0.0)
+    factor = sensitivity * GYRO_SENSITIVITY_SCALE
+    return float(-rate[2] * factor), float(-rate[1] * factor)
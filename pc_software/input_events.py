@@ -0,0 +1,178 @@
+"""
+Joy-Con と OMIP シリアルデバイス (M5Tab・マスターハブ) に共通の入力イベントと、その配信。
+
+- InputEvent: (source, device, control, kind, value) の5つ組。source は 'joycon' / 'omip'、
+  control は Joy-Con ならボタン名、OMIP なら port_id。kind は button (押下 True / 解放 False)、
+  analog (値)、encoder (ステップ数)。
+- MappingTable: (kind, control) -> コンパイル済みアクションの表。設定やページが変わったら
+  作り直して丸ごと差し替えるので、入力ループは辞書を1回引くだけでアクションを実行できる。
+  (Joy-Con のボタンは action_engine.JoyConBindings.buttons がデバイスごとの同じ役割の表になっている)
+- InputEventPublisher: 購読している Socket.IO クライアントに InputEvent を UI レートでまとめて送る。
+  button / encoder は順番通りに送り、analog は (デバイス, control) ごとに最新値だけを送る。
+  購読者がいない間は何も記録しない。
+"""
+import asyncio
+
+SOURCES = ('joycon', 'omip')
+BUTTON = 'button'
+ANALOG = 'analog'
+ENCODER = 'encoder'
+
+DEFAULT_UI_RATE = 30
+MAX_PENDING_EVENTS = 1024  # 送信待ちの button / encoder がこれを超えたら古いものから捨てる
+
+
+class InputEvent:
+    __slots__ = ('source', 'device', 'control', 'kind', 'value')
+
+    def __init__(self, source, device, control, kind, value):
+        self.source = source
+        self.device = device
+        self.control = control
+        self.kind = kind
+        self.value = value
+
+    def to_dict(self):
+        return {'source': self.source, 'device': self.device, 'control': self.control,
+                'kind': self.kind, 'value': self.value}
+
+    def __repr__(self):
+        return (f'InputEvent({self.source!r}, {self.device!r}, {self.control!r}, '
+                f'{self.kind!r}, {self.value!r})')
+
+
+class MappingTable:
+    __slots__ = ('_entries',)
+
+    def __init__(self, entries=None):
+        self._entries = entries or {}
+
+    @classmethod
+    def from_omip(cls, port_actions, encoder_bindings):
+        """M5Tab の1ページ分のアクション (port_id 順のリスト) とエンコーダー設定から表を作る"""
+        entries = {(BUTTON, port_id): action for port_id, action in enumerate(port_actions or ()) if action}
+        entries.update(((ENCODER, port_id), binding) for port_id, binding in encoder_bindings.items())
+        return cls(entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, kind, control):
+        return self._entries.get((kind, control))
+
+    def dispatch(self, event, output):
+        """イベントに割り当てられたアクションを実行する。何か実行したら True を返す。"""
+        handler = self._entries.get((event.kind, event.control))
+        if handler is None:
+            return False
+        if event.kind == ENCODER:
+            handler.steps(output, event.value, device_id=event.device)
+        elif handler.tap_on_press:
+            # M5Tab のポートは押したときに tap する (backend.py と同じ)
+            if not event.value:
+                return False
+            handler.tap(output, event.device)
+        elif event.value:
+            handler.press(output, event.device)
+        else:
+            handler.release(output, event.device)
+        return True
+
+
+class InputEventPublisher:
+    def __init__(self, sio, rate_hz=DEFAULT_UI_RATE, max_pending=MAX_PENDING_EVENTS):
+        self.sio = sio
+        self.period = 1.0 / rate_hz
+        self.max_pending = max_pending
+        self._subscribers = {}  # sid -> 購読する source の集合 (None は全部)
+        self._sources = frozenset()  # いずれかのクライアントが購読している source
+        self._events = []       # 未送信の button / encoder (到着順)
+        self._analog = {}       # (source, device, control) -> 未送信の最新の analog
+        self._dirty = asyncio.Event()
+        self._seq = 0
+        self.frames_sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.emit_errors = 0
+
+    # --- 購読の管理 ---
+    def subscribe(self, sid, sources=None):
+        for source in sources or ():
+            if source not in SOURCES:
+                raise ValueError(f"Unknown input source: '{source}'")
+        self._subscribers[sid] = frozenset(sources) if sources else None
+        self._update_sources()
+
+    def unsubscribe(self, sid):
+        if self._subscribers.pop(sid, False) is not False:
+            self._update_sources()
+
+    def _update_sources(self):
+        sources = set()
+        for subscribed in self._subscribers.values():
+            sources.update(SOURCES if subscribed is None else subscribed)
+        self._sources = frozenset(sources)
+
+    def wants(self, source):
+        return source in self._sources
+
+    def subscribed_sources(self):
+        return self._sources
+
+    # --- 入力ループから呼ばれる (待たない) ---
+    def publish(self, event):
+        if event.source not in self._sources:
+            return
+        if event.kind == ANALOG:
+            key = (event.source, event.device, event.control)
+            if key in self._analog:
+                self.coalesced += 1
+            self._analog[key] = event
+        else:
+            if len(self._events) >= self.max_pending:
+                del self._events[0]
+                self.dropped += 1
+            self._events.append(event)
+        self._dirty.set()
+
+    def stats(self):
+        return {
+            'subscribers': len(self._subscribers),
+            'frames_sent': self.frames_sent,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'emit_errors': self.emit_errors,
+        }
+
+    # --- 送信側 ---
+    def _build_frames(self):
+        events = self._events + list(self._analog.values())
+        self._events = []
+        self._analog = {}
+        if not events:
+            return {}
+        self._seq += 1
+        frames = {}
+        for sid, sources in self._subscribers.items():
+            selected = events if sources is None else [e for e in events if e.source in sources]
+            if selected:
+                frames[sid] = {'seq': self._seq, 'events': [e.to_dict() for e in selected]}
+        return frames
+
+    async def run(self):
+        """イベントがあったときだけ、最大 rate_hz でフレームを送信する"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._dirty.wait()
+            self._dirty.clear()
+            started = loop.time()
+            for sid, frame in self._build_frames().items():
+                try:
+                    await self.sio.emit('input_events', frame, to=sid)
+                    self.frames_sent += 1
+                except Exception as e:
+                    self.emit_errors += 1
+                    print(f"Failed to publish input events to {sid}: {e}")
+            delay = self.period - (loop.time() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
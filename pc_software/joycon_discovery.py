@@ -0,0 +1,109 @@
+"""
+Joy-Con の接続・切断を入力ループの外で検出するディスカバリー。
+
+hid.enumerate() はデバイス数に応じて数十ミリ秒以上かかることがあるため、
+常にエグゼキューター (別スレッド) で実行し、入力ループは結果を受け取るだけにする。
+Linux で pyudev が使える場合は udev (netlink) のホットプラグ通知を契機に再列挙し、
+それ以外の環境では一定間隔で再列挙する。pyudev はディスカバリーが動き出すときにエグゼキューターで読み込む。
+"""
+import asyncio
+import sys
+
+import startup_timing
+
+NINTENDO_VID = 0x057e
+JOYCON_L_PID = 0x2006
+JOYCON_R_PID = 0x2007
+
+HOTPLUG_SETTLE_SEC = 0.2       # udev通知が連続して届く間は再列挙を待つ
+HOTPLUG_RESCAN_INTERVAL = 30   # ホットプラグ通知が使える場合の保険の再列挙間隔 (秒)
+
+
+def enumerate_joycons():
+    """接続されているJoy-ConのHID情報を列挙する (ブロッキング)"""
+    return [
+        dev for dev in startup_timing.import_module('hid').enumerate(NINTENDO_VID)
+        if dev['vendor_id'] == NINTENDO_VID and dev['product_id'] in (JOYCON_L_PID, JOYCON_R_PID)
+    ]
+
+
+def _load_pyudev():
+    """pyudev を読み込む。Linux 以外か、インストールされていなければ None"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        return startup_timing.import_module('pyudev')
+    except ImportError:
+        return None
+
+
+def device_path_str(info):
+    return info['path'].decode('utf-8') if isinstance(info['path'], bytes) else info['path']
+
+
+class JoyConDiscovery:
+    def __init__(self, scan_interval):
+        self.scan_interval = scan_interval
+        self.changed = asyncio.Event()
+        self._snapshot = None
+        self._rescan = asyncio.Event()
+        self._monitor = None
+
+    def take_snapshot(self):
+        """新しい列挙結果があれば返し、無ければNoneを返す (待たない)"""
+        snapshot = self._snapshot
+        self._snapshot = None
+        self.changed.clear()
+        return snapshot
+
+    def request_rescan(self):
+        self._rescan.set()
+
+    def _start_hotplug_monitor(self, loop, pyudev):
+        if pyudev is None:
+            return False
+        try:
+            context = pyudev.Context()
+            monitor = pyudev.Monitor.from_netlink(context)
+            monitor.filter_by('hidraw')
+            monitor.start()
+        except Exception as e:
+            print(f"udev hot-plug monitor unavailable, falling back to polling: {e}")
+            return False
+
+        def on_readable():
+            # 溜まっている通知をすべて読み捨てて再列挙を1回だけ要求する
+            while monitor.poll(timeout=0) is not None:
+                pass
+            self._rescan.set()
+
+        loop.add_reader(monitor.fileno(), on_readable)
+        self._monitor = monitor
+        print("Using udev hot-plug notifications for Joy-Con detection.")
+        return True
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        pyudev = await loop.run_in_executor(None, _load_pyudev)
+        hotplug = self._start_hotplug_monitor(loop, pyudev)
+        interval = HOTPLUG_RESCAN_INTERVAL if hotplug else self.scan_interval
+        try:
+            while True:
+                try:
+                    infos = await loop.run_in_executor(None, enumerate_joycons)
+                except Exception as e:
+                    print(f"HID enumeration failed: {e}")
+                else:
+                    self._snapshot = infos
+                    self.changed.set()
+
+                try:
+                    await asyncio.wait_for(self._rescan.wait(), timeout=interval)
+                    if hotplug:
+                        await asyncio.sleep(HOTPLUG_SETTLE_SEC)
+                except asyncio.TimeoutError:
+                    pass
+                self._rescan.clear()
+        finally:
+            if self._monitor is not None:
+                loop.remove_reader(self._monitor.fileno())
@@ -0,0 +1,532 @@
+"""
+Joy-Con の入力処理経路 (HID の読み取り・デコード・マッピングの実行・出力) と、その状態。
+
+Web サーバー (server.py) の無いプロセスでも使えるよう、FastAPI・Socket.IO には依存しない。
+server.py のほか、別プロセスの入力処理 (hid_ingest.py)、再生ドライバー (replay_hid.py)、
+ソークテスト (soak_joycons.py) が同じ処理経路を使う。
+
+- telemetry と input_events は送信先 (sio) を持たずに作る。server.py が自分の Socket.IO サーバーを設定し、
+  hid_ingest.py はリングに書く RingTelemetry / RingInputEvents に差し替える。
+- output は set_output() で作る。start() で入力ループなどのタスクを起動し、shutdown() で止めて後始末をする。
+"""
+import asyncio
+import math
+import json
+
+import startup_timing
+from action_engine import compile_joycon_mapping, cancel_gestures, set_rumble_player, set_timer_wheel, EMPTY_JOYCON_BINDINGS, NO_STICK
+from mouse_motion import MouseMotionEngine, stick_velocity
+from telemetry import TelemetryPublisher
+from joycon_discovery import JoyConDiscovery, device_path_str
+from rumble import RumblePlayer
+from latency import LatencyTracer, TimedOutput, now_ns
+from output_worker import OutputWorker
+from timer_wheel import TimerWheel
+from profile_store import ProfileStore
+from input_events import BUTTON, InputEvent, InputEventPublisher
+from server_metrics import LoopLagMonitor, ServerCounters
+
+# --- 定数 ---
+MAPPING_FILE = "joycon_mapping.json"  # 以前の形式 (初回起動時に MAPPING_STORE_DIR へ取り込む)
+MAPPING_STORE_DIR = "joycon_mapping.d"  # デバイスごとのマッピングを1ファイルずつ保存する
+JOYCON_SCAN_INTERVAL = 2  # Joy-Conをスキャンする間隔（秒、ホットプラグ通知が使えない環境）
+STICK_DEADZONE = 0.15  # スティックのデッドゾーン (15%)
+MOUSE_OUTPUT_RATE = 125  # マウス移動を出力するレート (Hz)
+UI_UPDATE_RATE = 30  # UIへ状態をまとめて送るレート (Hz)
+
+# --- キーボード・マウス出力 (起動時に出力ワーカーを作成する。入力ループは出力を待たない) ---
+output = None
+imu_lib = None  # gyro モードを初めて使うときに読み込む
+
+# --- Joy-Con 関連の定数 ---
+NINTENDO_VID = 0x057e
+JOYCON_L_PID = 0x2006
+JOYCON_R_PID = 0x2007
+
+LEFT_MAPPING = {
+    0x01: "arrow_down", 0x02: "arrow_up", 0x04: "arrow_right", 0x08: "arrow_left",
+    0x10: "sr", 0x20: "sl", 0x40: "l", 0x80: "zl",
+}
+RIGHT_MAPPING = {
+    0x01: "y", 0x02: "x", 0x04: "b", 0x08: "a",
+    0x10: "sr", 0x20: "sl", 0x40: "r", 0x80: "zr",
+}
+SHARED_MAPPING = {
+    0x01: "minus", 0x02: "plus", 0x04: "stick_press_r",
+    0x08: "stick_press_l", 0x10: "home", 0x20: "capture",
+}
+BATTERY_MAPPING = {
+    8: "満タン (Full)", 6: "中 (Medium)", 4: "低 (Low)",
+    2: "要充電 (Critical)", 0: "空 (Empty)",
+}
+NEUTRAL_RUMBLE_DATA = bytearray([0x00, 0x01, 0x40, 0x40, 0x00, 0x01, 0x40, 0x40])
+
+# --- アプリケーションの状態管理 ---
+class AppState:
+    def __init__(self):
+        self.joycon_reader_task = None
+        self.mouse_motion_task = None
+        self.discovery_task = None
+        self.rumble_task = None
+        self.timer_task = None
+        self.hid_recorder = None  # --record 指定時の生HIDレポート記録
+        self.joycon_devices = []
+        self.global_packet_counter = 0
+        self.mapping_store = None  # デバイスパス -> マッピング (ProfileStore)
+        self.joycon_bindings = {}  # デバイスパス -> コンパイル済みマッピング (使うときにコンパイルする)
+
+state = AppState()
+mouse_motion = MouseMotionEngine(None, rate_hz=MOUSE_OUTPUT_RATE)
+
+def set_output(backend=None, threaded=True, backend_factory=None):
+    """キーボードとマウスの出力先を設定する。threaded=False の場合は呼び出し元のスレッドで注入する。
+    backend の代わりに backend_factory を渡すと、出力ワーカーのスレッドでバックエンドを作る。"""
+    global output
+    output = OutputWorker(backend, threaded=threaded, backend_factory=backend_factory).start()
+    mouse_motion.mouse = output
+
+telemetry = TelemetryPublisher(None, rate_hz=UI_UPDATE_RATE)
+input_events = InputEventPublisher(None, rate_hz=UI_UPDATE_RATE)  # Joy-Con と OMIP デバイスに共通の入力イベント
+discovery = JoyConDiscovery(scan_interval=JOYCON_SCAN_INTERVAL)
+latency_tracer = LatencyTracer()
+counters = ServerCounters()  # GET /metrics で公開するカウンター
+lag_monitor = LoopLagMonitor()
+timer_wheel = TimerWheel()  # マクロ・長押し・ダブルタップ・連射
+set_timer_wheel(timer_wheel)
+
+def set_latency_tracing(enabled):
+    """レイテンシー計測を切り替える。無効な間は出力先も計測用のラッパーを通らない。"""
+    if enabled and not latency_tracer.enabled:
+        output.wait_backend()
+        output.backend = TimedOutput(output.backend, latency_tracer)
+        output.tracer = latency_tracer
+        telemetry.tracer = latency_tracer
+    elif not enabled and latency_tracer.enabled:
+        output.backend = output.backend.target
+        output.tracer = None
+        telemetry.tracer = None
+    latency_tracer.enabled = enabled
+
+# --- 設定ファイルの読み書き ---
+def load_mapping():
+    """マッピングのストアを開く。ここではインデックスだけを読み、各デバイスのマッピングは接続されたときに読む。"""
+    try:
+        state.mapping_store = ProfileStore(MAPPING_STORE_DIR, legacy_file=MAPPING_FILE)
+        print(f"Loaded mapping index from {MAPPING_STORE_DIR} ({len(state.mapping_store.keys())} devices)")
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Failed to load mapping: {e}")
+        state.mapping_store = ProfileStore(MAPPING_STORE_DIR)
+    state.joycon_bindings = {}
+
+def get_device_mapping(device_id):
+    if state.mapping_store is None:
+        return {}
+    return state.mapping_store.get(device_id, {})
+
+def device_bindings(path):
+    """デバイスのコンパイル済みマッピングを返す。初めて使うときにストアから読んでコンパイルする。"""
+    bindings = state.joycon_bindings.get(path)
+    if bindings is None:
+        device_mapping = get_device_mapping(path)
+        if device_mapping:
+            bindings, errors = compile_joycon_mapping(device_mapping, where=path)
+            for error in errors:
+                print(f"Invalid mapping entry: {error}")
+        else:
+            bindings = EMPTY_JOYCON_BINDINGS
+        state.joycon_bindings[path] = bindings
+    return bindings
+
+def save_mapping(device_id, mapping):
+    """1台分のマッピングを保存する。ファイルへの書き込みはストアのスレッドで後からまとめて行う。"""
+    if state.mapping_store is None:
+        state.mapping_store = ProfileStore(MAPPING_STORE_DIR)
+    if state.mapping_store.put(device_id, mapping):
+        print(f"Saved mapping for {device_id} to {MAPPING_STORE_DIR}")
+
+def apply_mapping(device_id, bindings):
+    """コンパイル済みのマッピングを使い始める (押したままのキーやマウス移動は止める)"""
+    state.joycon_bindings[device_id] = bindings
+    mouse_motion.clear(device_id)
+    cancel_gestures(device_id)
+
+# --- Joy-Con 関連 ---
+def send_joycon_subcommand(device, command, data):
+    try:
+        payload = bytearray([0x01, state.global_packet_counter & 0xF])
+        payload.extend(NEUTRAL_RUMBLE_DATA)
+        payload.append(command)
+        payload.extend(data)
+        device['hid'].write(payload)
+        state.global_packet_counter = (state.global_packet_counter + 1) % 16
+    except OSError as e:
+        print(f"Error sending subcommand to {device['path']}: {e}")
+        counters.error('subcommand')
+        asyncio.create_task(handle_joycon_disconnection(device['path']))
+
+
+def send_joycon_rumble(device_id, rumble_data):
+    """8バイトの振動データを送信する (RumblePlayerから呼ばれる)"""
+    device = next((d for d in state.joycon_devices if d['path'] == device_id), None)
+    if device is None:
+        return False
+    if not device['rumble_enabled']:
+        # 最初の1回は振動有効化サブコマンド (0x48) に振動データを載せて送る
+        device['rumble_enabled'] = True
+        payload = bytearray([0x01, state.global_packet_counter & 0xF])
+        payload.extend(rumble_data)
+        payload.extend(b'\x48\x01')
+    else:
+        payload = bytearray([0x10, state.global_packet_counter & 0xF])
+        payload.extend(rumble_data)
+    try:
+        device['hid'].write(payload)
+        state.global_packet_counter = (state.global_packet_counter + 1) % 16
+        return True
+    except OSError as e:
+        print(f"Error sending rumble to {device_id}: {e}")
+        return False
+
+rumble_player = RumblePlayer(send_joycon_rumble)
+set_rumble_player(rumble_player)
+
+def play_rumble(device_id, pattern):
+    """振動を再生する。device_id が None なら接続中のすべての Joy-Con で"""
+    targets = [device_id] if device_id else [d['path'] for d in state.joycon_devices]
+    for target in targets:
+        rumble_player.play(target, pattern)
+
+
+async def handle_joycon_disconnection(device_path):
+    device_to_remove = next((d for d in state.joycon_devices if d['path'] == device_path), None)
+    if device_to_remove:
+        print(f"Joy-Con disconnected: {device_path}")
+        try:
+            device_to_remove['hid'].close()
+        except Exception as e:
+            print(f"Error closing HID device for {device_path}: {e}")
+        state.joycon_devices.remove(device_to_remove)
+        mouse_motion.clear(device_path)
+        telemetry.remove_device(device_path)
+        rumble_player.remove_device(device_path)
+        cancel_gestures(device_path)
+        discovery.request_rescan()  # 一時的なエラーだった場合に再接続できるよう再列挙する
+
+def process_stick_input(x_raw, y_raw):
+    """スティックの生データを-1.0から1.0の範囲に正規化し、デッドゾーンを適用する"""
+    x = (x_raw - 2048) / 2048.0
+    y = (y_raw - 2048) / 2048.0
+
+    magnitude = math.sqrt(x*x + y*y)
+    if magnitude < STICK_DEADZONE:
+        return 0.0, 0.0
+
+    # デッドゾーンの外側の値を0.0から1.0に再マッピング
+    magnitude = (magnitude - STICK_DEADZONE) / (1.0 - STICK_DEADZONE)
+    return x / math.sqrt(x*x + y*y) * magnitude, y / math.sqrt(x*x + y*y) * magnitude
+
+def register_joycon(dev, dev_type, device_path):
+    """開いたHIDデバイスを管理対象に加え、標準入力レポートモードに切り替える"""
+    device_obj = {
+        'type': dev_type,
+        'hid': dev,
+        'path': device_path,
+        'last_battery_level': 10, # 初回更新を強制するため範囲外の値に設定
+        'last_button_state': {},
+        'last_stick_direction': None,
+        'last_stick_angle': 0,
+        'last_stick_sector': None,
+        'imu': None,
+        'rumble_enabled': False,
+    }
+    state.joycon_devices.append(device_obj)
+    send_joycon_subcommand(device_obj, 0x03, b'\x30')
+    telemetry.add_device(device_path, {'type': dev_type, 'battery': device_obj['last_battery_level']})
+    return device_obj
+
+def process_joycon_report(dev_info, report):
+    """0x30 入力レポート1件を処理する (バッテリー・ボタン・スティックの解析とアクションの実行)"""
+    current_buttons, pressed, released = decode_joycon_report(dev_info, report)
+    apply_joycon_report(dev_info, report, current_buttons, pressed, released)
+    output.flush()  # 1レポート分の出力をまとめて送る
+
+def trace_joycon_report(dev_info, report, read_started, read_done):
+    """process_joycon_report と同じ処理を、段階ごとの所要時間を記録しながら行う"""
+    current_buttons, pressed, released = decode_joycon_report(dev_info, report)
+    decoded = now_ns()
+    apply_joycon_report(dev_info, report, current_buttons, pressed, released)
+    output.flush()
+    done = now_ns()
+    # 注入は出力ワーカーのスレッドで行われ、'output_queue' と 'inject' に別途記録される
+    latency_tracer.record('hid_read', read_done - read_started)
+    latency_tracer.record('decode', decoded - read_done)
+    latency_tracer.record('mapping', done - decoded)
+    latency_tracer.record('end_to_end', done - read_started)
+
+def decode_joycon_report(dev_info, report):
+    """バッテリーとボタンを解析し、(現在のボタン, 押されたボタン, 離されたボタン) を返す"""
+    # --- バッテリー残量解析 ---
+    battery_info = report[2]
+    battery_level = battery_info >> 4
+    last_batt = dev_info.get('last_battery_level', -1)
+    if battery_level != last_batt:
+        dev_info['last_battery_level'] = battery_level
+        telemetry.update_battery(dev_info['path'], battery_level, (battery_info & 0x10) > 0)
+
+    # --- ボタン解析 ---
+    current_buttons = {}
+    byte3, byte4, byte5 = report[3], report[4], report[5]
+    MAPPING = LEFT_MAPPING if dev_info['type'] == 'L' else RIGHT_MAPPING
+    for mask, name in MAPPING.items():
+        if (byte5 if dev_info['type'] == 'L' else byte3) & mask: current_buttons[name] = True
+    for mask, name in SHARED_MAPPING.items():
+        if byte4 & mask: current_buttons[name] = True
+
+    last_state = dev_info.get('last_button_state', {})
+    pressed = {name for name in current_buttons if name not in last_state}
+    released = {name for name in last_state if name not in current_buttons}
+    dev_info['last_button_state'] = current_buttons
+    return current_buttons, pressed, released
+
+def apply_joycon_report(dev_info, report, current_buttons, pressed, released):
+    """ボタンのアクションを実行し、スティック (またはジャイロ) を処理する"""
+    global imu_lib
+    bindings = device_bindings(dev_info['path'])
+    button_actions = bindings.buttons
+
+    # --- キーマッピング実行 ---
+    for button in pressed:
+        action = button_actions.get(button)
+        if action:
+            action.press(output, dev_info['path'])
+    for button in released:
+        action = button_actions.get(button)
+        if action:
+            action.release(output, dev_info['path'])
+
+    # --- UIへ更新通知 (ボタン) ---
+    if pressed or released:
+        telemetry.update_input(dev_info['path'], current_buttons)
+        if input_events.wants('joycon'):
+            for button in pressed:
+                input_events.publish(InputEvent('joycon', dev_info['path'], button, BUTTON, True))
+            for button in released:
+                input_events.publish(InputEvent('joycon', dev_info['path'], button, BUTTON, False))
+
+    # --- アナログスティック処理 ---
+    stick = bindings.sticks.get('stick_l' if dev_info['type'] == 'L' else 'stick_r', NO_STICK)
+    stick_mode = stick.mode
+    sensitivity = stick.sensitivity
+
+    stick_telemetry = telemetry.wants('stick', dev_info['path'])
+    if stick_mode not in ('none', 'gyro') or stick_telemetry:
+        if dev_info['type'] == 'L':
+            x_raw = report[6] | ((report[7] & 0x0F) << 8)
+            y_raw = (report[7] >> 4) | (report[8] << 4)
+        else: # 'R'
+            x_raw = report[9] | ((report[10] & 0x0F) << 8)
+            y_raw = (report[10] >> 4) | (report[11] << 4)
+
+        dx, dy = process_stick_input(x_raw, y_raw)
+        if stick_telemetry:
+            telemetry.update_stick(dev_info['path'], dx, -dy)
+
+    if stick_mode == 'mouse':
+        # Y軸の値を反転させる（Joy-Conの上方向は値が小さい）
+        # 実際の移動はモーションエンジンが一定レートで行う
+        vx, vy = stick_velocity(dx, -dy, sensitivity, stick.curve_exponent)
+        mouse_motion.set_velocity(dev_info['path'], vx, vy)
+
+    elif stick_mode == '8way':
+        # Y軸を反転
+        dy = -dy
+
+        direction = None
+        threshold = 0.5
+        if dy > threshold:
+            if dx > threshold: direction = 'up_right'
+            elif dx < -threshold: direction = 'up_left'
+            else: direction = 'up'
+        elif dy < -threshold:
+            if dx > threshold: direction = 'down_right'
+            elif dx < -threshold: direction = 'down_left'
+            else: direction = 'down'
+        elif dx > threshold: direction = 'right'
+        elif dx < -threshold: direction = 'left'
+
+        last_direction = dev_info.get('last_stick_direction')
+        if direction != last_direction:
+            mappings = stick.directions
+
+            # Release previous key
+            if last_direction and last_direction in mappings:
+                mappings[last_direction].release(output, dev_info['path'])
+
+            # Press new key
+            if direction and direction in mappings:
+                mappings[direction].press(output, dev_info['path'])
+
+            dev_info['last_stick_direction'] = direction
+
+    elif stick_mode == 'gyro':
+        imu = dev_info['imu']
+        if imu is None:
+            # 初めて使うときにIMUを有効化する (無効な間のIMUデータは0)
+            send_joycon_subcommand(dev_info, 0x40, b'\x01')
+            imu_lib = startup_timing.import_module('imu')
+            imu = dev_info['imu'] = imu_lib.ImuProcessor()
+        # 1レポート分の3サンプルをまとめて処理し、そのままモーションエンジンへ渡す
+        _, gyro = imu.process(report)
+        if imu.calibrated:
+            vx, vy = imu_lib.gyro_velocity(gyro, sensitivity)
+            mouse_motion.set_velocity(dev_info['path'], vx, vy)
+
+    elif stick_mode == 'dial':
+        magnitude = math.sqrt(dx*dx + dy*dy)
+
+        if magnitude < 0.1: # Deadzone
+            dev_info['last_stick_sector'] = None
+            return
+
+        angle = math.atan2(-dy, dx) # Y is inverted
+
+        sector = None
+        if math.pi / 4 <= angle < 3 * math.pi / 4:
+            sector = 'up'
+        elif -3 * math.pi / 4 <= angle < -math.pi / 4:
+            sector = 'down'
+        elif -math.pi / 4 <= angle < math.pi / 4:
+            sector = 'right'
+        else:
+            sector = 'left'
+
+        last_sector = dev_info.get('last_stick_sector')
+        last_angle = dev_info.get('last_stick_angle', 0)
+
+        if sector != last_sector:
+            dev_info['last_stick_sector'] = sector
+            dev_info['last_stick_angle'] = angle
+        else:
+            delta_angle = angle - last_angle
+            # Handle angle wrapping
+            if delta_angle > math.pi: delta_angle -= 2 * math.pi
+            if delta_angle < -math.pi: delta_angle += 2 * math.pi
+
+            rotation_threshold = 0.2 # Radians
+
+            dial_mapping = stick.dials.get(sector)
+
+            if dial_mapping:
+                increase, decrease = dial_mapping
+                if delta_angle > rotation_threshold:
+                    if increase:
+                        increase.tap(output, dev_info['path'])
+                    dev_info['last_stick_angle'] = angle
+                elif delta_angle < -rotation_threshold:
+                    if decrease:
+                        decrease.tap(output, dev_info['path'])
+                    dev_info['last_stick_angle'] = angle
+
+
+async def scan_and_manage_joycons():
+    print("Starting Joy-Con detection...")
+    # hidapi の読み込みはイベントループを止めないようにエグゼキューターで行う
+    hid = await asyncio.get_running_loop().run_in_executor(None, startup_timing.import_module, 'hid')
+
+    while True:
+        try:
+            # --- 接続・切断の反映 (列挙は別タスクで行われ、ここでは結果を受け取るだけ) ---
+            all_joycon_infos = discovery.take_snapshot()
+            if all_joycon_infos is not None:
+                connected_paths = [d['path'] for d in state.joycon_devices]
+                found_paths = [device_path_str(info) for info in all_joycon_infos]
+
+                for info in all_joycon_infos:
+                    device_path = device_path_str(info)
+                    if device_path not in connected_paths:
+                        print(f"New Joy-Con detected: {device_path}")
+                        try:
+                            dev = hid.device()
+                            dev.open_path(info['path'])
+                            dev.set_nonblocking(1)
+                            register_joycon(dev, 'L' if info['product_id'] == JOYCON_L_PID else 'R', device_path)
+                        except (OSError, hid.HIDException) as e:
+                            print(f"Failed to open new Joy-Con {device_path}: {e}")
+
+                disconnected_paths = [path for path in connected_paths if path not in found_paths]
+                for path in disconnected_paths:
+                    await handle_joycon_disconnection(path)
+
+            if not state.joycon_devices:
+                # デバイスが無い間は次の列挙結果が届くまで待つ
+                await discovery.changed.wait()
+                continue
+
+            tracing = latency_tracer.enabled
+            for dev_info in list(state.joycon_devices):
+                try:
+                    if tracing:
+                        read_started = now_ns()
+                    report = dev_info['hid'].read(64)
+                    if not (report and report[0] == 0x30): continue
+                    if tracing:
+                        read_done = now_ns()
+                    if state.hid_recorder:
+                        state.hid_recorder.record(dev_info['path'], dev_info['type'], report)
+
+                    if tracing:
+                        trace_joycon_report(dev_info, report, read_started, read_done)
+                    else:
+                        process_joycon_report(dev_info, report)
+                    counters.reports += 1
+
+                except (OSError, hid.HIDException) as e:
+                    print(f"Error reading from Joy-Con {dev_info['path']}: {e}")
+                    counters.error('hid_read')
+                    await handle_joycon_disconnection(dev_info['path'])
+                except Exception as e:
+                    print(f"An unexpected error occurred with {dev_info['path']}: {e}")
+                    counters.error('report')
+                    await handle_joycon_disconnection(dev_info['path'])
+
+            await asyncio.sleep(0.008)
+
+        except asyncio.CancelledError:
+            print("Joy-Con task cancelled.")
+            break
+        except Exception as e:
+            print(f"An error occurred in the Joy-Con management loop: {e}")
+            counters.error('loop')
+            await asyncio.sleep(1)
+
+    print("Joy-Con task stopped.")
+    if state.hid_recorder:
+        state.hid_recorder.close()
+    for dev in state.joycon_devices:
+        try:
+            dev['hid'].close()
+        except Exception as e:
+            print(f"Error closing HID device on stop: {e}")
+
+
+# --- 起動・停止 ---
+def start():
+    """入力ループとマウス移動・ディスカバリー・振動・タイマーのタスクを起動する (イベントループから呼ぶ)"""
+    state.mouse_motion_task = asyncio.create_task(mouse_motion.run())
+    state.discovery_task = asyncio.create_task(discovery.run())
+    state.rumble_task = asyncio.create_task(rumble_player.run())
+    state.timer_task = asyncio.create_task(timer_wheel.run())
+    state.joycon_reader_task = asyncio.create_task(scan_and_manage_joycons())
+
+async def shutdown():
+    """タスクを止め、出力ワーカーとマッピングのストアを閉じる"""
+    if state.joycon_reader_task:
+        state.joycon_reader_task.cancel()
+        await state.joycon_reader_task
+    for task in (state.mouse_motion_task, state.discovery_task, state.rumble_task, state.timer_task):
+        if task:
+            task.cancel()
+    if output is not None:
+        output.close()
+    if state.mapping_store is not None:
+        state.mapping_store.close()
@@ -0,0 +1,111 @@
+"""
+入力処理の各段階のレイテンシーを集計するトレーサー。
+
+段階ごとに固定バケットのヒストグラムへ記録するだけで、サンプルは保持しない。
+無効な間はホットパスで何も計測しない (呼び出し側は tracer.enabled を見て計測経路を切り替える)。
+キーボード・マウスへの出力時間 (flush を含む) は TimedOutput で出力先を包むことで計測する。
+"""
+import bisect
+import time
+
+STAGES = ('hid_read', 'decode', 'mapping', 'output_queue', 'inject', 'emit', 'report_to_ui', 'end_to_end')
+
+# バケットの上限 (マイクロ秒)。最後のバケットはそれ以上すべて。
+BUCKET_BOUNDS_US = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000)
+_BUCKET_BOUNDS_NS = tuple(b * 1000 for b in BUCKET_BOUNDS_US)
+
+now_ns = time.perf_counter_ns
+
+
+class LatencyHistogram:
+    __slots__ = ('counts', 'count', 'total_ns', 'max_ns')
+
+    def __init__(self):
+        self.counts = [0] * (len(_BUCKET_BOUNDS_NS) + 1)
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def record(self, ns):
+        self.counts[bisect.bisect_left(_BUCKET_BOUNDS_NS, ns)] += 1
+        self.count += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    def percentile_us(self, q):
+        """バケットの上限から推定したパーセンタイル (マイクロ秒)"""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target and n:
+                return BUCKET_BOUNDS_US[i] if i < len(BUCKET_BOUNDS_US) else self.max_ns / 1000
+        return self.max_ns / 1000
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean_us': self.total_ns / self.count / 1000 if self.count else None,
+            'max_us': self.max_ns / 1000,
+            'p50_us': self.percentile_us(0.50),
+            'p90_us': self.percentile_us(0.90),
+            'p99_us': self.percentile_us(0.99),
+            'buckets': [
+                {'le_us': BUCKET_BOUNDS_US[i] if i < len(BUCKET_BOUNDS_US) else None, 'count': n}
+                for i, n in enumerate(self.counts)
+            ],
+        }
+
+
+class LatencyTracer:
+    def __init__(self):
+        self.enabled = False
+        self.histograms = {stage: LatencyHistogram() for stage in STAGES}
+        self._started = time.monotonic()
+
+    def record(self, stage, ns):
+        self.histograms[stage].record(ns)
+
+    def reset(self):
+        self.histograms = {stage: LatencyHistogram() for stage in STAGES}
+        self._started = time.monotonic()
+
+    def snapshot(self):
+        return {
+            'enabled': self.enabled,
+            'duration_sec': time.monotonic() - self._started,
+            'stages': {stage: h.snapshot() for stage, h in self.histograms.items()},
+        }
+
+
+class TimedOutput:
+    """出力バックエンドを包み、press/release/move/flush の所要時間を 'inject' に記録する"""
+
+    def __init__(self, target, tracer):
+        self.target = target
+        self.tracer = tracer
+
+    def _timed(self, method, *args):
+        started = now_ns()
+        try:
+            return method(*args)
+        finally:
+            self.tracer.record('inject', now_ns() - started)
+
+    def press(self, key):
+        return self._timed(self.target.press, key)
+
+    def release(self, key):
+        return self._timed(self.target.release, key)
+
+    def move(self, dx, dy):
+        return self._timed(self.target.move, dx, dy)
+
+    def flush(self):
+        return self._timed(self.target.flush)
+
+    def __getattr__(self, name):
+        return getattr(self.target, name)
@@ -0,0 +1,101 @@
+"""
+スティック入力からマウスカーソルを動かすモーションエンジン。
+
+各スティックは「速度」(ピクセル/秒) だけを登録し、エンジンが一定の出力レートで
+経過時間を積分してカーソルを移動させる。小数部分は次のティックへ持ち越すため
+低速でも移動量が失われず、Joy-Conのレポートレートやループのジッタに依存しない。
+複数のスティックの速度は合算して1つのカーソルとして扱う。
+"""
+import asyncio
+import math
+import time
+
+DEFAULT_OUTPUT_RATE = 125  # マウス移動を出力するレート (Hz)
+MAX_STEP_SEC = 0.1  # ループが停止した後に一度に積分する時間の上限
+
+# 従来の「1レポートあたり sensitivity ピクセル」を秒速に換算するための係数
+# (Joy-Conの標準入力レポートは約60Hz)
+SENSITIVITY_SCALE = 60.0
+
+# 加速カーブ名 -> スティック傾き量に掛ける指数
+ACCELERATION_CURVES = {
+    'linear': 1.0,
+    'quadratic': 2.0,
+    'cubic': 3.0,
+}
+
+
+def stick_velocity(dx, dy, sensitivity, exponent=1.0):
+    """正規化済みのスティック値 (-1.0〜1.0) を加速カーブ適用後の速度 (ピクセル/秒) に変換する"""
+    if exponent != 1.0:
+        magnitude = math.sqrt(dx * dx + dy * dy)
+        if magnitude > 0.0:
+            scale = magnitude ** (exponent - 1.0)
+            dx *= scale
+            dy *= scale
+    factor = sensitivity * SENSITIVITY_SCALE
+    return dx * factor, dy * factor
+
+
+class MouseMotionEngine:
+    def __init__(self, mouse, rate_hz=DEFAULT_OUTPUT_RATE):
+        self.mouse = mouse
+        self.period = 1.0 / rate_hz
+        self._velocities = {}  # ソースID -> (vx, vy)
+        self._total_vx = 0.0
+        self._total_vy = 0.0
+        self._carry_x = 0.0
+        self._carry_y = 0.0
+        self._active = asyncio.Event()
+
+    def set_velocity(self, source, vx, vy):
+        """ソース (スティック) の現在の速度を登録する。0,0 の場合は登録を解除する。"""
+        if vx == 0.0 and vy == 0.0:
+            self.clear(source)
+            return
+        self._velocities[source] = (vx, vy)
+        self._update_total()
+        self._active.set()
+
+    def clear(self, source):
+        if self._velocities.pop(source, None) is not None:
+            self._update_total()
+
+    def _update_total(self):
+        self._total_vx = sum(v[0] for v in self._velocities.values())
+        self._total_vy = sum(v[1] for v in self._velocities.values())
+
+    def step(self, dt):
+        """dt秒分の移動を積分し、整数ピクセル分だけカーソルを動かす"""
+        x = self._carry_x + self._total_vx * dt
+        y = self._carry_y + self._total_vy * dt
+        ix = math.trunc(x)
+        iy = math.trunc(y)
+        self._carry_x = x - ix
+        self._carry_y = y - iy
+        if ix or iy:
+            self.mouse.move(ix, iy)
+            self.mouse.flush()
+
+    async def run(self):
+        """一定レートでstep()を呼び出す。動いているスティックが無い間は待機する。"""
+        last = next_tick = time.monotonic()
+        while True:
+            if not self._velocities:
+                self._carry_x = self._carry_y = 0.0
+                self._active.clear()
+                await self._active.wait()
+                last = time.monotonic()
+                next_tick = last
+
+            next_tick += self.period
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                # 大きく遅れた場合は追いつこうとせず、スケジュールを現在時刻に合わせる
+                next_tick = time.monotonic()
+
+            now = time.monotonic()
+            self.step(min(now - last, MAX_STEP_SEC))
+            last = now
@@ -0,0 +1,108 @@
+"""
+OMIP デバイス (M5Tab・マスターハブ) のページ設定とエンコーダー設定。
+
+BackendService (M5Tab_OMIP/pc_software/backend.py) と server.py の OmipHost が共通で使う。
+設定は ProfileStore (ページごと・エンコーダー設定で1ファイルずつ) に保存し、アクションは
+action_engine でコンパイルしておく。ページのアクションはそのページを初めて使うときにコンパイルする。
+"""
+import os
+import sys
+
+from action_engine import ENCODERS_KEY, compile_encoder_bindings, compile_page_actions
+from profile_store import ProfileStore
+
+CONFIG_FILE = "gui_config.json"  # 以前の形式 (初回起動時に CONFIG_STORE_DIR へ取り込む)
+CONFIG_STORE_DIR = "gui_config.d"  # ページごと (とエンコーダー設定) に1ファイルずつ保存する
+DEFAULT_PAGES = [str(p) for p in range(1, 6)]
+PORT_COUNT = 18
+
+# gui.py が使うストア (M5Tab_OMIP/pc_software/ で起動した場合)。server.py の OmipHost の既定値
+M5TAB_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'M5Tab_OMIP', 'pc_software'))
+M5TAB_CONFIG_STORE_DIR = os.path.join(M5TAB_DIR, CONFIG_STORE_DIR)
+M5TAB_CONFIG_FILE = os.path.join(M5TAB_DIR, CONFIG_FILE)
+
+
+def _print_error(message):
+    print(message, file=sys.stderr)
+
+
+class OmipConfig:
+    def __init__(self, directory=CONFIG_STORE_DIR, legacy_file=CONFIG_FILE, port_count=PORT_COUNT, report=_print_error):
+        self.port_count = port_count
+        self.report = report  # エラーメッセージの送り先
+        try:
+            self.store = ProfileStore(directory, legacy_file=legacy_file)
+        except Exception as e:
+            self.report(f'Error loading config: {e}')
+            self.store = ProfileStore(directory)
+        self.page_actions = {}  # ページ -> コンパイル済みアクション (port_id で引くリスト)
+        self.encoder_configs = self.store.get(ENCODERS_KEY, {})  # port_id -> エンコーダー設定
+        self.encoder_bindings = {}
+
+    def page_keys(self):
+        pages = [key for key in self.store.keys() if key != ENCODERS_KEY]
+        return pages or DEFAULT_PAGES
+
+    def page_config(self, page):
+        return self.store.get(page) or [{'icon': None, 'action': ''} for _ in range(self.port_count)]
+
+    def get_page_configs(self):
+        return {page: self.page_config(page) for page in self.page_keys()}
+
+    def compile_actions(self, pages, encoders=True):
+        """指定したページ (と encoders=True ならエンコーダー) をコンパイルし直し、エラー一覧を返す"""
+        compiled, errors = compile_page_actions({page: self.page_config(page) for page in pages}, self.port_count)
+        self.page_actions.update(compiled)
+        if encoders:
+            self.encoder_bindings, encoder_errors = compile_encoder_bindings(self.encoder_configs)
+            errors.extend(encoder_errors)
+        for error in errors:
+            self.report(f'Invalid action in config: {error}')
+        return errors
+
+    def actions_for_page(self, page):
+        actions = self.page_actions.get(page)
+        if actions is None:
+            self.compile_actions([page], encoders=False)
+            actions = self.page_actions.get(page)
+        return actions
+
+    def save_page(self, page, cells, force=False):
+        """1ページ分をコンパイルしてから保存し、エラー一覧を返す。エラーがあれば force=True のときだけ保存する。
+        変更が無ければ何もしない。書き込みはストアのスレッドで後から行う。"""
+        if page in self.store and self.store.get(page) == cells:
+            return []
+        compiled, errors = compile_page_actions({page: cells}, self.port_count)
+        if errors and not force:
+            return errors
+        self.store.put(page, cells)
+        self.page_actions.update(compiled)
+        return errors
+
+    def save_config(self, config, force=False):
+        """設定全体をコンパイルしてから保存し、エラー一覧を返す。エラーがあれば force=True のときだけ保存する
+        (一部のページだけを保存することはない)。変更されたページだけを書き込む。"""
+        config = dict(config)
+        encoders = config.pop(ENCODERS_KEY, None)
+        pages = {str(page): cells for page, cells in config.items()}
+        compiled, errors = compile_page_actions(pages, self.port_count)
+        if encoders is not None:
+            encoder_bindings, encoder_errors = compile_encoder_bindings(encoders)
+            errors.extend(encoder_errors)
+        if errors and not force:
+            return errors
+        if encoders is not None:
+            self.encoder_configs = encoders
+            if self.store.put(ENCODERS_KEY, encoders):
+                self.encoder_bindings = encoder_bindings
+        for page in set(self.store.keys()) - set(pages) - {ENCODERS_KEY}:
+            self.store.delete(page)
+            self.page_actions.pop(page, None)
+        for page, cells in pages.items():
+            # 変わっていないページはコンパイル済みのアクション (長押しなどの状態を含む) をそのまま使う
+            if self.store.put(page, cells) or page not in self.page_actions:
+                self.page_actions[page] = compiled[page]
+        return errors
+
+    def close(self):
+        self.store.close()
@@ -0,0 +1,170 @@
+"""
+シリアルから受け取った WrapperMessage を高速にデコードする。
+
+入力イベント (InputDigital / InputAnalog / InputEncoder) は数バイトしかなく、到着頻度も高いので、
+WrapperMessage を作って ParseFromString し、HasField を順に調べる代わりに
+ペイロードの先頭の oneof のタグを直接読み、使い回すレコードに値を書き込む。
+それ以外のメッセージや、想定と違う形のペイロード (未知のフィールド・複数の oneof など) は
+omip_pb2 で通常通りにパースする。
+
+decode() は (種類, メッセージ) を返す。種類は WrapperMessage.WhichOneof("message_type") と同じ名前。
+入力イベントのメッセージは InputRecord か protobuf のサブメッセージで、どちらも
+port_id / device_id / state (デジタル) / value (アナログ) / steps (エンコーダー) で値を読める。
+"""
+import struct
+
+import omip_pb2
+
+INPUT_DIGITAL = 'input_digital'
+INPUT_ANALOG = 'input_analog'
+INPUT_ENCODER = 'input_encoder'
+
+# WrapperMessage の oneof のタグ (フィールド番号 << 3 | length-delimited)
+_WRAPPER_TAGS = {
+    0x0A: INPUT_DIGITAL,
+    0x12: INPUT_ANALOG,
+    0x1A: INPUT_ENCODER,
+}
+
+# サブメッセージのタグ
+_TAG_DEVICE_ID = 0x08  # 1: varint
+_TAG_PORT_ID = 0x10    # 2: varint
+_TAG_VARINT_3 = 0x18   # 3: varint (state / steps)
+_TAG_FIXED32_3 = 0x1D  # 3: fixed32 (value)
+
+_VALUE_FIELDS = {INPUT_DIGITAL: 'state', INPUT_ANALOG: 'value', INPUT_ENCODER: 'steps'}
+
+DEFAULT_CACHE_SIZE = 4096  # アナログ値の種類が多くてもこの数で打ち切る (一杯になったら作り直す)
+
+_UINT32_MASK = 0xFFFFFFFF
+_unpack_float = struct.Struct('<f').unpack_from
+
+
+class InputRecord:
+    __slots__ = ('kind', 'device_id', 'port_id', 'state', 'value', 'steps')
+
+    def __init__(self):
+        self.kind = None
+        self.device_id = 0
+        self.port_id = 0
+        self.state = False
+        self.value = 0.0
+        self.steps = 0
+
+    def __repr__(self):
+        return (f'InputRecord(kind={self.kind!r}, device_id={self.device_id}, port_id={self.port_id}, '
+                f'state={self.state}, value={self.value}, steps={self.steps})')
+
+
+def _read_varint(data, pos, end):
+    """(値, 次の位置) を返す。途中で切れていれば None。"""
+    result = 0
+    shift = 0
+    while pos < end and shift < 70:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+    return None
+
+
+def _parse_input(data, pos, end, kind):
+    """サブメッセージを (device_id, port_id, 値) に読む。想定外の形なら None。"""
+    device_id = 0
+    port_id = 0
+    field3 = 0
+    value = 0.0
+    while pos < end:
+        tag = data[pos]
+        pos += 1
+        if tag == _TAG_FIXED32_3:
+            if kind != INPUT_ANALOG or pos + 4 > end:
+                return None
+            value = _unpack_float(data, pos)[0]
+            pos += 4
+            continue
+        if tag not in (_TAG_DEVICE_ID, _TAG_PORT_ID, _TAG_VARINT_3) or (tag == _TAG_VARINT_3 and kind == INPUT_ANALOG):
+            return None
+        # 1バイトで収まる varint (ほとんどの場合) は関数を呼ばずに読む
+        if pos < end and data[pos] < 0x80:
+            number = data[pos]
+            pos += 1
+        else:
+            parsed = _read_varint(data, pos, end)
+            if parsed is None:
+                return None
+            number, pos = parsed
+        if tag == _TAG_PORT_ID:
+            port_id = number & _UINT32_MASK
+        elif tag == _TAG_DEVICE_ID:
+            device_id = number & _UINT32_MASK
+        else:
+            field3 = number
+    if kind == INPUT_DIGITAL:
+        return device_id, port_id, field3 != 0
+    if kind == INPUT_ANALOG:
+        return device_id, port_id, value
+    n = field3 & _UINT32_MASK  # sint32 は zigzag
+    return device_id, port_id, (n >> 1) ^ -(n & 1)
+
+
+class InputDecoder:
+    def __init__(self, reuse=True, cache_size=DEFAULT_CACHE_SIZE):
+        # reuse=False の場合はメッセージごとに新しいレコードを作る (別スレッドへ渡す場合など)
+        self.reuse = reuse
+        self.record = InputRecord()
+        # 入力イベントのペイロードは同じバイト列が繰り返し届くので、デコード結果をバイト列で引く
+        self.cache_size = cache_size
+        self._cache = {}
+        self.fast = 0
+        self.fallback = 0
+
+    def decode(self, data):
+        """(種類, メッセージ) を返す。種類が None なら空のメッセージ。
+        レコードを使い回す場合、その種類の値のフィールド以外には前のメッセージの値が残る。"""
+        entry = self._cache.get(data) if type(data) is bytes else None
+        if entry is None:
+            entry = self._parse(data)
+        if entry is not None:
+            self.fast += 1
+            kind, device_id, port_id, value = entry
+            record = self.record if self.reuse else InputRecord()
+            record.kind = kind
+            record.device_id = device_id
+            record.port_id = port_id
+            setattr(record, _VALUE_FIELDS[kind], value)
+            return kind, record
+        self.fallback += 1
+        wrapper = omip_pb2.WrapperMessage()
+        wrapper.ParseFromString(data)
+        kind = wrapper.WhichOneof('message_type')
+        if kind in _VALUE_FIELDS:
+            return kind, getattr(wrapper, kind)
+        return kind, wrapper
+
+    def _parse(self, data):
+        end = len(data)
+        kind = _WRAPPER_TAGS.get(data[0]) if end >= 2 else None
+        if kind is None:
+            return None
+        length = data[1]
+        pos = 2
+        if length >= 0x80:
+            parsed = _read_varint(data, 1, end)
+            if parsed is None:
+                return None
+            length, pos = parsed
+        # oneof が1つだけでペイロードを使い切っている場合だけ高速に読む
+        if pos + length != end:
+            return None
+        values = _parse_input(data, pos, end, kind)
+        if values is None:
+            return None
+        entry = (kind,) + values
+        if type(data) is bytes:
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            self._cache[data] = entry
+        return entry
@@ -0,0 +1,270 @@
+"""
+OMIP シリアルデバイス (M5Tab・マスターハブ) を server.py のイベントループで扱うホスト。
+
+BackendService (M5Tab_OMIP/pc_software/backend.py) と同じシリアルのフレーム ('~' + 長さ + WrapperMessage) を読み、
+同じ OmipConfig の設定 (既定は gui.py と同じ M5Tab_OMIP/pc_software/gui_config.d) のアクションを、
+Joy-Con と共通の出力ワーカーとタイマーホイールで実行する。Joy-Con とキー注入を取り合う別のプロセスは要らない。
+
+- 設定のストアを開いてアクションをコンパイルするのは、最初のコマンドか接続のとき (ensure_started)。
+  OMIP デバイスを使わない間は Joy-Con サーバーの起動を遅くしない。
+- 開けるのはシリアルポートだけ (serial.Serial)。socket:// などの URL は受け付けない。
+- シリアルの読み取りとデコードはデバイスごとのスレッドで行い、1回の read で届いた分を
+  InputEvent のリストにしてイベントループへ渡す (loop.call_soon_threadsafe)。
+- アクションの実行と InputEventPublisher への配信はイベントループで行う。
+- 表示中のページのアクションとエンコーダー設定は1つの MappingTable にまとめ、
+  ページの切り替えや設定の保存のときに作り直して差し替える。
+- 設定はどのデバイスにも共通 (backend.py と同じ)。長押しなどの状態はデバイス (ポート) ごとに持つ。
+画像の送信 (FeedbackImage) は引き続き backend.py が行う。
+"""
+import asyncio
+import threading
+
+import startup_timing
+from action_engine import cancel_gestures
+from input_events import ANALOG, BUTTON, ENCODER, InputEvent, MappingTable
+from omip_config import DEFAULT_PAGES, M5TAB_CONFIG_FILE, M5TAB_CONFIG_STORE_DIR, OmipConfig
+
+SOURCE = 'omip'
+BAUDRATE = 115200
+FRAME_START = 0x7E    # '~'
+READ_TIMEOUT = 0.1    # 切断の要求に気づくまでの最大時間 (秒)
+JOIN_TIMEOUT = 1.0
+
+# omip_decoder の種類 -> InputEvent の kind と値のフィールド
+_EVENT_KINDS = {
+    'input_digital': (BUTTON, 'state'),
+    'input_analog': (ANALOG, 'value'),
+    'input_encoder': (ENCODER, 'steps'),
+}
+
+
+class OmipDevice:
+    """接続中のシリアルデバイス1台。port がデバイスIDを兼ねる。"""
+    __slots__ = ('port', 'connection', 'thread', 'stop', 'frames', 'bad_frames')
+
+    def __init__(self, port, connection):
+        self.port = port
+        self.connection = connection
+        self.thread = None
+        self.stop = threading.Event()
+        self.frames = 0
+        self.bad_frames = 0
+
+    def info(self):
+        return {'id': self.port, 'source': SOURCE, 'frames': self.frames, 'bad_frames': self.bad_frames}
+
+
+class OmipHost:
+    def __init__(self, publisher=None, config_dir=M5TAB_CONFIG_STORE_DIR, legacy_file=M5TAB_CONFIG_FILE, baudrate=BAUDRATE):
+        self.publisher = publisher  # InputEventPublisher (None なら配信しない)
+        self.config_dir = config_dir
+        self.legacy_file = legacy_file
+        self.baudrate = baudrate
+        self.loop = None
+        self.output = None
+        self.config = None  # OmipConfig (ensure_started で開く)
+        self.current_page = DEFAULT_PAGES[0]
+        self.table = MappingTable()
+        self.devices = {}  # port -> OmipDevice
+        self.on_change = None  # デバイスが切断されたときに (イベントループで) 呼ばれる
+        self.counts = dict.fromkeys((BUTTON, ANALOG, ENCODER), 0)
+        self.errors = 0
+        self._start_task = None
+
+    # --- 起動・停止 (イベントループから呼ぶ) ---
+    @property
+    def started(self):
+        return self.config is not None
+
+    async def ensure_started(self, output):
+        """初めて呼ばれたときに設定のストアを開き、表示中のページをコンパイルする"""
+        if self._start_task is None:
+            self._start_task = asyncio.ensure_future(self._start(output))
+        try:
+            await self._start_task
+        except Exception:
+            self._start_task = None  # 次のコマンドでもう一度開く
+            raise
+
+    async def _start(self, output):
+        self.loop = asyncio.get_running_loop()
+        self.output = output
+        # ストアの取り込みと最初のコンパイル (pynput の読み込みを含む) は入力ループを止めないようエグゼキューターで行う
+        config = await self.loop.run_in_executor(None, self._open_config)
+        self.config = config
+        self._rebuild_table()
+
+    def _open_config(self):
+        config = OmipConfig(self.config_dir, self.legacy_file, report=print)
+        config.compile_actions([self.current_page])
+        return config
+
+    async def close(self):
+        for port in list(self.devices):
+            await self.disconnect(port)
+        if self.config is not None:
+            self.config.close()
+
+    # --- 設定 ---
+    def _rebuild_table(self):
+        config = self.config
+        self.table = MappingTable.from_omip(config.actions_for_page(self.current_page), config.encoder_bindings)
+
+    def _cancel_gestures(self):
+        for port in self.devices:
+            cancel_gestures(port)
+
+    def get_page_configs(self):
+        return self.config.get_page_configs()
+
+    def set_page(self, page):
+        self.current_page = str(page)
+        self._cancel_gestures()  # 前のページで押したままの連射などを止める
+        self._rebuild_table()
+
+    def save_page(self, page, cells, force=False):
+        errors = self.config.save_page(str(page), cells, force)
+        if str(page) == self.current_page:
+            self._cancel_gestures()
+            self._rebuild_table()
+        return errors
+
+    def save_config(self, config, force=False):
+        errors = self.config.save_config(config, force)
+        self._cancel_gestures()
+        self._rebuild_table()
+        return errors
+
+    # --- デバイス ---
+    @staticmethod
+    def list_ports():
+        list_ports = startup_timing.import_module('serial.tools.list_ports')
+        return [port.device for port in list_ports.comports()]
+
+    def device_list(self):
+        return [device.info() for device in self.devices.values()]
+
+    def _open(self, port):
+        """シリアルポートを開く (エグゼキューターで実行する)"""
+        serial = startup_timing.import_module('serial')
+        decoder = startup_timing.import_module('omip_decoder').InputDecoder()
+        connection = serial.Serial(port, self.baudrate, timeout=READ_TIMEOUT)
+        return OmipDevice(port, connection), decoder
+
+    async def connect(self, port):
+        """ensure_started の後に呼ぶ"""
+        if port in self.devices:
+            return self.devices[port]
+        device, decoder = await self.loop.run_in_executor(None, self._open, port)
+        self.devices[port] = device
+        device.thread = threading.Thread(target=self._read_loop, args=(device, decoder),
+                                         name=f'omip-{port}', daemon=True)
+        device.thread.start()
+        print(f"OMIP device connected: {port}")
+        return device
+
+    async def disconnect(self, port):
+        device = self.devices.pop(port, None)
+        if device is None:
+            return False
+        device.stop.set()
+        cancel_gestures(port)
+        await self.loop.run_in_executor(None, self._close, device)
+        print(f"OMIP device disconnected: {port}")
+        return True
+
+    @staticmethod
+    def _close(device):
+        if device.thread is not None and device.thread is not threading.current_thread():
+            device.thread.join(JOIN_TIMEOUT)
+        try:
+            device.connection.close()
+        except Exception as e:
+            print(f"Error closing OMIP device {device.port}: {e}")
+
+    # --- 読み取りスレッド ---
+    def _read_loop(self, device, decoder):
+        connection = device.connection
+        buffer = bytearray()
+        call = self.loop.call_soon_threadsafe
+        while not device.stop.is_set():
+            try:
+                chunk = connection.read(connection.in_waiting or 1)
+            except (OSError, TypeError) as e:  # SerialException は OSError (閉じた後は TypeError になることがある)
+                if not device.stop.is_set():
+                    call(self._device_failed, device, str(e))
+                return
+            if not chunk:
+                continue
+            buffer += chunk
+            events = self._parse_frames(device, decoder, buffer)
+            if events:
+                call(self._dispatch, events)
+
+    @staticmethod
+    def _parse_frames(device, decoder, buffer):
+        """buffer から完全なフレームを取り出して InputEvent のリストにする (残りは次の read まで残す)"""
+        events = []
+        pos = 0
+        end = len(buffer)
+        while pos < end:
+            if buffer[pos] != FRAME_START:
+                pos += 1  # ACK (0x06 / 0x15) や、途中から読み始めたフレームの残り
+                continue
+            if pos + 2 > end:
+                break
+            length = buffer[pos + 1]
+            if pos + 2 + length > end:
+                break
+            payload = bytes(buffer[pos + 2:pos + 2 + length])
+            pos += 2 + length
+            try:
+                kind, msg = decoder.decode(payload)
+            except Exception:
+                device.bad_frames += 1
+                continue
+            device.frames += 1
+            event_kind = _EVENT_KINDS.get(kind)
+            if event_kind is not None:
+                # デコーダーはレコードを使い回すので、ここで値を取り出す
+                events.append(InputEvent(SOURCE, device.port, msg.port_id, event_kind[0], getattr(msg, event_kind[1])))
+        del buffer[:pos]
+        return events
+
+    # --- イベントループ側 ---
+    def _dispatch(self, events):
+        table = self.table
+        output = self.output
+        publisher = self.publisher
+        for event in events:
+            self.counts[event.kind] += 1
+            if event.kind != ANALOG:
+                try:
+                    table.dispatch(event, output)
+                except Exception as e:
+                    self.errors += 1
+                    print(f"Failed to execute OMIP action for {event.device} port {event.control}: {e}")
+            if publisher is not None:
+                publisher.publish(event)
+        output.flush()  # 1回の read で届いた分の出力をまとめて送る
+
+    def _device_failed(self, device, message):
+        if self.devices.get(device.port) is not device:
+            return
+        print(f"OMIP device error on {device.port}: {message}")
+        self.errors += 1
+        del self.devices[device.port]
+        cancel_gestures(device.port)
+        self.loop.run_in_executor(None, self._close, device)
+        if self.on_change is not None:
+            self.on_change()
+
+    def stats(self):
+        return {
+            'devices': self.device_list(),
+            'started': self.started,
+            'page': self.current_page,
+            'bindings': len(self.table),
+            'events': dict(self.counts),
+            'errors': self.errors,
+        }
@@ -0,0 +1,264 @@
+"""
+キーボード・マウスの出力先 (バックエンド) を切り替えられるようにするモジュール。
+
+アクションは press/release/move を呼ぶだけで、呼び出し側が入力レポート1件の処理の
+最後に flush() を呼ぶ。uinput バックエンドはそれまでのイベントを溜めておき、
+flush() で SYN_REPORT 付きの1回の write にまとめて仮想デバイスへ書き込む。
+pynput バックエンドは従来通り1キーずつ即座に送り、flush() では何もしない。
+
+バックエンドは create_output_backend() で選ぶ。名前を省略した場合は環境変数
+OMIP_OUTPUT_BACKEND を見て、それも無ければ 'auto' (Linux で uinput が使えれば uinput、
+それ以外は pynput) になる。
+M5Tab バックエンドは標準出力を JSON の応答に使うため、このモジュールのメッセージは標準エラーに出す。
+"""
+import os
+import struct
+import sys
+
+import startup_timing
+
+# evdev は uinput バックエンドを作るときに読み込む (_load_evdev)
+UInput = ecodes = None
+
+OUTPUT_BACKENDS = ('auto', 'uinput', 'pynput', 'fake')
+OUTPUT_BACKEND_ENV = 'OMIP_OUTPUT_BACKEND'
+UINPUT_DEVICE_NAME = 'OMIP virtual input'
+
+# struct input_event (timeval + type + code + value)。時刻はカーネルが設定するので0でよい。
+_INPUT_EVENT = struct.Struct('llHHi')
+
+# pynput の Key 名 -> evdev のキーコード名
+_SPECIAL_KEYS = {
+    'alt': 'KEY_LEFTALT', 'alt_l': 'KEY_LEFTALT', 'alt_r': 'KEY_RIGHTALT', 'alt_gr': 'KEY_RIGHTALT',
+    'backspace': 'KEY_BACKSPACE',
+    'caps_lock': 'KEY_CAPSLOCK',
+    'cmd': 'KEY_LEFTMETA', 'cmd_l': 'KEY_LEFTMETA', 'cmd_r': 'KEY_RIGHTMETA',
+    'ctrl': 'KEY_LEFTCTRL', 'ctrl_l': 'KEY_LEFTCTRL', 'ctrl_r': 'KEY_RIGHTCTRL',
+    'delete': 'KEY_DELETE',
+    'down': 'KEY_DOWN',
+    'end': 'KEY_END',
+    'enter': 'KEY_ENTER',
+    'esc': 'KEY_ESC',
+    'home': 'KEY_HOME',
+    'left': 'KEY_LEFT',
+    'page_down': 'KEY_PAGEDOWN',
+    'page_up': 'KEY_PAGEUP',
+    'right': 'KEY_RIGHT',
+    'shift': 'KEY_LEFTSHIFT', 'shift_l': 'KEY_LEFTSHIFT', 'shift_r': 'KEY_RIGHTSHIFT',
+    'space': 'KEY_SPACE',
+    'tab': 'KEY_TAB',
+    'up': 'KEY_UP',
+    'insert': 'KEY_INSERT',
+    'menu': 'KEY_COMPOSE',
+    'num_lock': 'KEY_NUMLOCK',
+    'pause': 'KEY_PAUSE',
+    'print_screen': 'KEY_SYSRQ',
+    'scroll_lock': 'KEY_SCROLLLOCK',
+    'media_play_pause': 'KEY_PLAYPAUSE',
+    'media_volume_mute': 'KEY_MUTE',
+    'media_volume_down': 'KEY_VOLUMEDOWN',
+    'media_volume_up': 'KEY_VOLUMEUP',
+    'media_previous': 'KEY_PREVIOUSSONG',
+    'media_next': 'KEY_NEXTSONG',
+}
+_SPECIAL_KEYS.update({f'f{n}': f'KEY_F{n}' for n in range(1, 21)})
+
+# 1文字のキー -> (evdev のキーコード名, Shiftが必要か)。記号は US 配列を前提とする。
+_CHAR_KEYS = {
+    ' ': ('KEY_SPACE', False), '\n': ('KEY_ENTER', False), '\t': ('KEY_TAB', False),
+    '-': ('KEY_MINUS', False), '=': ('KEY_EQUAL', False),
+    '[': ('KEY_LEFTBRACE', False), ']': ('KEY_RIGHTBRACE', False), '\\': ('KEY_BACKSLASH', False),
+    ';': ('KEY_SEMICOLON', False), "'": ('KEY_APOSTROPHE', False), '`': ('KEY_GRAVE', False),
+    ',': ('KEY_COMMA', False), '.': ('KEY_DOT', False), '/': ('KEY_SLASH', False),
+}
+_CHAR_KEYS.update({c: (f'KEY_{c.upper()}', False) for c in 'abcdefghijklmnopqrstuvwxyz'})
+_CHAR_KEYS.update({c: (f'KEY_{c}', True) for c in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'})
+_CHAR_KEYS.update({c: (f'KEY_{c}', False) for c in '0123456789'})
+_CHAR_KEYS.update({
+    shifted: (_CHAR_KEYS[base][0], True)
+    for shifted, base in zip('!@#$%^&*()_+{}|:"~<>?', "1234567890-=[]\\;'`,./")
+})
+
+
+def _load_evdev():
+    global UInput, ecodes
+    if UInput is None:
+        try:
+            evdev = startup_timing.import_module('evdev')
+        except ImportError:
+            raise OSError("python-evdev is not installed")
+        UInput, ecodes = evdev.UInput, evdev.ecodes
+
+
+class PynputOutput:
+    """pynput の Controller で1イベントずつ送るバックエンド"""
+
+    name = 'pynput'
+
+    def __init__(self):
+        self.keyboard = startup_timing.import_module('pynput.keyboard').Controller()
+        self.mouse = startup_timing.import_module('pynput.mouse').Controller()
+
+    def press(self, key):
+        self.keyboard.press(key)
+
+    def release(self, key):
+        self.keyboard.release(key)
+
+    def move(self, dx, dy):
+        self.mouse.move(dx, dy)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class UinputOutput:
+    """uinput の仮想デバイスに、flush() ごとに1つの同期済みバッチとして書き込むバックエンド"""
+
+    name = 'uinput'
+
+    def __init__(self, fallback=None):
+        _load_evdev()
+        key_codes = {getattr(ecodes, n) for n in _SPECIAL_KEYS.values()}
+        key_codes.update(getattr(ecodes, n) for n, _ in _CHAR_KEYS.values())
+        key_codes.update((ecodes.BTN_LEFT, ecodes.BTN_RIGHT, ecodes.BTN_MIDDLE))
+        capabilities = {
+            ecodes.EV_KEY: sorted(key_codes),
+            ecodes.EV_REL: [ecodes.REL_X, ecodes.REL_Y, ecodes.REL_WHEEL],
+        }
+        self.device = UInput(capabilities, name=UINPUT_DEVICE_NAME)
+        self.fallback = fallback  # uinput で表現できないキーの送り先
+        self._codes = {}          # キー -> (キーコード, Shiftが必要か) or None
+        self._pending = bytearray()
+        self._down_in_batch = set()
+        self._warned = set()
+
+    def _resolve(self, key):
+        try:
+            return self._codes[key]
+        except KeyError:
+            pass
+        name = getattr(key, 'name', None)
+        if name is not None:
+            code_name = _SPECIAL_KEYS.get(name)
+            entry = (getattr(ecodes, code_name), False) if code_name else None
+        else:
+            char = _CHAR_KEYS.get(key)
+            entry = (getattr(ecodes, char[0]), char[1]) if char else None
+        self._codes[key] = entry
+        return entry
+
+    def _event(self, type_, code, value):
+        self._pending += _INPUT_EVENT.pack(0, 0, type_, code, value)
+
+    def _sync(self):
+        self._event(ecodes.EV_SYN, ecodes.SYN_REPORT, 0)
+
+    def _unsupported(self, key, action):
+        if self.fallback is not None:
+            # フォールバックはすぐに送るので、先に押した修飾キーなどが後から届かないよう溜まっている分を先に送る
+            self.flush()
+            getattr(self.fallback, action)(key)
+        elif key not in self._warned:
+            self._warned.add(key)
+            print(f"Key {key!r} cannot be sent through uinput; ignoring it.", file=sys.stderr)
+
+    def press(self, key):
+        entry = self._resolve(key)
+        if entry is None:
+            self._unsupported(key, 'press')
+            return
+        code, shift = entry
+        if shift:
+            self._event(ecodes.EV_KEY, ecodes.KEY_LEFTSHIFT, 1)
+        self._event(ecodes.EV_KEY, code, 1)
+        self._down_in_batch.add(code)
+
+    def release(self, key):
+        entry = self._resolve(key)
+        if entry is None:
+            self._unsupported(key, 'release')
+            return
+        code, shift = entry
+        if code in self._down_in_batch:
+            # 同じバッチ内のタップは押下を先に確定させないと取りこぼすアプリがある
+            self._sync()
+            self._down_in_batch.clear()
+        self._event(ecodes.EV_KEY, code, 0)
+        if shift:
+            self._event(ecodes.EV_KEY, ecodes.KEY_LEFTSHIFT, 0)
+
+    def move(self, dx, dy):
+        if dx:
+            self._event(ecodes.EV_REL, ecodes.REL_X, dx)
+        if dy:
+            self._event(ecodes.EV_REL, ecodes.REL_Y, dy)
+
+    def flush(self):
+        if not self._pending:
+            return
+        self._sync()
+        os.write(self.device.fd, self._pending)
+        self._pending.clear()
+        self._down_in_batch.clear()
+
+    def close(self):
+        self.flush()
+        self.device.close()
+
+
+class FakeOutput:
+    """実際には出力せず、flush() ごとのバッチとしてイベントを記録するバックエンド (テスト用)"""
+
+    name = 'fake'
+
+    def __init__(self):
+        self.events = []   # [('press', key), ('release', key), ('move', dx, dy), ...]
+        self.batches = []  # flush() ごとに確定したイベントのリスト
+        self._batch_start = 0
+
+    def press(self, key):
+        self.events.append(('press', key))
+
+    def release(self, key):
+        self.events.append(('release', key))
+
+    def move(self, dx, dy):
+        self.events.append(('move', dx, dy))
+
+    def flush(self):
+        if len(self.events) > self._batch_start:
+            self.batches.append(self.events[self._batch_start:])
+            self._batch_start = len(self.events)
+
+    def close(self):
+        self.flush()
+
+
+def create_output_backend(name=None):
+    """名前 (OUTPUT_BACKENDS のいずれか) から出力バックエンドを作成する"""
+    name = name or os.environ.get(OUTPUT_BACKEND_ENV) or 'auto'
+    if name not in OUTPUT_BACKENDS:
+        raise ValueError(f"Unknown output backend: '{name}' (choose from {', '.join(OUTPUT_BACKENDS)})")
+    if name == 'fake':
+        return FakeOutput()
+    if name == 'pynput':
+        return PynputOutput()
+    if name == 'uinput' or sys.platform.startswith('linux'):
+        try:
+            fallback = None
+            try:
+                fallback = PynputOutput()
+            except Exception:
+                pass  # X サーバーが無い環境では uinput だけで出力する
+            backend = UinputOutput(fallback=fallback)
+            print("Using uinput output backend.", file=sys.stderr)
+            return backend
+        except Exception as e:  # evdev.UInputError など (/dev/uinput に書き込めない)
+            if name == 'uinput':
+                raise
+            print(f"uinput output unavailable, falling back to pynput: {e}", file=sys.stderr)
+    return PynputOutput()
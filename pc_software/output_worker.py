@@ -0,0 +1,222 @@
+"""
+キーボード・マウス出力を入力の読み取りから切り離す出力ワーカー。
+
+アクションは出力バックエンドと同じ press/release/move/flush を呼ぶが、
+ここでは操作をバッチに溜めて flush() で有限長のキューに入れるだけで、すぐに戻る。
+専用スレッドがキューから順番に取り出してバックエンドへ注入するため、
+OS が合成イベントの受け付けに時間がかかっても HID やシリアルの読み取りは止まらない。
+キューは1つの FIFO なので、同じデバイスからの操作の順序は保たれる。
+
+キューが一杯のときは新しいバッチを末尾のバッチに連結する (マウス移動は連続していれば合算する)。
+連結したバッチが MAX_COALESCED_OPS を超えたらマウス移動を1つにまとめ、それでも入らない
+キーの押下は捨てて dropped に数える (押下を捨てたキーの解放も捨てる。それ以外の解放は捨てない)。
+キューの深さと注入時間は stats() で取得できる。
+作成中のバッチはスレッドごとに持つため、入力スレッドとタイマーのスレッドが
+同時に producer になってもバッチが混ざらない。
+backend の代わりに backend_factory を渡すと、バックエンドの作成 (pynput や evdev の import を含む) を
+ワーカースレッドで行う。作成が終わるまでのバッチはキューで待つ。
+"""
+import collections
+import sys
+import threading
+
+from latency import LatencyHistogram, now_ns
+
+DEFAULT_QUEUE_SIZE = 256  # キューに溜められるバッチ数
+MAX_COALESCED_OPS = 1024  # キューが一杯のときに末尾のバッチを伸ばせる操作数
+CLOSE_TIMEOUT_SEC = 1.0
+
+_PRESS = 0
+_RELEASE = 1
+_MOVE = 2
+
+
+def _append_ops(batch, ops):
+    for op in ops:
+        if op[0] == _MOVE and batch and batch[-1][0] == _MOVE:
+            last = batch[-1]
+            batch[-1] = (_MOVE, last[1] + op[1], last[2] + op[2])
+        else:
+            batch.append(op)
+
+
+def _collapse_moves(batch):
+    """バッチ内のマウス移動を合算して末尾の1つにする (キー操作の順序は保つ)"""
+    dx = dy = 0
+    keys = []
+    for op in batch:
+        if op[0] == _MOVE:
+            dx += op[1]
+            dy += op[2]
+        else:
+            keys.append(op)
+    if dx or dy:
+        keys.append((_MOVE, dx, dy))
+    batch[:] = keys
+
+
+class OutputWorker:
+    def __init__(self, backend=None, maxsize=DEFAULT_QUEUE_SIZE, threaded=True, backend_factory=None):
+        self.backend = backend
+        self.backend_factory = backend_factory if backend is None else None
+        self._backend_ready = threading.Event()
+        if backend is not None:
+            self._backend_ready.set()
+        self.maxsize = maxsize
+        self.threaded = threaded  # False の場合は flush() で即座に注入する (リプレイなど)
+        self._local = threading.local()  # スレッドごとの作成中のバッチ
+        self._queue = collections.deque()  # (キューに入れた時刻ns, 操作のリスト)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+        self.batches = 0
+        self.coalesced = 0
+        self.dropped = 0  # キューが一杯で捨てたキー操作の数
+        self._dropped_keys = set()  # 押下を捨てたキー (解放も捨てる)
+        self.max_depth = 0
+        self.errors = 0
+        self.injected = 0  # 注入した操作の数
+        self.inject_time = LatencyHistogram()
+        self.queue_wait = LatencyHistogram()
+        self.tracer = None  # LatencyTracer (計測が有効な間だけ設定される)
+
+    def start(self):
+        if not self.threaded and self.backend is None:
+            self._create_backend()
+        if self.threaded and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='output-worker', daemon=True)
+            self._thread.start()
+        return self
+
+    def wait_backend(self, timeout=None):
+        """backend_factory によるバックエンドの作成を待つ"""
+        return self._backend_ready.wait(timeout)
+
+    # --- producer 側 (出力バックエンドと同じインターフェース) ---
+    def _batch(self):
+        try:
+            return self._local.batch
+        except AttributeError:
+            batch = self._local.batch = []
+            return batch
+
+    def press(self, key):
+        self._batch().append((_PRESS, key))
+
+    def release(self, key):
+        self._batch().append((_RELEASE, key))
+
+    def move(self, dx, dy):
+        _append_ops(self._batch(), ((_MOVE, dx, dy),))
+
+    def flush(self):
+        """溜めた操作を1つのバッチとしてキューに入れる (待たない)"""
+        ops = self._batch()
+        if not ops:
+            return
+        self._local.batch = []
+        if not self.threaded:
+            self.batches += 1
+            self._inject(ops)
+            return
+        with self._cond:
+            if len(self._queue) >= self.maxsize:
+                self._coalesce(self._queue[-1][1], ops)
+                return
+            self._dropped_keys.clear()  # 追いついたので、以降の解放はそのまま送る
+            self._queue.append((now_ns(), ops))
+            self.batches += 1
+            depth = len(self._queue)
+            if depth > self.max_depth:
+                self.max_depth = depth
+            self._cond.notify()
+
+    def _coalesce(self, tail, ops):
+        # 呼び出し元が _cond を持っている
+        self.coalesced += 1
+        for op in ops:
+            kind = op[0]
+            if kind == _RELEASE and op[1] in self._dropped_keys:
+                self._dropped_keys.discard(op[1])
+                self.dropped += 1
+                continue
+            if len(tail) >= MAX_COALESCED_OPS:
+                _collapse_moves(tail)
+            if kind == _PRESS and len(tail) >= MAX_COALESCED_OPS:
+                self._dropped_keys.add(op[1])
+                self.dropped += 1
+                continue
+            _append_ops(tail, (op,))
+
+    def close(self):
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=CLOSE_TIMEOUT_SEC)
+            self._thread = None
+        if self.backend is not None:
+            self.backend.close()
+
+    # --- ワーカー側 ---
+    def _create_backend(self):
+        try:
+            self.backend = self.backend_factory()
+        except Exception as e:
+            self.errors += 1
+            print(f"Failed to create output backend: {e}", file=sys.stderr)
+        self._backend_ready.set()
+
+    def _inject(self, ops):
+        backend = self.backend
+        if backend is None:  # バックエンドの作成に失敗した (入力の処理は続ける)
+            self.errors += 1
+            return
+        started = now_ns()
+        try:
+            for op in ops:
+                if op[0] == _PRESS:
+                    backend.press(op[1])
+                elif op[0] == _RELEASE:
+                    backend.release(op[1])
+                else:
+                    backend.move(op[1], op[2])
+            backend.flush()
+            self.injected += len(ops)
+        except Exception as e:
+            self.errors += 1
+            print(f"Failed to inject output events: {e}", file=sys.stderr)
+        self.inject_time.record(now_ns() - started)
+
+    def _run(self):
+        if self.backend is None:
+            self._create_backend()
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                enqueued, ops = self._queue.popleft()
+            waited = now_ns() - enqueued
+            self.queue_wait.record(waited)
+            tracer = self.tracer
+            if tracer is not None:
+                tracer.record('output_queue', waited)
+            self._inject(ops)
+
+    def stats(self):
+        return {
+            'backend': getattr(self.backend, 'name', type(self.backend).__name__) if self.backend is not None else None,
+            'depth': len(self._queue),
+            'max_depth': self.max_depth,
+            'capacity': self.maxsize,
+            'batches': self.batches,
+            'coalesced': self.coalesced,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'injected': self.injected,
+            'inject_time': self.inject_time.snapshot(),
+            'queue_wait': self.queue_wait.snapshot(),
+        }
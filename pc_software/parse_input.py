@@ -1,7 +1,7 @@
 import hid
 import time
-import math
-import threading
+
+from rumble import encode_rumble_data
 
 # Nintendo's Vendor ID
 NINTENDO_VID = 0x057e
@@ -32,6 +32,7 @@ BATTERY_MAPPING = {
 # 振動を発生させないための中立的な（無振動の）データ
 NEUTRAL_RUMBLE_DATA = bytearray([0x00, 0x01, 0x40, 0x40,  # 左用4バイト
                                  0x00, 0x01, 0x40, 0x40])  # 右用4バイト
+RUMBLE_DURATION = 0.1  # 振動させる時間（秒）
 
 def find_joycons():
     """Finds all connected Joy-Cons (L and R)."""
@@ -45,37 +46,6 @@ def find_joycons():
                 devices.append({'type': 'R', 'path': device_dict['path']})
     return devices
 
-def encode_rumble_data(frequency, amplitude):
-    """
-    周波数(Hz)と振幅(0.0-1.0)からJoy-Con用の4バイト振動データを生成する。
-    """
-    if amplitude == 0:
-        # 振幅0の場合は無振動データを返す
-        return bytearray([0x00, 0x01, 0x40, 0x40])
-    # 周波数をJoy-Conの範囲内にクランプ（40.87～1252.55 Hz）
-    freq_hz = max(40.87, min(frequency, 1252.55))
-    # 周波数エンコード（Joy-Con仕様に基づき対数スケールで量子化）
-    encoded_hex_freq = round(math.log2(freq_hz / 10.0) * 32.0)
-    hf_data = (encoded_hex_freq - 0x60) * 4
-    lf_data = encoded_hex_freq - 0x40
-    # 振幅エンコード（振幅も低・中・高域で異なるスケールで量子化）
-    amp = max(0.0, min(amplitude, 1.0))
-    if amp > 0.23:
-        encoded_hex_amp = round(math.log2(amp * 8.7) * 32.0)
-    elif amp > 0.12:
-        encoded_hex_amp = round(math.log2(amp * 17.0) * 16.0)
-    else:
-        encoded_hex_amp = round((amp * 158.8) + 16.0) if amp > 0.0 else 0
-    hf_amp = encoded_hex_amp * 2
-    lf_amp = int(encoded_hex_amp / 2) + 0x40
-    # 4バイトの振動パケットを構築
-    packet = bytearray(4)
-    packet[0] = hf_data & 0xFF
-    packet[1] = (((hf_data >> 8) & 0xFF) + hf_amp) & 0xFF
-    packet[2] = (lf_data + ((lf_amp >> 8) & 0xFF)) & 0xFF
-    packet[3] = lf_amp & 0xFF
-    return packet
-
 def send_rumble(device, packet_counter, rumble_data):
     """
     レポートID 0x10 を使用して8バイトの振動データを送信する。
@@ -136,6 +106,7 @@ def main():
                 'last_stick_v': 2048,
                 'led_index': initial_led_index,
                 'last_battery_level': -1,
+                'rumble_stop_at': None,  # 振動を停止する時刻
             }
 
         print("Reading input reports... Press A (R) or Down (L) button to rumble. Press Ctrl+C to exit.")
@@ -147,6 +118,14 @@ def main():
                 dev_type = dev_info['type']
                 dev_path = dev_info['path']
 
+                # --- 振動停止の時刻になったら停止コマンドを送信 ---
+                stop_at = device_states[dev_path]['rumble_stop_at']
+                if stop_at is not None and time.monotonic() >= stop_at:
+                    send_rumble(device, global_packet_counter, NEUTRAL_RUMBLE_DATA)
+                    global_packet_counter = (global_packet_counter + 1) % 16
+                    device_states[dev_path]['rumble_stop_at'] = None
+                    print("--> Rumble stopped.")
+
                 report = device.read(64)
                 if report and report[0] == 0x30:  # 標準入力レポート(0x30)の場合【要修正ポイント】
                     # --- Battery Level (電池残量) ---
@@ -211,14 +190,8 @@ def main():
                             # 振動コマンド送信（開始）
                             send_rumble(device, global_packet_counter, rumble_data)
                             global_packet_counter = (global_packet_counter + 1) % 16
-                            # 100ms後に振動停止コマンドを送信するスレッドを起動
-                            def stop_rumble():
-                                time.sleep(0.1)
-                                nonlocal global_packet_counter
-                                send_rumble(device, global_packet_counter, NEUTRAL_RUMBLE_DATA)
-                                global_packet_counter = (global_packet_counter + 1) % 16
-                                print("--> Rumble stopped.")
-                            threading.Thread(target=stop_rumble).start()
+                            # 100ms後にメインループで振動停止コマンドを送信する
+                            device_states[dev_path]['rumble_stop_at'] = time.monotonic() + RUMBLE_DURATION
 
                         # --- 振動トリガー（例：左Joy-Conの下ボタン） ---
                         if dev_type == 'L' and '下 (Down)' in pressed:
@@ -232,14 +205,8 @@ def main():
                             # 振動コマンド送信（開始）
                             send_rumble(device, global_packet_counter, rumble_data)
                             global_packet_counter = (global_packet_counter + 1) % 16
-                            # 100ms後に振動停止コマンドを送信するスレッドを起動
-                            def stop_rumble():
-                                time.sleep(0.1)
-                                nonlocal global_packet_counter
-                                send_rumble(device, global_packet_counter, NEUTRAL_RUMBLE_DATA)
-                                global_packet_counter = (global_packet_counter + 1) % 16
-                                print("--> Rumble stopped.")
-                            threading.Thread(target=stop_rumble).start()
+                            # 100ms後にメインループで振動停止コマンドを送信する
+                            device_states[dev_path]['rumble_stop_at'] = time.monotonic() + RUMBLE_DURATION
 
                     if released:
                         print(f"Released ({dev_type}): {', '.join(sorted(released))}")
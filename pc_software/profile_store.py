@@ -0,0 +1,238 @@
+"""
+ページ・デバイスごとのレコードに分けて保存するプロファイルストア。
+
+1つの JSON ファイルを毎回丸ごと書き直す代わりに、ディレクトリにレコードごとのファイルと
+インデックス (index.json: キー -> ファイル名) を置く。
+
+- 読み込み: 開くときはインデックスだけを読み、レコードは get() で初めて必要になったときに読む。
+- 書き込み: put() はメモリ上の値を更新してすぐに戻る。変更されたレコードだけを、最後の変更から
+  write_delay 秒後 (変更が続いても最初の変更から max_delay 秒以内) に専用スレッドで書き出す。
+  インデックスはキーが増減したときだけ書き直す。
+- 書き出しは一時ファイルに書いて fsync してから os.replace で置き換えるので、途中で落ちても
+  前の内容か新しい内容のどちらかが残る。新しいキーはレコード → インデックスの順に、
+  削除はインデックス → レコードの順に書くため、インデックスが存在しないファイルを指すことはない。
+- 従来の1ファイルの設定 (legacy_file) があり、ストアがまだ無い場合は最初に開いたときに取り込む。
+  取り込んだ元のファイルは変更しない。
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+INDEX_FILE = 'index.json'
+STORE_VERSION = 1
+DEFAULT_WRITE_DELAY_SEC = 0.5
+DEFAULT_MAX_DELAY_SEC = 5.0
+
+_MISSING = object()
+
+
+def _dumps(data):
+    return json.dumps(data, indent=2, ensure_ascii=False)
+
+
+def atomic_write_text(path, text):
+    """一時ファイル経由で path を置き換える"""
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _record_file(key):
+    # キーにはデバイスパスなどファイル名に使えない文字が入るのでハッシュにする
+    return 'r-' + hashlib.sha1(key.encode('utf-8')).hexdigest()[:20] + '.json'
+
+
+class ProfileStore:
+    def __init__(self, directory, legacy_file=None, write_delay=DEFAULT_WRITE_DELAY_SEC, max_delay=DEFAULT_MAX_DELAY_SEC):
+        self.directory = directory
+        self.write_delay = write_delay
+        self.max_delay = max_delay
+        self._lock = threading.Condition()
+        self._write_lock = threading.Lock()  # 書き出しを1つずつ行う (ファイルの I/O は _lock の外で行う)
+        self._index = {}    # キー -> ファイル名
+        self._records = {}  # 読み込み済み・変更済みのレコード
+        self._texts = {}    # キー -> 最後に読み書きした JSON (変更の有無の判定用)
+        self._dirty = {}    # キー -> 書き出す JSON (_MISSING は削除)
+        self._index_dirty = False
+        self._first_dirty = None
+        self._deadline = None
+        self._closed = False
+        self.writes = 0
+        self.errors = 0
+        self._open(legacy_file)
+        self._thread = threading.Thread(target=self._run, name='profile-store', daemon=True)
+        self._thread.start()
+
+    def _open(self, legacy_file):
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                self._index = json.load(f).get('records', {})
+            return
+        except FileNotFoundError:
+            pass
+        if legacy_file and os.path.exists(legacy_file):
+            with open(legacy_file, 'r', encoding='utf-8') as f:
+                legacy = json.load(f)
+            print(f"Importing {legacy_file} into {self.directory}", file=sys.stderr)
+            for key, value in legacy.items():
+                key = str(key)
+                self._records[key] = value
+                self._index[key] = _record_file(key)
+                self._texts[key] = self._dirty[key] = _dumps(value)
+            self._index_dirty = True
+            self._write_pending()
+
+    # --- 読み込み ---
+    def keys(self):
+        with self._lock:
+            return list(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def get(self, key, default=None):
+        """レコードを返す (初めて使うときにファイルから読む)"""
+        with self._lock:
+            value = self._records.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+            name = self._index.get(key)
+            if name is None:
+                return default
+            try:
+                with open(os.path.join(self.directory, name), 'r', encoding='utf-8') as f:
+                    text = f.read()
+                value = json.loads(text)
+            except (OSError, ValueError) as e:
+                self.errors += 1
+                print(f"Failed to read profile record '{key}': {e}", file=sys.stderr)
+                return default
+            self._records[key] = value
+            self._texts[key] = text
+            return value
+
+    def items(self):
+        return [(key, self.get(key)) for key in self.keys()]
+
+    # --- 書き込み ---
+    def put(self, key, value):
+        """レコードを更新する。値が変わっていなければ何も書かない。書き出しは後でまとめて行う。
+        値はこの時点で JSON にするので、呼び出し元は後から value を書き換えてもよい。"""
+        text = _dumps(value)
+        with self._lock:
+            if key in self._index and self._texts.get(key) == text:
+                return False
+            self._records[key] = json.loads(text)
+            self._texts[key] = text
+            if key not in self._index:
+                self._index[key] = _record_file(key)
+                self._index_dirty = True
+            self._dirty[key] = text
+            self._schedule()
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            if key not in self._index:
+                return False
+            del self._index[key]
+            self._records.pop(key, None)
+            self._texts.pop(key, None)
+            self._dirty[key] = _MISSING
+            self._index_dirty = True
+            self._schedule()
+            return True
+
+    def _schedule(self):
+        now = time.monotonic()
+        if self._first_dirty is None:
+            self._first_dirty = now
+        self._deadline = min(now + self.write_delay, self._first_dirty + self.max_delay)
+        self._lock.notify()
+
+    def flush(self):
+        """溜まっている変更をすぐに書き出す (呼び出し元のスレッドで書く)"""
+        self._write_pending()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._lock.notify()
+        self._thread.join(timeout=2.0)
+        self.flush()
+
+    def _take_pending(self):
+        # 呼び出し元が _lock を持っている
+        if not self._dirty and not self._index_dirty:
+            return None
+        dirty, self._dirty = self._dirty, {}
+        index_dirty, self._index_dirty = self._index_dirty, False
+        self._first_dirty = self._deadline = None
+        return dirty, (dict(self._index) if index_dirty else None)
+
+    def _write_pending(self):
+        """溜まっている変更を書き出す。_lock は変更を取り出すときだけ持ち、fsync の間に get()/put() を待たせない。"""
+        with self._write_lock:
+            with self._lock:
+                pending = self._take_pending()
+            if pending is None:
+                return
+            dirty, index = pending
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                removed = []
+                for key, text in dirty.items():
+                    if text is _MISSING:
+                        removed.append(_record_file(key))
+                    else:
+                        atomic_write_text(os.path.join(self.directory, _record_file(key)), text)
+                        self.writes += 1
+                if index is not None:
+                    atomic_write_text(os.path.join(self.directory, INDEX_FILE),
+                                      _dumps({'version': STORE_VERSION, 'records': index}))
+                    self.writes += 1
+                for name in removed:
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except FileNotFoundError:
+                        pass
+            except OSError as e:
+                # 次の変更か close() でもう一度書く (その間に put() された新しい値を優先する)
+                print(f"Failed to write profile store {self.directory}: {e}", file=sys.stderr)
+                with self._lock:
+                    self.errors += 1
+                    for key, text in dirty.items():
+                        self._dirty.setdefault(key, text)
+                    self._index_dirty = self._index_dirty or index is not None
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._closed:
+                    if self._deadline is None:
+                        self._lock.wait()
+                        continue
+                    remaining = self._deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._lock.wait(remaining)
+                if self._closed:
+                    return
+            self._write_pending()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'records': len(self._index),
+                'loaded': len(self._records),
+                'pending': len(self._dirty),
+                'writes': self.writes,
+                'errors': self.errors,
+            }
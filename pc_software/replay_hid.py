@@ -0,0 +1,166 @@
+"""
+main.py --record で記録した生HIDレポートのログを、実機と同じ処理経路
+(joycon_pipeline.register_joycon / joycon_pipeline.process_joycon_report) に流して再生するドライバー。
+
+キーボード・マウス・振動の出力は実際には行わず、イベント列として記録する。
+出力イベント列のダイジェストを表示するので、変更前後で同じログを再生して比較できる。
+
+使い方:
+    python replay_hid.py capture.bin                 # できるだけ速く再生してスループットを計測
+    python replay_hid.py capture.bin --realtime      # 記録時のタイミングで再生
+    python replay_hid.py capture.bin --mapping joycon_mapping.json --repeat 10
+"""
+import argparse
+import hashlib
+import json
+import time
+
+import joycon_pipeline as pipeline
+from action_engine import set_rumble_player, set_timer_wheel
+from hid_log import read_hid_log
+from output_backend import FakeOutput
+from timer_wheel import TimerWheel
+
+
+class OutputSink(FakeOutput):
+    """キーボード・マウス・振動の出力先の代わりにイベントを記録する"""
+
+    def __init__(self):
+        super().__init__()
+        self.mouse = self  # MouseMotionEngine.mouse の代わり
+
+    # MouseMotionEngine 互換 (速度の変化だけを記録する)
+    def set_velocity(self, source, vx, vy):
+        self.events.append(('velocity', source, round(vx, 3), round(vy, 3)))
+
+    def clear(self, source):
+        self.events.append(('velocity', source, 0.0, 0.0))
+
+    # RumblePlayer 互換
+    def play(self, device_id, pattern):
+        self.events.append(('rumble', device_id, pattern if isinstance(pattern, str) else len(pattern)))
+
+    def stop(self, device_id):
+        self.events.append(('rumble_stop', device_id))
+
+    def remove_device(self, device_id):
+        pass
+
+    def digest(self):
+        return hashlib.sha256(repr(self.batches).encode('utf-8')).hexdigest()[:16]
+
+
+class ReplayDevice:
+    """hid.device の代わり。書き込み (サブコマンド・振動) は捨てる。"""
+
+    def write(self, data):
+        return len(data)
+
+    def close(self):
+        pass
+
+
+def install_sink(sink):
+    pipeline.mouse_motion = sink
+    pipeline.set_output(sink, threaded=False)  # 出力の順序とダイジェストを決定的にする
+    pipeline.rumble_player = sink
+    set_rumble_player(sink)
+
+
+def load_replay_mapping(path):
+    if path is None:
+        pipeline.load_mapping()
+        return
+    with open(path, 'r') as f:
+        joycon_mapping = json.load(f)
+    pipeline.state.joycon_bindings = {}
+    for device_id, device_mapping in joycon_mapping.items():
+        bindings, errors = pipeline.compile_joycon_mapping(device_mapping, where=device_id)
+        for error in errors:
+            print(f"Invalid mapping entry: {error}")
+        pipeline.state.joycon_bindings[device_id] = bindings
+
+
+def replay(records, realtime=False, device_paths=None):
+    """レコード列を処理経路に流し、(処理したレポート数, 処理時間の合計秒) を返す"""
+    devices = {}
+    processed = 0
+    busy = 0.0
+    start = time.perf_counter()
+    # 長押しや連射のタイマーは記録時刻を時計として進める (再生速度に関係なく同じ出力になる)
+    clock = [0.0]
+    wheel = TimerWheel(clock=lambda: clock[0])
+    set_timer_wheel(wheel)
+    for timestamp, slot, dev_type, report in records:
+        if realtime:
+            delay = timestamp - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+        clock[0] = timestamp
+        wheel.advance()
+        dev_info = devices.get(slot)
+        if dev_info is None:
+            path = device_paths[slot] if device_paths and slot < len(device_paths) else f"replay:{slot}"
+            dev_info = devices[slot] = pipeline.register_joycon(ReplayDevice(), dev_type, path)
+        t0 = time.perf_counter()
+        if pipeline.latency_tracer.enabled:
+            read_at = pipeline.now_ns()
+            pipeline.trace_joycon_report(dev_info, report, read_at, read_at)
+        else:
+            pipeline.process_joycon_report(dev_info, report)
+        busy += time.perf_counter() - t0
+        processed += 1
+    clock[0] += 10.0  # 残っているタイマーを消化する
+    wheel.advance()
+    for dev_info in devices.values():
+        pipeline.cancel_gestures(dev_info['path'])
+        pipeline.state.joycon_devices.remove(dev_info)
+        pipeline.telemetry.remove_device(dev_info['path'])
+    return processed, busy
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Replay a raw Joy-Con HID report log through the report processing path")
+    parser.add_argument("log", help="main.py --record で記録したログファイル")
+    parser.add_argument("--realtime", action="store_true", help="記録時のタイミングで再生する")
+    parser.add_argument("--repeat", type=int, default=1, help="ログを繰り返す回数")
+    parser.add_argument("--mapping", help="使用するマッピングファイル (省略時は joycon_mapping.d、無ければ joycon_mapping.json)")
+    parser.add_argument("--device-path", action="append", dest="device_paths",
+                        help="デバイス番号順に割り当てるデバイスパス (マッピングのキーに合わせる)")
+    parser.add_argument("--trace-latency", action="store_true", help="段階ごとのレイテンシーを集計して表示する")
+    args = parser.parse_args()
+
+    records = list(read_hid_log(args.log))
+    if not records:
+        print("Log contains no reports.")
+        return
+
+    sink = OutputSink()
+    install_sink(sink)
+    load_replay_mapping(args.mapping)
+    if args.trace_latency:
+        pipeline.set_latency_tracing(True)
+
+    total = 0
+    busy = 0.0
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        processed, elapsed = replay(records, realtime=args.realtime, device_paths=args.device_paths)
+        total += processed
+        busy += elapsed
+    wall = time.perf_counter() - started
+
+    print(f"Reports processed : {total} ({len(records)} per pass, {args.repeat} pass(es))")
+    print(f"Wall time         : {wall:.3f} s")
+    print(f"Processing time   : {busy:.3f} s ({busy / total * 1e6:.1f} us/report, {total / busy:.0f} reports/s)")
+    print(f"Output events     : {len(sink.events)}")
+    print(f"Output digest     : {sink.digest()}")
+    if args.trace_latency:
+        for stage, stats in pipeline.latency_tracer.snapshot()['stages'].items():
+            if stats['count']:
+                print(f"  {stage:<12} n={stats['count']:<8} mean={stats['mean_us']:.1f}us p50<={stats['p50_us']}us "
+                      f"p99<={stats['p99_us']}us max={stats['max_us']:.1f}us")
+
+
+if __name__ == "__main__":
+    main_cli()
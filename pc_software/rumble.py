@@ -0,0 +1,190 @@
+"""
+Joy-Con の振動 (HD振動) を再生するスケジューラー。
+
+振動パターンは (周波数Hz, 振幅0.0-1.0, 長さ秒) のセグメント列として表し、
+イベントループ上の1つのタスクがすべてのデバイスのセグメント切り替えを行う。
+パルスごとにスレッドやタスクを作らず、デバイスごとに出力レポートの最小間隔を守る。
+周波数と振幅のエンコードは起動時に作成したテーブルを引くだけで、対数計算は行わない。
+"""
+import asyncio
+import heapq
+import math
+
+RUMBLE_MIN_INTERVAL = 0.015  # 1台のJoy-Conへ出力レポートを送る最小間隔 (秒)
+
+MIN_FREQUENCY = 40.87
+MAX_FREQUENCY = 1252.55
+AMPLITUDE_STEPS = 1000
+
+NEUTRAL_RUMBLE = bytes([0x00, 0x01, 0x40, 0x40])
+
+# 名前で呼び出せる振動パターン: [(周波数Hz, 振幅, 長さ秒), ...]
+RUMBLE_PATTERNS = {
+    'pulse': [(320.0, 0.5, 0.1)],
+    'light': [(160.0, 0.3, 0.08)],
+    'heavy': [(160.0, 0.9, 0.25)],
+    'double': [(320.0, 0.6, 0.06), (320.0, 0.0, 0.06), (320.0, 0.6, 0.06)],
+    'ramp': [(160.0, 0.2, 0.05), (200.0, 0.4, 0.05), (250.0, 0.6, 0.05), (320.0, 0.8, 0.05)],
+}
+
+
+def _build_frequency_table():
+    # 周波数(1Hz刻み) -> (高周波データ, 低周波データ)
+    table = []
+    for hz in range(int(MAX_FREQUENCY) + 2):
+        freq_hz = max(MIN_FREQUENCY, min(float(hz), MAX_FREQUENCY))
+        encoded_hex_freq = round(math.log2(freq_hz / 10.0) * 32.0)
+        table.append(((encoded_hex_freq - 0x60) * 4, encoded_hex_freq - 0x40))
+    return table
+
+
+def _build_amplitude_table():
+    # 振幅(1/AMPLITUDE_STEPS刻み) -> (高周波振幅, 低周波振幅)
+    table = []
+    for step in range(AMPLITUDE_STEPS + 1):
+        amp = step / AMPLITUDE_STEPS
+        if amp > 0.23:
+            encoded_hex_amp = round(math.log2(amp * 8.7) * 32.0)
+        elif amp > 0.12:
+            encoded_hex_amp = round(math.log2(amp * 17.0) * 16.0)
+        else:
+            encoded_hex_amp = round((amp * 158.8) + 16.0) if amp > 0.0 else 0
+        table.append((encoded_hex_amp * 2, int(encoded_hex_amp / 2) + 0x40))
+    return table
+
+
+FREQUENCY_TABLE = _build_frequency_table()
+AMPLITUDE_TABLE = _build_amplitude_table()
+
+
+def encode_rumble_data(frequency, amplitude):
+    """周波数(Hz)と振幅(0.0-1.0)からJoy-Con用の4バイト振動データを生成する (テーブル参照のみ)"""
+    if amplitude <= 0:
+        return NEUTRAL_RUMBLE
+    hf_data, lf_data = FREQUENCY_TABLE[max(0, min(int(frequency + 0.5), len(FREQUENCY_TABLE) - 1))]
+    hf_amp, lf_amp = AMPLITUDE_TABLE[min(int(amplitude * AMPLITUDE_STEPS + 0.5), AMPLITUDE_STEPS)]
+    return bytes((
+        hf_data & 0xFF,
+        (((hf_data >> 8) & 0xFF) + hf_amp) & 0xFF,
+        (lf_data + ((lf_amp >> 8) & 0xFF)) & 0xFF,
+        lf_amp & 0xFF,
+    ))
+
+
+def compile_pattern(segments):
+    """セグメント列を [(エンコード済み8バイト, 長さ秒), ...] に変換する"""
+    compiled = []
+    for frequency, amplitude, duration in segments:
+        if duration <= 0:
+            raise ValueError("Rumble segment duration must be positive")
+        data = encode_rumble_data(frequency, amplitude)
+        compiled.append((data + data, duration))  # 左右どちらのJoy-Conでも同じ振動にする
+    return compiled
+
+
+COMPILED_PATTERNS = {name: compile_pattern(segments) for name, segments in RUMBLE_PATTERNS.items()}
+NEUTRAL_RUMBLE_DATA = NEUTRAL_RUMBLE + NEUTRAL_RUMBLE
+
+
+class _Playback:
+    __slots__ = ('segments', 'index', 'segment_end', 'last_sent', 'last_data', 'due')
+
+    def __init__(self):
+        self.segments = []
+        self.index = 0
+        self.segment_end = 0.0
+        self.due = None  # 有効なスケジュール時刻 (これと異なるキューの要素は古いもの)
+        self.last_sent = -math.inf
+        self.last_data = NEUTRAL_RUMBLE_DATA
+
+
+class RumblePlayer:
+    """
+    すべてのJoy-Conの振動パターンを1つのタスクで再生する。
+    send(device_id, rumble_data) は8バイトの振動データを送信し、失敗した場合はFalseを返す。
+    """
+
+    def __init__(self, send, min_interval=RUMBLE_MIN_INTERVAL):
+        self.send = send
+        self.min_interval = min_interval
+        self._playbacks = {}  # デバイスID -> _Playback
+        self._queue = []      # (次に処理する時刻, デバイスID)
+        self._wake = asyncio.Event()
+
+    def play(self, device_id, pattern):
+        """パターン名またはコンパイル済みパターンを再生する。再生中のパターンは置き換える。"""
+        segments = COMPILED_PATTERNS[pattern] if isinstance(pattern, str) else pattern
+        playback = self._playbacks.setdefault(device_id, _Playback())
+        playback.segments = segments
+        playback.index = -1
+        self._schedule(device_id, playback, 0.0)
+
+    def stop(self, device_id):
+        playback = self._playbacks.get(device_id)
+        if playback is not None:
+            playback.segments = []
+            playback.index = 0
+            playback.segment_end = 0.0
+            self._schedule(device_id, playback, 0.0)
+
+    def remove_device(self, device_id):
+        self._playbacks.pop(device_id, None)
+
+    def _schedule(self, device_id, playback, when):
+        playback.due = when
+        heapq.heappush(self._queue, (when, device_id))
+        self._wake.set()
+
+    def _service(self, device_id, playback, now):
+        """デバイスの再生状態を進め、次に処理すべき時刻を返す (無ければNone)"""
+        if playback.index >= 0 and now < playback.segment_end:
+            return playback.segment_end
+        if now - playback.last_sent < self.min_interval:
+            # 出力間隔を空けるため、セグメントの切り替えを少し遅らせる
+            return playback.last_sent + self.min_interval
+
+        playback.index += 1
+        if playback.index < len(playback.segments):
+            data, duration = playback.segments[playback.index]
+            playback.segment_end = now + duration
+            next_time = playback.segment_end
+        else:
+            data = NEUTRAL_RUMBLE_DATA
+            playback.segments = []
+            next_time = None
+            if playback.last_data == NEUTRAL_RUMBLE_DATA:
+                return None
+
+        if data != playback.last_data or next_time is None:
+            if not self.send(device_id, data):
+                self.remove_device(device_id)
+                return None
+            playback.last_sent = now
+            playback.last_data = data
+        return next_time
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._queue:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            when, device_id = self._queue[0]
+            now = loop.time()
+            if when > now:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=when - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._queue)
+            playback = self._playbacks.get(device_id)
+            if playback is None or playback.due != when:
+                continue
+            next_time = self._service(device_id, playback, now)
+            playback.due = next_time
+            if next_time is not None:
+                heapq.heappush(self._queue, (next_time, device_id))
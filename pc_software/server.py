@@ -0,0 +1,384 @@
+"""
+Joy-Con / OMIP PC サーバー (FastAPI・Socket.IO) の本体。起動は main.py から行う。
+"""
+import asyncio
+
+# 重いモジュール (hid, pynput, numpy, evdev, uvicorn) と、使わないことの多い機能のモジュール
+# (hid_ingest, omip_host, server_metrics) は使う機能が動き出すときに startup_timing.import_module で読み込む
+import startup_timing
+import socketio
+from fastapi import FastAPI, Response
+
+# Joy-Con の入力処理経路は joycon_pipeline (サーバーを作らないので --ingest-process の入力プロセスでも使える)
+import joycon_pipeline as pipeline
+from joycon_pipeline import state, telemetry, input_events, latency_tracer, counters, lag_monitor
+from action_engine import compile_joycon_mapping
+from telemetry import STREAMS
+from rumble import RUMBLE_PATTERNS, compile_pattern
+from output_backend import create_output_backend
+from input_events import ANALOG, BUTTON, ENCODER, SOURCES
+
+startup_timing.mark('imports')
+
+# --- 定数 ---
+BAUDRATE = 115200
+
+# --ingest-process の場合、HID の読み取りから注入までは別プロセスで行う (このプロセスは Web サーバーだけ)
+ingest = None
+
+# --- サーバーの状態管理 (Joy-Con の状態は joycon_pipeline.state) ---
+class ServerState:
+    def __init__(self):
+        self.telemetry_task = None
+        self.ingest_task = None
+        self.lag_task = None
+        self.input_events_task = None
+        self.omip_ports = []  # 起動時に接続する OMIP デバイスのシリアルポート (--omip-port)
+        self.omip_config = None  # OMIP デバイスのページ設定のディレクトリ (--omip-config、指定すると起動時に開く)
+
+server_state = ServerState()
+
+# --- FastAPI, Socket.IO ---
+app = FastAPI()
+sio = socketio.AsyncServer(async_mode="asgi", cors_allowed_origins="*")
+socket_app = socketio.ASGIApp(sio, other_asgi_app=app)
+telemetry.sio = sio
+# Joy-Con と OMIP シリアルデバイス (M5Tab・マスターハブ) の入力を共通の InputEvent で配信する
+input_events.sio = sio
+omip = None  # OmipHost (OMIP デバイスも同じイベントループ・出力ワーカーで扱う。初めて使うときに作る)
+
+def get_omip():
+    global omip
+    if omip is None:
+        omip = startup_timing.import_module('omip_host').OmipHost(input_events)
+        omip.on_change = lambda: asyncio.create_task(notify_omip_devices())
+    return omip
+
+def set_latency_tracing(enabled):
+    """レイテンシー計測を切り替える。無効な間は出力先も計測用のラッパーを通らない。"""
+    if ingest is not None:
+        ingest.send('latency', enabled, False)
+        return
+    pipeline.set_latency_tracing(enabled)
+
+def reset_latency():
+    if ingest is not None:
+        ingest.send('latency', None, True)
+    else:
+        latency_tracer.reset()
+
+def latency_snapshot():
+    # 入力プロセスの計測は1秒ごとに届く統計の値を返す
+    if ingest is not None:
+        return ingest.stats.get('latency', {})
+    return latency_tracer.snapshot()
+
+def sync_ingest_subscriptions():
+    """テレメトリーと入力イベントの購読状況を入力プロセスに伝える (購読されていない更新はリングに書かせない)"""
+    if ingest is not None:
+        ingest.send('subscriptions', telemetry.subscription_keys())
+        ingest.send('input_sources', input_events.subscribed_sources())
+
+# --- レイテンシー計測 API ---
+@app.get("/latency")
+async def get_latency():
+    return latency_snapshot()
+
+@app.post("/latency")
+async def configure_latency(enabled: bool = None, reset: bool = False):
+    if enabled is not None:
+        set_latency_tracing(enabled)
+    if reset:
+        reset_latency()
+    return latency_snapshot()
+
+@app.get("/startup")
+async def get_startup_report():
+    """起動の各段階と、後から読み込んだモジュールの import 時間"""
+    return startup_timing.report()
+
+@app.get("/output")
+async def get_output_stats():
+    """出力ワーカーのキューの深さと注入時間"""
+    if ingest is not None:
+        return ingest.stats.get('output', {})
+    return pipeline.output.stats() if pipeline.output is not None else {}
+
+@app.get("/ingest")
+async def get_ingest_stats():
+    """入力プロセスとの間のリングバッファの使用量と捨てたメッセージ数 (--ingest-process のとき)"""
+    if ingest is None:
+        return {'enabled': False}
+    return dict(ingest.ring_stats(), enabled=True, devices=ingest.stats.get('devices', 0))
+
+@app.get("/devices")
+async def get_devices():
+    """接続中の Joy-Con と OMIP デバイスの一覧 (source で区別する)"""
+    joycons = [dict(device, source='joycon') for device in telemetry.device_list()]
+    return {'devices': joycons + (omip.device_list() if omip is not None else [])}
+
+@app.get("/omip")
+async def get_omip_stats():
+    """OMIP デバイス・表示中のページ・種類ごとの入力イベント数"""
+    if omip is None:
+        # 統計を見るだけで OmipHost を作らない (--ingest-process では OMIP を使わない)
+        stats = {'devices': [], 'started': False, 'page': None, 'bindings': 0,
+                 'events': dict.fromkeys((BUTTON, ANALOG, ENCODER), 0), 'errors': 0}
+    else:
+        stats = omip.stats()
+    return dict(stats, enabled=ingest is None, input_events=input_events.stats())
+
+# --- メトリクス (Prometheus のテキスト形式) ---
+def render_metrics():
+    server_metrics = startup_timing.import_module('server_metrics')
+    writer = server_metrics.MetricsWriter()
+    lags = {'server': lag_monitor.export()}
+    if ingest is not None:
+        # 入力プロセスの値は1秒ごとに届く統計から
+        stats = ingest.stats
+        counts = stats.get('counters') or server_metrics.ServerCounters().export()
+        output_stats = stats.get('output', {})
+        if 'loop_lag' in stats:
+            lags['ingest'] = stats['loop_lag']
+    else:
+        counts = counters.export()
+        output_stats = pipeline.output.stats() if pipeline.output is not None else {}
+    writer.counter('joycon_reports_total', 'Joy-Con input reports processed.', counts['reports'])
+    writer.gauge('joycon_connected_devices', 'Connected Joy-Cons.', telemetry.device_count())
+    writer.counter('telemetry_frames_total', 'Telemetry frames emitted to Socket.IO clients.', telemetry.frames_sent)
+    writer.gauge('socketio_clients', 'Connected Socket.IO clients.', telemetry.client_count())
+    if omip is not None:
+        omip_devices, omip_counts, omip_errors = len(omip.devices), omip.counts, omip.errors
+    else:
+        omip_devices, omip_counts, omip_errors = 0, dict.fromkeys((BUTTON, ANALOG, ENCODER), 0), 0
+    writer.gauge('omip_connected_devices', 'Connected OMIP serial devices.', omip_devices)
+    for kind, count in omip_counts.items():
+        writer.counter('omip_input_events_total', 'OMIP input events received.', count, {'kind': kind})
+    writer.counter('input_event_frames_total', 'Input event frames emitted to Socket.IO clients.', input_events.frames_sent)
+    writer.counter('input_events_dropped_total', 'Input events dropped because a client fell behind.', input_events.dropped)
+    errors = dict(counts['errors'], emit=telemetry.emit_errors + input_events.emit_errors,
+                  output=output_stats.get('errors', 0), omip=omip_errors)
+    for kind, count in errors.items():
+        writer.counter('errors_total', 'Errors by kind.', count, {'kind': kind})
+    server_metrics.write_output(writer, output_stats)
+    server_metrics.write_loop_lag(writer, lags)
+    if ingest is not None:
+        rings = ingest.ring_stats()
+        for ring in ('events', 'commands'):
+            writer.counter('ingest_ring_dropped_total', 'Messages dropped because the ingest ring was full.',
+                           rings[ring].get('dropped', 0), {'ring': ring})
+        writer.gauge('ingest_alive', 'Whether the HID ingest process is running.', int(rings['alive']))
+    return writer.text()
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(render_metrics(), media_type=startup_timing.import_module('server_metrics').CONTENT_TYPE)
+
+# --- Socket.IO イベントハンドラ ---
+@sio.event
+async def connect(sid, environ):
+    startup_timing.mark('first_socket')
+    print(f"Socket.IO client connected: {sid}")
+    telemetry.connect(sid)
+    await send_joycon_devices_update(sid)
+
+@sio.event
+async def disconnect(sid, *args):
+    print(f"Socket.IO client disconnected: {sid}")
+    telemetry.disconnect(sid)
+    input_events.unsubscribe(sid)
+    sync_ingest_subscriptions()
+
+@sio.on('subscribe_joycon')
+async def subscribe_joycon(sid, data):
+    """テレメトリーを購読する。deviceIdを省略すると全デバイス、streamsを省略すると全ストリーム。"""
+    data = data or {}
+    try:
+        telemetry.subscribe(sid, data.get('streams') or STREAMS, data.get('deviceId'))
+    except ValueError as e:
+        await sio.emit('joycon_subscription', {'status': 'error', 'message': str(e)}, to=sid)
+        return
+    sync_ingest_subscriptions()
+    await sio.emit('joycon_subscription', {'status': 'success'}, to=sid)
+
+@sio.on('unsubscribe_joycon')
+async def unsubscribe_joycon(sid, data):
+    data = data or {}
+    telemetry.unsubscribe(sid, data.get('streams'), data.get('deviceId'))
+    sync_ingest_subscriptions()
+    await sio.emit('joycon_subscription', {'status': 'success'}, to=sid)
+
+@sio.on('subscribe_input_events')
+async def subscribe_input_events(sid, data=None):
+    """Joy-Con と OMIP デバイスの入力を共通の形式 (input_events) で購読する。sources を省略すると両方。"""
+    data = data or {}
+    try:
+        input_events.subscribe(sid, data.get('sources'))
+    except (TypeError, ValueError) as e:
+        await sio.emit('input_events_subscription', {'status': 'error', 'message': str(e)}, to=sid)
+        return
+    sync_ingest_subscriptions()
+    await sio.emit('input_events_subscription', {'status': 'success', 'sources': data.get('sources') or list(SOURCES)}, to=sid)
+
+@sio.on('unsubscribe_input_events')
+async def unsubscribe_input_events(sid, data=None):
+    input_events.unsubscribe(sid)
+    sync_ingest_subscriptions()
+    await sio.emit('input_events_subscription', {'status': 'success', 'sources': []}, to=sid)
+
+@sio.on('omip_command')
+async def omip_command(sid, data):
+    """OMIP デバイスへのコマンド。backend.py の stdin のコマンドと同じ形 ({type, id, ...}) で受け、omip_response で返す。"""
+    data = data or {}
+    try:
+        response = await run_omip_command(data)
+    except Exception as e:
+        response = {'command': data.get('type'), 'status': 'error', 'message': str(e)}
+    if data.get('id') is not None:
+        response['id'] = data['id']
+    await sio.emit('omip_response', response, to=sid)
+
+async def run_omip_command(command):
+    cmd_type = command.get('type')
+    if ingest is not None:
+        # 入力プロセスとこのプロセスの2か所から注入しないよう、OMIP デバイスは扱わない
+        return {'command': cmd_type, 'status': 'error', 'message': 'OMIP devices are not available with --ingest-process'}
+    omip = get_omip()
+    if cmd_type == 'get_ports':
+        ports = await asyncio.get_running_loop().run_in_executor(None, omip.list_ports)
+        return {'command': cmd_type, 'status': 'success', 'ports': ports}
+    await omip.ensure_started(pipeline.output)  # 設定のストアは OMIP のコマンドが初めて来たときに開く
+    if cmd_type == 'connect':
+        port = command.get('port')
+        if not port:
+            return {'command': cmd_type, 'status': 'error', 'message': 'Port not specified'}
+        await omip.connect(port)
+        await notify_omip_devices()
+        return {'command': cmd_type, 'status': 'success', 'port': port}
+    if cmd_type == 'disconnect':
+        port = command.get('port')
+        ports = [port] if port else list(omip.devices)
+        for target in ports:
+            await omip.disconnect(target)
+        await notify_omip_devices()
+        return {'command': cmd_type, 'status': 'success'}
+    if cmd_type == 'set_page':
+        omip.set_page(command.get('page', 1))
+        return {'command': cmd_type, 'status': 'success', 'page': omip.current_page}
+    if cmd_type == 'get_config':
+        return {'command': cmd_type, 'status': 'success', 'config': omip.get_page_configs(), 'encoders': omip.config.encoder_configs}
+    if cmd_type == 'save_config':
+        # エラーがあれば保存しない (force: true ならそのまま保存し、エラーのあるアクションには何も割り当てない)
+        errors = omip.save_config(dict(command['config']), bool(command.get('force'))) if 'config' in command else []
+        if errors:
+            return {'command': cmd_type, 'status': 'error', 'message': 'Invalid actions in config', 'errors': errors}
+        return {'command': cmd_type, 'status': 'success'}
+    if cmd_type == 'save_page':
+        page = str(command.get('page', omip.current_page))
+        cells = command.get('cells')
+        errors = omip.save_page(page, cells, bool(command.get('force'))) if isinstance(cells, list) else ['cells must be a list']
+        if errors:
+            return {'command': cmd_type, 'status': 'error', 'page': page, 'message': 'Invalid actions in config', 'errors': errors}
+        return {'command': cmd_type, 'status': 'success', 'page': page}
+    if cmd_type == 'get_stats':
+        return {'command': cmd_type, 'status': 'success', 'stats': omip.stats()}
+    return {'command': cmd_type, 'status': 'error', 'message': f'Unknown command: {cmd_type}'}
+
+async def notify_omip_devices():
+    await sio.emit('omip_devices', {'devices': omip.device_list()})
+
+@sio.on('rumble_joycon')
+async def rumble_joycon(sid, data):
+    """振動を再生する。pattern (名前) か segments ([{frequency, amplitude, duration_ms}, ...]) を指定する。"""
+    device_id = data.get('deviceId')
+    try:
+        if data.get('segments'):
+            pattern = compile_pattern(
+                (float(seg['frequency']), float(seg['amplitude']), float(seg['duration_ms']) / 1000.0)
+                for seg in data['segments']
+            )
+        else:
+            pattern = data.get('pattern', 'pulse')
+            if pattern not in RUMBLE_PATTERNS:
+                raise ValueError(f"Unknown rumble pattern: '{pattern}'")
+    except (KeyError, TypeError, ValueError) as e:
+        await sio.emit('joycon_rumble', {'status': 'error', 'message': str(e)}, to=sid)
+        return
+    if ingest is not None:
+        ingest.send('rumble', device_id, pattern)
+        await sio.emit('joycon_rumble', {'status': 'success'}, to=sid)
+        return
+    pipeline.play_rumble(device_id, pattern)
+    await sio.emit('joycon_rumble', {'status': 'success'}, to=sid)
+
+@sio.on('get_latency')
+async def get_latency_stats(sid, data=None):
+    """レイテンシーの集計を返す。enabled/reset を指定すると計測の切り替え・リセットも行う。"""
+    data = data or {}
+    if 'enabled' in data:
+        set_latency_tracing(bool(data['enabled']))
+    if data.get('reset'):
+        reset_latency()
+    await sio.emit('latency_stats', latency_snapshot(), to=sid)
+
+@sio.on('load_joycon_mapping')
+async def load_joycon_mapping(sid, data):
+    device_id = data.get('deviceId')
+    await sio.emit('joycon_mapping_loaded', {'deviceId': device_id, 'mapping': pipeline.get_device_mapping(device_id)}, to=sid)
+
+@sio.on('save_joycon_mapping')
+async def save_joycon_mapping(sid, data):
+    device_id = data.get('deviceId')
+    mapping = data.get('mapping')
+    if device_id and mapping is not None:
+        bindings, errors = compile_joycon_mapping(mapping, where=device_id)
+        if errors:
+            await sio.emit('joycon_mapping_saved', {'status': 'error', 'errors': errors}, to=sid)
+            return
+        if ingest is not None:
+            ingest.send('mapping', device_id, mapping)
+        else:
+            pipeline.apply_mapping(device_id, bindings)
+        pipeline.save_mapping(device_id, mapping)
+        await sio.emit('joycon_mapping_saved', {'status': 'success'}, to=sid)
+
+async def send_joycon_devices_update(sid):
+    """完全なデバイスリストを1クライアントに送る。以降の変更は joycon_frame の差分で届く。"""
+    await sio.emit('joycon_devices', {'devices': telemetry.device_list()}, to=sid)
+
+
+# --- サーバー起動・メイン処理 ---
+@app.on_event("startup")
+async def startup_event():
+    pipeline.load_mapping()
+    server_state.telemetry_task = asyncio.create_task(telemetry.run())
+    server_state.lag_task = asyncio.create_task(lag_monitor.run())
+    server_state.input_events_task = asyncio.create_task(input_events.run())
+    if ingest is not None:
+        # マッピングのストアを開いて (初回の取り込みを済ませて) から入力プロセスを起動する
+        ingest.start()
+        server_state.ingest_task = asyncio.create_task(ingest.run(telemetry, input_events))
+        startup_timing.mark('server_started')
+        return
+    if pipeline.output is None:
+        pipeline.set_output(backend_factory=create_output_backend)
+    pipeline.start()
+    if server_state.omip_ports or server_state.omip_config:
+        await get_omip().ensure_started(pipeline.output)
+    for port in server_state.omip_ports:
+        try:
+            await omip.connect(port)
+        except Exception as e:
+            print(f"Failed to connect OMIP device {port}: {e}")
+    startup_timing.mark('server_started')
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in (server_state.telemetry_task, server_state.ingest_task, server_state.lag_task, server_state.input_events_task):
+        if task:
+            task.cancel()
+    if omip is not None:
+        await omip.close()
+    if ingest is not None:
+        ingest.stop()
+    await pipeline.shutdown()
@@ -0,0 +1,147 @@
+"""
+Joy-Con サーバーの稼働状況を Prometheus のテキスト形式 (GET /metrics) で公開するためのメトリクス。
+
+- LoopLagMonitor: イベントループで一定間隔 sleep し、予定より遅れて起きた時間をループの遅れとして
+  ヒストグラムに記録する。遅れが budget を超えた回数も数える (アラート用)。
+- ServerCounters: 入力ループが数えるカウンター (処理したレポート数、種類ごとのエラー数)。
+  ホットパスでは属性を1つ増やすだけにする。
+- MetricsWriter: カウンター・ゲージ・ヒストグラムをテキスト形式に書き出す。
+  ヒストグラムは latency.LatencyHistogram.snapshot() の形式をそのまま受け取る。
+"""
+import asyncio
+
+from latency import LatencyHistogram
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LAG_SAMPLE_INTERVAL = 0.05  # ループの遅れを測る間隔 (秒)
+DEFAULT_LAG_BUDGET = 0.010  # これを超える遅れを budget 超過として数える (秒)
+
+ERROR_KINDS = ('hid_read', 'report', 'loop', 'subcommand')
+
+
+class LoopLagMonitor:
+    def __init__(self, interval=LAG_SAMPLE_INTERVAL, budget=DEFAULT_LAG_BUDGET):
+        self.interval = interval
+        self.budget = budget
+        self.histogram = LatencyHistogram()
+        self.last = 0.0
+        self.over_budget = 0
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.last = lag
+            self.histogram.record(int(lag * 1e9))
+            if lag > self.budget:
+                self.over_budget += 1
+
+    def export(self):
+        return {
+            'histogram': self.histogram.snapshot(),
+            'last_sec': self.last,
+            'over_budget': self.over_budget,
+            'budget_sec': self.budget,
+        }
+
+
+class ServerCounters:
+    def __init__(self):
+        self.reports = 0
+        self.errors = dict.fromkeys(ERROR_KINDS, 0)
+
+    def error(self, kind):
+        self.errors[kind] += 1
+
+    def export(self):
+        return {'reports': self.reports, 'errors': dict(self.errors)}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+
+
+def _format_value(value):
+    if value is None:
+        return 'NaN'
+    if isinstance(value, float):
+        return repr(value)
+    return str(int(value))
+
+
+class MetricsWriter:
+    def __init__(self, prefix='omip_'):
+        self.prefix = prefix
+        self._lines = []
+        self._declared = set()
+
+    def _declare(self, name, kind, help_text):
+        if name not in self._declared:
+            self._declared.add(name)
+            self._lines.append(f'# HELP {name} {help_text}')
+            self._lines.append(f'# TYPE {name} {kind}')
+
+    def _sample(self, name, value, labels=None):
+        self._lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+
+    def counter(self, name, help_text, value, labels=None):
+        name = self.prefix + name
+        self._declare(name, 'counter', help_text)
+        self._sample(name, value, labels)
+
+    def gauge(self, name, help_text, value, labels=None):
+        name = self.prefix + name
+        self._declare(name, 'gauge', help_text)
+        self._sample(name, value, labels)
+
+    def histogram(self, name, help_text, snapshot, labels=None):
+        """LatencyHistogram.snapshot() を秒単位のヒストグラムとして書き出す"""
+        name = self.prefix + name
+        self._declare(name, 'histogram', help_text)
+        labels = labels or {}
+        cumulative = 0
+        for bucket in snapshot['buckets']:
+            cumulative += bucket['count']
+            le = '+Inf' if bucket['le_us'] is None else repr(bucket['le_us'] / 1e6)
+            self._sample(f'{name}_bucket', cumulative, dict(labels, le=le))
+        mean_us = snapshot['mean_us'] or 0.0
+        self._sample(f'{name}_sum', mean_us * snapshot['count'] / 1e6, labels)
+        self._sample(f'{name}_count', snapshot['count'], labels)
+
+    def text(self):
+        return '\n'.join(self._lines) + '\n'
+
+
+def write_loop_lag(writer, lags):
+    """{ループ名 ('server' / 'ingest'): LoopLagMonitor.export()} を書き出す (同じ名前の値はまとめて並べる)"""
+    for loop, lag in lags.items():
+        writer.histogram('event_loop_lag_seconds', 'Event loop wake-up delay.', lag['histogram'], {'loop': loop})
+    for loop, lag in lags.items():
+        writer.gauge('event_loop_lag_last_seconds', 'Most recent event loop wake-up delay.', lag['last_sec'], {'loop': loop})
+    for loop, lag in lags.items():
+        writer.gauge('event_loop_lag_max_seconds', 'Largest event loop wake-up delay since start.',
+                     lag['histogram']['max_us'] / 1e6, {'loop': loop})
+    for loop, lag in lags.items():
+        writer.gauge('event_loop_lag_budget_seconds', 'Event loop lag budget.', lag['budget_sec'], {'loop': loop})
+    for loop, lag in lags.items():
+        writer.counter('event_loop_lag_over_budget_total', 'Event loop lag samples over budget.', lag['over_budget'], {'loop': loop})
+
+
+def write_output(writer, stats):
+    """OutputWorker.stats() を書き出す (エラー数は errors_total{kind="output"} に含める)"""
+    writer.counter('output_batches_total', 'Output batches queued for injection.', stats.get('batches', 0))
+    writer.counter('output_injected_events_total', 'Keyboard and mouse events injected.', stats.get('injected', 0))
+    writer.counter('output_coalesced_total', 'Output batches merged because the queue was full.', stats.get('coalesced', 0))
+    writer.counter('output_dropped_total', 'Key presses dropped because the output queue stayed full.', stats.get('dropped', 0))
+    writer.gauge('output_queue_depth', 'Output batches waiting for injection.', stats.get('depth', 0))
+    if 'inject_time' in stats:
+        writer.histogram('output_inject_seconds', 'Time to inject one output batch.', stats['inject_time'])
+        writer.histogram('output_queue_wait_seconds', 'Time an output batch waited in the queue.', stats['queue_wait'])
@@ -0,0 +1,165 @@
+"""
+プロセス間でメッセージを受け渡す共有メモリのリングバッファ (書き込み1・読み出し1)。
+
+ロックは使わない。書き込み側だけが head を、読み出し側だけが tail を進める。
+どちらも書いたバイト数の累計 (単調増加の64ビット値) で、位置はそれを容量で割った余り。
+
+head の更新より先にメッセージ本体が読み出し側から見えるとは限らない (x86/x64 以外ではストアの順序が
+入れ替わることがある) ので、各レコードの先頭にシーケンス番号 (seqlock) を置く。
+書き込み側はレコードの位置 pos (累計のバイト数) に対して 2*pos+1 (書き込み中) を書いてから本体を書き、
+最後に 2*pos+2 (完了) を書く。読み出し側は本体を読む前と後で 2*pos+2 であることを確かめ、
+違えば (まだ見えていない・前の周回の内容) そのレコードから次の poll() で読み直す。
+
+- 各レコードは 8バイトのシーケンス番号 + 4バイトの長さ + pickle したデータ。
+  末尾に収まらないときは折り返しの印 (長さ _WRAP のレコード) を書いて先頭から書く。
+- 空きが足りないときは待たずにメッセージを捨て、dropped を数える (入力処理を止めないため)。
+- 読み出し側は poll() で溜まっているメッセージをすべて取り出す。通知の仕組みは無いので一定間隔で呼ぶ。
+"""
+import pickle
+import struct
+from multiprocessing import shared_memory
+
+DEFAULT_CAPACITY = 1 << 20
+
+_MAGIC = 0x4F4D5252  # 'OMRR'
+# 書き込み側と読み出し側が書く値は別のキャッシュラインに置く
+_MAGIC_OFFSET = 0
+_CAPACITY_OFFSET = 8
+_HEAD_OFFSET = 64
+_DROPPED_OFFSET = 72
+_TAIL_OFFSET = 128
+_DATA_OFFSET = 192
+
+_U64 = struct.Struct('<Q')
+_HEADER = struct.Struct('<QI')  # シーケンス番号, 長さ
+_WRAP = 0xFFFFFFFF
+
+
+def _attach(name):
+    # 作成したプロセス (サーバー) が後始末をするので、接続しただけのプロセスでは追跡しない。
+    # Python 3.12 以前は track を指定できないが、multiprocessing で起動した子プロセスは
+    # 親と同じ resource_tracker を使うので、登録が重なるだけで親より先に削除されることはない。
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+class ShmRing:
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        self.buf = shm.buf
+        magic, = _U64.unpack_from(self.buf, _MAGIC_OFFSET)
+        if magic != _MAGIC:
+            raise ValueError(f"Shared memory '{shm.name}' is not a ring buffer")
+        self.capacity, = _U64.unpack_from(self.buf, _CAPACITY_OFFSET)
+        self.name = shm.name
+        # 自分が書く側の値は手元に持っておき、相手の値だけを共有メモリから読む
+        self._head = self._load(_HEAD_OFFSET)
+        self._tail = self._load(_TAIL_OFFSET)
+        self._dropped = self._load(_DROPPED_OFFSET)
+        self.retries = 0  # 読み出し側: 書き込みが見え切っていないレコードを次の poll() に回した回数
+
+    @classmethod
+    def create(cls, capacity=DEFAULT_CAPACITY):
+        shm = shared_memory.SharedMemory(create=True, size=_DATA_OFFSET + capacity)
+        shm.buf[:_DATA_OFFSET] = bytes(_DATA_OFFSET)
+        _U64.pack_into(shm.buf, _CAPACITY_OFFSET, capacity)
+        _U64.pack_into(shm.buf, _MAGIC_OFFSET, _MAGIC)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        return cls(_attach(name), owner=False)
+
+    def _load(self, offset):
+        # 8バイトの読み取りが途中で書き換わった値にならないよう、同じ値が2回続くまで読む
+        value, = _U64.unpack_from(self.buf, offset)
+        while True:
+            again, = _U64.unpack_from(self.buf, offset)
+            if again == value:
+                return value
+            value = again
+
+    # --- 書き込み側 ---
+    def put(self, message):
+        """メッセージを書き込む。空きが足りなければ捨てて False を返す。"""
+        payload = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+        size = _HEADER.size + len(payload)
+        capacity = self.capacity
+        head = self._head
+        pos = head % capacity
+        skip = capacity - pos if capacity - pos < size else 0
+        if size + skip > capacity - (head - self._load(_TAIL_OFFSET)):
+            self._dropped += 1
+            _U64.pack_into(self.buf, _DROPPED_OFFSET, self._dropped)
+            return False
+        buf = self.buf
+        if skip:
+            if skip >= _HEADER.size:
+                self._write_record(head, _WRAP, b'')
+            head += skip
+        self._write_record(head, len(payload), payload)
+        self._head = head + size
+        _U64.pack_into(buf, _HEAD_OFFSET, self._head)
+        return True
+
+    def _write_record(self, pos, length, payload):
+        buf = self.buf
+        start = _DATA_OFFSET + pos % self.capacity
+        _HEADER.pack_into(buf, start, 2 * pos + 1, length)
+        buf[start + _HEADER.size:start + _HEADER.size + len(payload)] = payload
+        _U64.pack_into(buf, start, 2 * pos + 2)
+
+    # --- 読み出し側 ---
+    def poll(self, limit=None):
+        """溜まっているメッセージを (最大 limit 件) 取り出す"""
+        messages = []
+        head = self._load(_HEAD_OFFSET)
+        tail = self._tail
+        capacity = self.capacity
+        buf = self.buf
+        while tail != head and (limit is None or len(messages) < limit):
+            pos = tail % capacity
+            if capacity - pos < _HEADER.size:
+                tail += capacity - pos
+                continue
+            start = _DATA_OFFSET + pos
+            done = 2 * tail + 2
+            seq, length = _HEADER.unpack_from(buf, start)
+            if seq != done:
+                self.retries += 1
+                break
+            if length == _WRAP:
+                tail += capacity - pos
+                continue
+            if length > capacity - pos - _HEADER.size:
+                self.retries += 1  # 長さが本体より先に見えていない
+                break
+            payload = bytes(buf[start + _HEADER.size:start + _HEADER.size + length])
+            seq, = _U64.unpack_from(buf, start)
+            if seq != done:
+                self.retries += 1
+                break
+            messages.append(pickle.loads(payload))
+            tail += _HEADER.size + length
+        if tail != self._tail:
+            self._tail = tail
+            _U64.pack_into(buf, _TAIL_OFFSET, tail)
+        return messages
+
+    def stats(self):
+        head = self._load(_HEAD_OFFSET)
+        tail = self._load(_TAIL_OFFSET)
+        return {'capacity': self.capacity, 'used': head - tail, 'dropped': self._load(_DROPPED_OFFSET),
+                'retries': self.retries}
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,210 @@
+"""
+模擬 Joy-Con (fake_hid) を N 台つなぎ、main.py の入力ループ (joycon_pipeline.scan_and_manage_joycons) が
+台数に応じてどうスケールするかを測るソークテスト。実機は不要。
+
+台数ごとに新しいプロセスで main.py と同じ処理経路 (joycon_pipeline: ディスカバリー・入力ループ・マウス移動・タイマー・
+テレメトリー・出力ワーカー) を動かし、次の値を表にする。
+    CPU%         プロセス全体の CPU 使用率 (1コア = 100%) と 1台あたりの値
+    reports      処理したレポート数と、実機の間隔から計算した期待値
+    dropped      読み取りが遅れてバッファから溢れたレポート数
+    latency      レポートが生成されてから処理 (マッピング・注入の依頼) を終えるまでの時間
+    loop lag     イベントループの遅れ (LAG_INTERVAL ごとに sleep したときの超過時間)
+
+使い方:
+    python soak_joycons.py                              # 1, 2, 4, 8, 16 台で各10秒
+    python soak_joycons.py --counts 8,16,32 --duration 30 --script buttons
+    python soak_joycons.py --counts 8 --json result.json
+出力は OMIP_OUTPUT_BACKEND に関係なく常に fake (実際にはキーを押さない)。
+マッピングのキー名の解決には pynput を使うので、測定用のプロセスは PYNPUT_BACKEND が未設定なら
+dummy (X サーバーなどが無くても読み込める) で起動する。
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import fake_hid
+
+DEFAULT_COUNTS = (1, 2, 4, 8, 16)
+DEFAULT_DURATION = 10.0
+WARMUP_SEC = 1.5
+LAG_INTERVAL = 0.01
+
+# 模擬デバイスに割り当てるマッピング (ボタンはキー、スティックはマウス)
+LEFT_SOAK_MAPPING = {
+    'arrow_up': 'up', 'arrow_down': 'down', 'arrow_left': 'left', 'arrow_right': 'right', 'l': 'shift', 'minus': 'esc',
+    'stick_l': {'mode': 'mouse', 'sensitivity': 20},
+}
+RIGHT_SOAK_MAPPING = {
+    'a': 'a', 'b': 'b', 'x': 'x', 'y': 'y', 'r': 'ctrl+c', 'plus': 'enter',
+    'stick_r': {'mode': 'mouse', 'sensitivity': 20},
+}
+
+
+def _percentiles(samples, scale=1000.0):
+    """(p50, p95, p99, max) をミリ秒で返す"""
+    if not samples:
+        return None, None, None, None
+    ordered = sorted(samples)
+    last = len(ordered) - 1
+    pick = lambda q: round(ordered[min(last, int(q * len(ordered)))] * scale, 3)
+    return pick(0.50), pick(0.95), pick(0.99), round(ordered[-1] * scale, 3)
+
+
+class CountingEmitter:
+    """Socket.IO の代わりにフレームを JSON にして数える (シリアライズのコストは含める)"""
+
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+
+    async def emit(self, event, data, to=None):
+        self.frames += 1
+        self.bytes += len(json.dumps(data))
+
+
+async def _measure(pipeline, count, duration, use_mapping):
+    latencies = []
+    lags = []
+    process_report = pipeline.process_joycon_report
+
+    def timed_process(dev_info, report):
+        process_report(dev_info, report)
+        latencies.append(time.perf_counter() - dev_info['hid'].last_due)
+
+    pipeline.process_joycon_report = timed_process
+    if use_mapping:
+        for info in fake_hid.enumerate():
+            path = pipeline.device_path_str(info)
+            mapping = LEFT_SOAK_MAPPING if info['product_id'] == fake_hid.JOYCON_L_PID else RIGHT_SOAK_MAPPING
+            bindings, errors = pipeline.compile_joycon_mapping(mapping, where=path)
+            if errors:
+                raise ValueError(errors)
+            pipeline.state.joycon_bindings[path] = bindings
+
+    emitter = CountingEmitter()
+    pipeline.telemetry.sio = emitter
+    pipeline.telemetry.connect('soak')
+    pipeline.telemetry.subscribe('soak')
+
+    async def sample_lag():
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + LAG_INTERVAL
+            await asyncio.sleep(LAG_INTERVAL)
+            lags.append(max(0.0, loop.time() - expected))
+
+    state = pipeline.state
+    pipeline.start()
+    telemetry_task = asyncio.create_task(pipeline.telemetry.run())
+    lag_task = asyncio.create_task(sample_lag())
+
+    await asyncio.sleep(WARMUP_SEC)
+    connected = len(state.joycon_devices)
+    latencies.clear()
+    lags.clear()
+    before = fake_hid.stats()
+    batches_before = pipeline.output.batches
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    await asyncio.sleep(duration)
+    cpu = time.process_time() - cpu_started
+    wall = time.perf_counter() - started
+    after = fake_hid.stats()
+    processed = len(latencies)
+    latency = _percentiles(latencies)
+    lag = _percentiles(lags)
+    output_stats = pipeline.output.stats()
+
+    lag_task.cancel()
+    telemetry_task.cancel()
+    await pipeline.shutdown()
+
+    cpu_percent = cpu / wall * 100
+    return {
+        'controllers': count,
+        'connected': connected,
+        'duration_sec': round(wall, 3),
+        'cpu_percent': round(cpu_percent, 2),
+        'cpu_percent_per_controller': round(cpu_percent / count, 3) if count else None,
+        'reports': processed,
+        'expected_reports': int(count * wall / fake_hid.REPORT_INTERVAL),
+        'dropped_reports': after['dropped'] - before['dropped'],
+        'latency_ms': dict(zip(('p50', 'p95', 'p99', 'max'), latency)),
+        'loop_lag_ms': dict(zip(('p50', 'p95', 'p99', 'max'), lag)),
+        'output_batches': output_stats['batches'] - batches_before,
+        'output_errors': output_stats['errors'],
+        'telemetry_frames': emitter.frames,
+    }
+
+
+def run_single(count, duration, script, use_mapping):
+    """このプロセスで count 台を測定する (joycon_pipeline を import する前に hid を置き換える)"""
+    fake_hid.install(count, script)
+    import joycon_pipeline as pipeline
+    from output_backend import create_output_backend
+    pipeline.set_output(backend_factory=lambda: create_output_backend('fake'))
+    pipeline.output.wait_backend()
+    return asyncio.run(_measure(pipeline, count, duration, use_mapping))
+
+
+def _format_ms(value):
+    return '-' if value is None else f"{value:.2f}"
+
+
+def print_table(results):
+    header = (f"{'N':>3} {'CPU%':>7} {'CPU%/N':>7} {'reports':>15} {'dropped':>8} "
+              f"{'lat p50':>8} {'p95':>7} {'p99':>7} {'max':>7} {'lag p50':>8} {'p99':>7} {'max':>7}")
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        lat, lag = r['latency_ms'], r['loop_lag_ms']
+        reports = f"{r['reports']}/{r['expected_reports']}"
+        print(f"{r['controllers']:>3} {r['cpu_percent']:>7.1f} {r['cpu_percent_per_controller']:>7.2f} {reports:>15} "
+              f"{r['dropped_reports']:>8} {_format_ms(lat['p50']):>8} {_format_ms(lat['p95']):>7} {_format_ms(lat['p99']):>7} "
+              f"{_format_ms(lat['max']):>7} {_format_ms(lag['p50']):>8} {_format_ms(lag['p99']):>7} {_format_ms(lag['max']):>7}")
+    print("(latency / loop lag in ms)")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Soak test the Joy-Con input loop with simulated controllers")
+    parser.add_argument("--counts", default=','.join(map(str, DEFAULT_COUNTS)), help="測定する台数 (カンマ区切り)")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION, help="台数ごとの測定時間 (秒)")
+    parser.add_argument("--script", choices=fake_hid.SCRIPTS, default='mixed', help="模擬デバイスのボタン・スティックの動き")
+    parser.add_argument("--no-mapping", action="store_true", help="マッピングを割り当てない (デコードだけを測る)")
+    parser.add_argument("--json", metavar="PATH", help="結果を JSON で保存する")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)  # 台数ごとの子プロセス用
+    args = parser.parse_args()
+
+    if args.single is not None:
+        result = run_single(args.single, args.duration, args.script, not args.no_mapping)
+        print(json.dumps(result))
+        return
+
+    results = []
+    env = dict(os.environ, OMIP_OUTPUT_BACKEND='fake')
+    env.setdefault('PYNPUT_BACKEND', 'dummy')
+    for count in [int(c) for c in args.counts.split(',')]:
+        print(f"Measuring {count} controller(s) for {args.duration:.0f} s...", file=sys.stderr)
+        command = [sys.executable, os.path.abspath(__file__), '--single', str(count),
+                   '--duration', str(args.duration), '--script', args.script]
+        if args.no_mapping:
+            command.append('--no-mapping')
+        completed = subprocess.run(command, env=env, stdout=subprocess.PIPE, text=True)
+        lines = completed.stdout.strip().splitlines()
+        if completed.returncode != 0 or not lines:
+            print(f"Measurement with {count} controller(s) failed (exit code {completed.returncode})", file=sys.stderr)
+            continue
+        results.append(json.loads(lines[-1]))
+
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'script': args.script, 'mapping': not args.no_mapping, 'results': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
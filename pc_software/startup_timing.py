@@ -0,0 +1,62 @@
+"""
+起動時間の計測。
+
+エントリーポイントの最初に import し、起動の各段階 (mark) と、後から必要になった時点で行う
+重いモジュールの import (import_module) の時刻を記録する。
+記録は report() で取得でき、環境変数 OMIP_STARTUP_REPORT=1 のときは段階ごとに標準エラーへも出す
+(M5Tab バックエンドは標準出力を応答に使うため)。
+時刻はこのモジュールを import した時点からの経過時間で、それ以前のインタープリター自体の起動時間は含まない。
+"""
+import importlib
+import os
+import sys
+import time
+
+STARTUP_REPORT_ENV = 'OMIP_STARTUP_REPORT'
+
+_started = time.perf_counter()
+_marks = []    # (名前, 経過ms)
+_marked = set()
+_imports = []  # (モジュール名, import にかかった ms, import した時点の経過ms)
+_verbose = os.environ.get(STARTUP_REPORT_ENV) == '1'
+
+
+def _elapsed_ms():
+    return (time.perf_counter() - _started) * 1000
+
+
+def set_verbose(enabled):
+    global _verbose
+    _verbose = enabled
+
+
+def mark(name, once=True):
+    """起動の段階を記録する。once の場合は同じ名前の2回目以降を無視する。"""
+    if once and name in _marked:
+        return
+    _marked.add(name)
+    elapsed = _elapsed_ms()
+    _marks.append((name, elapsed))
+    if _verbose:
+        print(f"[startup] {name}: {elapsed:.1f} ms", file=sys.stderr)
+
+
+def import_module(name):
+    """モジュールを import する。初めて読み込む場合はかかった時間を記録する。"""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    started = time.perf_counter()
+    module = importlib.import_module(name)
+    took = (time.perf_counter() - started) * 1000
+    _imports.append((name, took, _elapsed_ms()))
+    if _verbose:
+        print(f"[startup] import {name}: {took:.1f} ms", file=sys.stderr)
+    return module
+
+
+def report():
+    return {
+        'marks': [{'name': n, 'ms': round(ms, 3)} for n, ms in _marks],
+        'deferred_imports': [{'module': n, 'ms': round(took, 3), 'at_ms': round(at, 3)} for n, took, at in _imports],
+    }
@@ -0,0 +1,220 @@
+"""
+Joy-Con の状態を Socket.IO クライアントへ配信するテレメトリーパブリッシャー。
+
+入力ループは最新の状態を記録するだけで、送信は一切待たない。
+パブリッシャーのタスクが一定の UI レートで変更をまとめて1つのフレームにし、
+デバイスリストは前回送信時からの差分 (追加・変更・削除) だけを送る。
+クライアントが遅くても、未送信の状態は「最新値で上書き」されるため溜まり続けない。
+
+入力・バッテリー・スティックの各ストリームは、クライアントがデバイス単位で
+購読したものだけを送る。購読者のいないストリームは記録もシリアライズもしない。
+"""
+import asyncio
+
+from latency import now_ns
+
+DEFAULT_UI_RATE = 30  # UIへフレームを送るレート (Hz)
+
+STREAMS = ('input', 'battery', 'stick')
+ALL_DEVICES = '*'
+_NO_SUBSCRIBERS = frozenset()
+
+
+class TelemetryPublisher:
+    def __init__(self, sio, rate_hz=DEFAULT_UI_RATE):
+        self.sio = sio
+        self.period = 1.0 / rate_hz
+        self._devices = {}        # デバイスID -> 現在のデバイス情報
+        self._sent_devices = {}   # デバイスID -> 最後に送信したデバイス情報
+        self._battery = {}        # デバイスID -> (残量, 充電中)
+        self._pending = {stream: {} for stream in STREAMS}  # ストリーム -> {デバイスID: 未送信の最新値}
+        self._clients = set()
+        self._subscribers = {}    # (ストリーム, デバイスID or '*') -> 購読しているsidの集合
+        self._client_subscriptions = {}  # sid -> {(ストリーム, デバイスID or '*'), ...}
+        self._dirty = asyncio.Event()
+        self._seq = 0
+        self.frames_sent = 0
+        self.emit_errors = 0
+        self.tracer = None        # LatencyTracer (計測が有効な間だけ設定される)
+        self._dirty_since = None  # 未送信の変更が最初に発生した時刻 (計測中のみ)
+
+    # --- クライアントと購読の管理 ---
+    def connect(self, sid):
+        self._clients.add(sid)
+
+    def disconnect(self, sid):
+        self._clients.discard(sid)
+        self.unsubscribe(sid)
+
+    def subscribe(self, sid, streams=STREAMS, device_id=None):
+        """sidに指定ストリームを購読させる。device_idがNoneの場合は全デバイスを購読する。"""
+        target = device_id or ALL_DEVICES
+        subscriptions = self._client_subscriptions.setdefault(sid, set())
+        for stream in streams:
+            if stream not in STREAMS:
+                raise ValueError(f"Unknown telemetry stream: '{stream}'")
+            key = (stream, target)
+            self._subscribers.setdefault(key, set()).add(sid)
+            subscriptions.add(key)
+
+    def unsubscribe(self, sid, streams=None, device_id=None):
+        """購読を解除する。streams/device_idを省略した場合はそのsidの購読をすべて解除する。"""
+        subscriptions = self._client_subscriptions.get(sid)
+        if not subscriptions:
+            return
+        for key in list(subscriptions):
+            stream, target = key
+            if streams is not None and stream not in streams:
+                continue
+            if device_id is not None and target != device_id:
+                continue
+            subscriptions.discard(key)
+            sids = self._subscribers.get(key)
+            if sids is not None:
+                sids.discard(sid)
+                if not sids:
+                    del self._subscribers[key]
+        if not subscriptions:
+            del self._client_subscriptions[sid]
+
+    def subscribers(self, stream, device_id):
+        """ストリームとデバイスに興味のあるsidの集合"""
+        specific = self._subscribers.get((stream, device_id), _NO_SUBSCRIBERS)
+        wildcard = self._subscribers.get((stream, ALL_DEVICES), _NO_SUBSCRIBERS)
+        if not wildcard:
+            return specific
+        if not specific:
+            return wildcard
+        return specific | wildcard
+
+    def subscription_keys(self):
+        """購読されている (ストリーム, デバイスID or '*') の集合"""
+        return frozenset(self._subscribers)
+
+    def wants(self, stream, device_id):
+        return (stream, device_id) in self._subscribers or (stream, ALL_DEVICES) in self._subscribers
+
+    def _mark_dirty(self):
+        if self.tracer is not None and not self._dirty.is_set():
+            self._dirty_since = now_ns()
+        self._dirty.set()
+
+    # --- 入力ループから呼ばれる (待たない) ---
+    def add_device(self, device_id, info):
+        self._devices[device_id] = dict(info, id=device_id)
+        self._mark_dirty()
+
+    def remove_device(self, device_id):
+        self._devices.pop(device_id, None)
+        self._battery.pop(device_id, None)
+        for pending in self._pending.values():
+            pending.pop(device_id, None)
+        self._mark_dirty()
+
+    def update_battery(self, device_id, level, charging):
+        self._battery[device_id] = (level, charging)
+        if self.wants('battery', device_id):
+            self._pending['battery'][device_id] = {'id': device_id, 'type': 'battery', 'level': level, 'charging': charging}
+            self._mark_dirty()
+
+    def update_input(self, device_id, buttons):
+        if self.wants('input', device_id):
+            self._pending['input'][device_id] = {'id': device_id, 'type': 'input', 'buttons': buttons}
+            self._mark_dirty()
+
+    def update_stick(self, device_id, x, y):
+        if self.wants('stick', device_id):
+            self._pending['stick'][device_id] = {'id': device_id, 'type': 'stick', 'x': x, 'y': y}
+            self._mark_dirty()
+
+    # --- 送信側 ---
+    def _device_entry(self, device_id, device):
+        entry = dict(device)
+        battery = self._battery.get(device_id)
+        if battery is not None:
+            entry['battery'], entry['charging'] = battery
+        return entry
+
+    def device_count(self):
+        return len(self._devices)
+
+    def client_count(self):
+        return len(self._clients)
+
+    def device_list(self):
+        """新しく接続したクライアントに送る完全なデバイスリスト"""
+        return [self._device_entry(device_id, d) for device_id, d in self._devices.items()]
+
+    def _build_device_delta(self):
+        added, changed, removed = [], [], []
+        for device_id, device in self._devices.items():
+            sent = self._sent_devices.get(device_id)
+            if sent is None:
+                added.append(self._device_entry(device_id, device))
+                continue
+            diff = {k: v for k, v in device.items() if sent.get(k) != v}
+            if diff:
+                diff['id'] = device_id
+                changed.append(diff)
+        for device_id in self._sent_devices:
+            if device_id not in self._devices:
+                removed.append(device_id)
+        self._sent_devices = {device_id: dict(d) for device_id, d in self._devices.items()}
+        if not (added or changed or removed):
+            return None
+        return {'added': added, 'changed': changed, 'removed': removed}
+
+    def _build_frames(self):
+        """sidごとのフレームを組み立てる。コストは送信対象の購読数に比例する。"""
+        updates_by_sid = {}
+        for stream, pending in self._pending.items():
+            if not pending:
+                continue
+            for device_id, update in pending.items():
+                for sid in self.subscribers(stream, device_id):
+                    updates_by_sid.setdefault(sid, []).append(update)
+            self._pending[stream] = {}
+
+        device_delta = self._build_device_delta()
+        recipients = self._clients if device_delta else updates_by_sid.keys()
+        if not recipients:
+            return {}
+
+        self._seq += 1
+        empty_delta = {'added': [], 'changed': [], 'removed': []}
+        return {
+            sid: {
+                'seq': self._seq,
+                'updates': updates_by_sid.get(sid, []),
+                'devices': device_delta or empty_delta,
+            }
+            for sid in recipients
+        }
+
+    async def run(self):
+        """変更があったときだけ、最大 rate_hz でフレームを送信する"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._dirty.wait()
+            self._dirty.clear()
+            started = loop.time()
+            tracer, dirty_since, self._dirty_since = self.tracer, self._dirty_since, None
+            frames = self._build_frames()
+            for sid, frame in frames.items():
+                try:
+                    if tracer is None:
+                        await self.sio.emit('joycon_frame', frame, to=sid)
+                    else:
+                        emit_started = now_ns()
+                        await self.sio.emit('joycon_frame', frame, to=sid)
+                        tracer.record('emit', now_ns() - emit_started)
+                    self.frames_sent += 1
+                except Exception as e:
+                    self.emit_errors += 1
+                    print(f"Failed to publish telemetry frame to {sid}: {e}")
+            if tracer is not None and dirty_since is not None and frames:
+                tracer.record('report_to_ui', now_ns() - dirty_since)
+            # 次のフレームまでの間に届いた変更は次のフレームにまとめる
+            delay = self.period - (loop.time() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
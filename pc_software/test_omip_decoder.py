@@ -0,0 +1,203 @@
+"""
+omip_decoder.InputDecoder のデコード結果が omip_pb2 (WrapperMessage.ParseFromString) と一致することを確かめるテスト。
+
+ランダムなメッセージ (フィールドの順序・重複・省略も混ぜる) と、境界値 (最大長の varint・負の値・
+未知のフィールド・途中で切れたペイロード) を両方でデコードして比べる。どちらも例外になる場合も一致とみなす。
+
+使い方 (pc_software/ で):
+    python -m unittest test_omip_decoder
+    python -m pytest test_omip_decoder.py
+"""
+import math
+import random
+import struct
+import unittest
+
+import omip_pb2
+from omip_decoder import INPUT_ANALOG, INPUT_DIGITAL, INPUT_ENCODER, InputDecoder
+
+VALUE_FIELDS = {INPUT_DIGITAL: 'state', INPUT_ANALOG: 'value', INPUT_ENCODER: 'steps'}
+WRAPPER_FIELDS = {INPUT_DIGITAL: 1, INPUT_ANALOG: 2, INPUT_ENCODER: 3}
+VARINT, FIXED64, LENGTH_DELIMITED, FIXED32 = 0, 1, 2, 5
+UINT32_MAX = 0xFFFFFFFF
+RANDOM_MESSAGES = 5000
+
+
+# --- エンコード (protobuf の SerializeToString では作れない順序・重複・不正な形も作る) ---
+def varint(n):
+    n &= (1 << 64) - 1  # 負の値は int64 と同じく10バイトの2の補数
+    out = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        if not n:
+            out.append(byte)
+            return bytes(out)
+        out.append(byte | 0x80)
+
+
+def field(number, wire_type, payload):
+    return varint(number << 3 | wire_type) + payload
+
+
+def length_delimited(number, body):
+    return field(number, LENGTH_DELIMITED, varint(len(body)) + body)
+
+
+def zigzag(n):
+    return (n << 1) ^ (n >> 31)
+
+
+def wrap(kind, body):
+    return length_delimited(WRAPPER_FIELDS[kind], body)
+
+
+# --- 比較 ---
+def canonical(kind, msg):
+    if kind not in VALUE_FIELDS:
+        return kind, msg.SerializeToString() if kind else b''
+    value = getattr(msg, VALUE_FIELDS[kind])
+    if isinstance(value, float):
+        value = 'nan' if math.isnan(value) else struct.pack('<f', value)  # -0.0 と 0.0 も区別する
+    return kind, msg.device_id, msg.port_id, value
+
+
+def reference(data):
+    wrapper = omip_pb2.WrapperMessage()
+    wrapper.ParseFromString(data)
+    kind = wrapper.WhichOneof('message_type')
+    return canonical(kind, getattr(wrapper, kind) if kind in VALUE_FIELDS else wrapper)
+
+
+def outcome(decode, data):
+    try:
+        return decode(data)
+    except Exception as e:
+        return 'error', type(e).__name__
+
+
+class DecoderParityTest(unittest.TestCase):
+    def setUp(self):
+        self.decoder = InputDecoder()
+
+    def assertParity(self, data):
+        expected = outcome(reference, data)
+        actual = outcome(lambda d: canonical(*self.decoder.decode(d)), data)
+        self.assertEqual(actual, expected, f"payload {data.hex()}")
+        return actual
+
+    def test_random_messages(self):
+        rng = random.Random(1234)
+        for _ in range(RANDOM_MESSAGES):
+            kind = rng.choice(list(WRAPPER_FIELDS))
+            fields = []
+            if rng.random() < 0.9:
+                fields.append(field(1, VARINT, varint(rng.choice((0, 1, rng.randrange(UINT32_MAX + 1))))))
+            if rng.random() < 0.9:
+                fields.append(field(2, VARINT, varint(rng.choice((0, 18, rng.randrange(300), rng.randrange(UINT32_MAX + 1))))))
+            if rng.random() < 0.9:
+                if kind == INPUT_ANALOG:
+                    fields.append(field(3, FIXED32, struct.pack('<I', rng.getrandbits(32))))  # NaN・無限大も含む
+                elif kind == INPUT_DIGITAL:
+                    fields.append(field(3, VARINT, varint(rng.choice((0, 1)))))
+                else:
+                    steps = rng.choice((-1, 1, rng.randrange(-(1 << 31), 1 << 31)))
+                    fields.append(field(3, VARINT, varint(zigzag(steps))))
+            if fields and rng.random() < 0.2:
+                fields.append(rng.choice(fields))  # 重複 (後勝ち)
+            rng.shuffle(fields)
+            data = wrap(kind, b''.join(fields))
+            # 同じペイロードを2回 (2回目はキャッシュから) デコードしても同じ
+            self.assertEqual(self.assertParity(data), self.assertParity(data))
+
+    def test_serialized_messages(self):
+        P = omip_pb2
+        messages = [
+            P.WrapperMessage(input_digital=P.InputDigital()),
+            P.WrapperMessage(input_analog=P.InputAnalog()),
+            P.WrapperMessage(input_encoder=P.InputEncoder()),
+            P.WrapperMessage(input_digital=P.InputDigital(device_id=UINT32_MAX, port_id=UINT32_MAX, state=True)),
+            P.WrapperMessage(input_analog=P.InputAnalog(port_id=18, value=-1.5e30)),
+            P.WrapperMessage(input_analog=P.InputAnalog(port_id=18, value=float('inf'))),
+            P.WrapperMessage(input_analog=P.InputAnalog(port_id=18, value=float('nan'))),
+            P.WrapperMessage(feedback_image=P.FeedbackImage(device_id=2, screen_id=3)),  # 両方の proto にあるフィールドだけ使う
+        ]
+        for message in messages:
+            self.assertParity(message.SerializeToString())
+        self.assertParity(b'')
+
+    def test_max_varints(self):
+        for kind in WRAPPER_FIELDS:
+            for value in (UINT32_MAX, UINT32_MAX + 1, (1 << 64) - 1):
+                self.assertParity(wrap(kind, field(1, VARINT, varint(value)) + field(2, VARINT, varint(value))))
+        # 10バイト目まで使った varint と、10バイトを超える (不正な) varint
+        self.assertParity(wrap(INPUT_DIGITAL, b'\x10' + b'\xff' * 9 + b'\x01'))
+        self.assertParity(wrap(INPUT_DIGITAL, b'\x10' + b'\xff' * 10 + b'\x01'))
+        # 1バイトで足りる値を長い varint で表したもの
+        self.assertParity(wrap(INPUT_DIGITAL, b'\x10\x85\x80\x80\x80\x00'))
+        # WrapperMessage の長さを2バイトの varint で表したもの
+        body = field(2, VARINT, varint(7)) + field(3, VARINT, varint(1))
+        self.assertParity(b'\x0a' + bytes([len(body) | 0x80, 0x00]) + body)
+
+    def test_negative_values(self):
+        for steps in (-1, -2, -(1 << 31), (1 << 31) - 1):
+            self.assertParity(wrap(INPUT_ENCODER, field(2, VARINT, varint(1)) + field(3, VARINT, varint(zigzag(steps)))))
+        # uint32 / bool に負の値 (int64 と同じ10バイトの varint) が来た場合
+        for kind in WRAPPER_FIELDS:
+            self.assertParity(wrap(kind, field(1, VARINT, varint(-1)) + field(2, VARINT, varint(-5))))
+        self.assertParity(wrap(INPUT_DIGITAL, field(3, VARINT, varint(-1))))
+        self.assertParity(wrap(INPUT_DIGITAL, field(3, VARINT, varint(1 << 40))))
+        # sint32 に32ビットを超える値 (下位32ビットだけを zigzag として読む)
+        self.assertParity(wrap(INPUT_ENCODER, field(3, VARINT, varint((1 << 40) | 3))))
+        for value in (-0.0, -1.0, float('-inf')):
+            self.assertParity(wrap(INPUT_ANALOG, field(3, FIXED32, struct.pack('<f', value))))
+
+    def test_unknown_fields(self):
+        unknown = [
+            field(4, VARINT, varint(5)),
+            field(5, FIXED64, bytes(8)),
+            length_delimited(6, b'abc'),
+            field(7, FIXED32, bytes(4)),
+            field(2000, VARINT, varint(1)),  # タグが2バイトになるフィールド番号
+        ]
+        known = field(1, VARINT, varint(1)) + field(2, VARINT, varint(9))
+        for kind in WRAPPER_FIELDS:
+            for extra in unknown:
+                self.assertParity(wrap(kind, known + extra))
+                self.assertParity(wrap(kind, extra + known))
+                self.assertParity(wrap(kind, known) + extra)  # WrapperMessage 側の未知のフィールド
+        # 知っているフィールドが想定と違うワイヤー型で来た場合 (protobuf は未知のフィールドとして扱う)
+        self.assertParity(wrap(INPUT_DIGITAL, field(2, FIXED32, bytes(4))))
+        self.assertParity(wrap(INPUT_ENCODER, field(3, FIXED32, bytes(4))))
+        self.assertParity(wrap(INPUT_ANALOG, field(3, VARINT, varint(1))))
+
+    def test_multiple_oneofs(self):
+        digital = wrap(INPUT_DIGITAL, field(2, VARINT, varint(5)))
+        analog = wrap(INPUT_ANALOG, field(2, VARINT, varint(18)) + field(3, FIXED32, struct.pack('<f', 1.0)))
+        self.assertParity(digital + analog)  # 後勝ち
+        self.assertParity(digital + wrap(INPUT_DIGITAL, field(3, VARINT, varint(1))))  # 同じ oneof はマージされる
+
+    def test_truncated_payloads(self):
+        payloads = [
+            wrap(INPUT_DIGITAL, field(1, VARINT, varint(UINT32_MAX)) + field(2, VARINT, varint(7)) + field(3, VARINT, varint(1))),
+            wrap(INPUT_ANALOG, field(2, VARINT, varint(18)) + field(3, FIXED32, struct.pack('<f', 0.5))),
+            wrap(INPUT_ENCODER, field(2, VARINT, varint(1)) + field(3, VARINT, varint(zigzag(-(1 << 31))))),
+        ]
+        for data in payloads:
+            for end in range(len(data)):
+                self.assertParity(data[:end])
+
+    def test_record_is_reused(self):
+        kind, first = self.decoder.decode(wrap(INPUT_DIGITAL, field(2, VARINT, varint(3)) + field(3, VARINT, varint(1))))
+        kind, second = self.decoder.decode(wrap(INPUT_ENCODER, field(2, VARINT, varint(4)) + field(3, VARINT, varint(zigzag(-2)))))
+        self.assertIs(first, second)
+        self.assertEqual((kind, second.port_id, second.steps), (INPUT_ENCODER, 4, -2))
+        decoder = InputDecoder(reuse=False)
+        _, first = decoder.decode(wrap(INPUT_DIGITAL, field(2, VARINT, varint(3))))
+        _, second = decoder.decode(wrap(INPUT_DIGITAL, field(2, VARINT, varint(4))))
+        self.assertIsNot(first, second)
+        self.assertEqual((first.port_id, second.port_id), (3, 4))
+
+
+if __name__ == '__main__':
+    unittest.main()
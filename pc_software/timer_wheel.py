@@ -0,0 +1,128 @@
+"""
+マクロ・長押し・ダブルタップ・連射で使うタイマーホイール。
+
+タイマーごとにスレッドやタスクを作らず、1つのドライバー (asyncio タスクか専用スレッド) が
+一定間隔のティックでホイールを進める。タイマーは期限のティックに対応するスロットに入れるだけなので、
+1ティックの処理量はそのティックで期限を迎えたタイマーの数に比例し、登録中のタイマーの総数には依存しない。
+タイマーのキャンセルはフラグを立てるだけで、スロットを訪れたときに取り除く。
+
+コールバックは lock を保持した状態で呼ばれる。別スレッドから状態を操作する場合は同じ lock を使う。
+"""
+import asyncio
+import math
+import sys
+import threading
+import time
+
+DEFAULT_TICK_SEC = 0.005
+DEFAULT_SLOTS = 512
+
+
+class Timer:
+    __slots__ = ('deadline', 'callback', 'args', 'cancelled')
+
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline  # 期限のティック番号
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel:
+    def __init__(self, tick_sec=DEFAULT_TICK_SEC, slots=DEFAULT_SLOTS, clock=time.monotonic):
+        self.tick_sec = tick_sec
+        self.clock = clock
+        self.lock = threading.RLock()
+        self._slots = [[] for _ in range(slots)]
+        self._tick = self._tick_at(clock())
+        self._count = 0         # スロットに入っているタイマーの数 (キャンセル済みで未回収のものを含む)
+        self._notify = None     # 空のホイールにタイマーが入ったときにドライバーを起こす関数
+
+    def _tick_at(self, now):
+        return int(now / self.tick_sec)
+
+    def schedule(self, delay, callback, *args):
+        """delay 秒後 (ティック単位に切り上げ) に callback(*args) を呼ぶ"""
+        with self.lock:
+            # 待機していた間は _tick が進んでいないので、現在時刻を基準にする
+            base = max(self._tick, self._tick_at(self.clock()))
+            ticks = max(1, math.ceil(delay / self.tick_sec - 1e-9))  # 浮動小数点の誤差で1ティック伸びないようにする
+            timer = Timer(base + ticks, callback, args)
+            self._slots[timer.deadline % len(self._slots)].append(timer)
+            self._count += 1
+            if self._count == 1 and self._notify is not None:
+                self._notify()
+            return timer
+
+    def advance(self, now=None):
+        """現在時刻までのティックを処理し、期限を迎えたタイマーのコールバックを呼ぶ"""
+        with self.lock:
+            target = self._tick_at(self.clock() if now is None else now)
+            if target <= self._tick:
+                return
+            slot_count = len(self._slots)
+            # 長く止まっていた場合でも各スロットは1回だけ訪れればよい
+            first = max(self._tick + 1, target - slot_count + 1)
+            self._tick = target
+            due = []
+            for tick in range(first, target + 1):
+                slot = self._slots[tick % slot_count]
+                if not slot:
+                    continue
+                keep = []
+                for timer in slot:
+                    if timer.cancelled:
+                        self._count -= 1
+                    elif timer.deadline <= target:
+                        self._count -= 1
+                        due.append(timer)
+                    else:
+                        keep.append(timer)
+                self._slots[tick % slot_count] = keep
+            if len(due) > 1:
+                due.sort(key=lambda t: t.deadline)
+            for timer in due:
+                if timer.cancelled:
+                    continue
+                try:
+                    timer.callback(*timer.args)
+                except Exception as e:
+                    print(f"Timer callback failed: {e}", file=sys.stderr)
+
+    def __len__(self):
+        return self._count
+
+    async def run(self):
+        """asyncio のドライバー。タイマーが無い間は待機する。"""
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+        self._notify = lambda: loop.call_soon_threadsafe(wake.set)
+        try:
+            while True:
+                if not self._count:
+                    wake.clear()
+                    await wake.wait()
+                await asyncio.sleep(self.tick_sec)
+                self.advance()
+        finally:
+            self._notify = None
+
+    def start_thread(self):
+        """専用スレッドのドライバーを起動する (asyncio を使わないアプリ用)"""
+        wake = threading.Event()
+        self._notify = wake.set
+
+        def worker():
+            while True:
+                if not self._count:
+                    wake.wait()
+                    wake.clear()
+                time.sleep(self.tick_sec)
+                self.advance()
+
+        thread = threading.Thread(target=worker, name='timer-wheel', daemon=True)
+        thread.start()
+        return thread
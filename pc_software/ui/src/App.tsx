@@ -6,7 +6,7 @@ import DeviceGrid from './DeviceGrid';
 import Settings from './Settings';
 import { ThemeProvider } from './contexts/ThemeContext';
 import { DeviceSettingsProvider, useDeviceSettings } from './contexts/DeviceSettingsContext';
-import type { JoyConDevice } from './types';
+import type { JoyConDevice, JoyConFrame } from './types';
 
 const MainContent: React.FC = () => {
   const { t } = useTranslation();
@@ -21,25 +21,43 @@ const MainContent: React.FC = () => {
       setDevices(prevDevices => ({ ...prevDevices, ...data }));
     });
 
+    // Joy-Conの入力とバッテリーを全デバイス分購読する (再接続時も購読し直す)
+    const subscribeJoycons = () => {
+      socket.emit('subscribe_joycon', { streams: ['input', 'battery'] });
+    };
+    socket.on('connect', subscribeJoycons);
+    if (socket.connected) subscribeJoycons();
+
     // Joy-Conデバイスリストの受信
     socket.on('joycon_devices', (data) => {
       setJoycons(data.devices || []);
     });
 
-    // Joy-Conの状態更新
-    socket.on('joycon_update', (data) => {
-      setJoycons(prevJoycons => 
-        prevJoycons.map(jc => {
-          if (jc.id === data.id) {
-            if (data.type === 'battery') {
-              return { ...jc, battery: data.level };
-            } else if (data.type === 'input') {
-              return { ...jc, buttons: data.buttons }; // ボタン状態を直接保持
-            }
+    // Joy-Conの状態更新 (UIレートでまとめられたフレーム。デバイスリストは差分のみ)
+    socket.on('joycon_frame', (frame: JoyConFrame) => {
+      setJoycons(prevJoycons => {
+        const { added, changed, removed } = frame.devices;
+        let next = prevJoycons.filter(jc => !removed.includes(jc.id));
+        for (const device of added) {
+          next = [...next.filter(jc => jc.id !== device.id), device];
+        }
+        const changedById = new Map(changed.map(c => [c.id, c] as const));
+        const updatesById = new Map<string, Partial<JoyConDevice>>();
+        for (const update of frame.updates) {
+          const prev = updatesById.get(update.id) || {};
+          if (update.type === 'input') {
+            updatesById.set(update.id, { ...prev, buttons: update.buttons }); // ボタン状態を直接保持
+          } else if (update.type === 'battery') {
+            updatesById.set(update.id, { ...prev, battery: update.level, charging: update.charging });
           }
-          return jc;
-        })
-      );
+        }
+        return next.map(jc => {
+          const diff = changedById.get(jc.id);
+          const update = updatesById.get(jc.id);
+          if (!diff && !update) return jc;
+          return { ...jc, ...diff, ...update };
+        });
+      });
     });
 
     window.electron.onActiveWindowChange((appName: string) => {
@@ -54,7 +72,9 @@ const MainContent: React.FC = () => {
     return () => {
       socket.off('device_update');
       socket.off('joycon_devices');
-      socket.off('joycon_update');
+      socket.off('joycon_frame');
+      socket.off('connect', subscribeJoycons);
+      socket.emit('unsubscribe_joycon', {});
     };
   }, [findProfileByAppName]);
 
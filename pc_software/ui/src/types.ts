@@ -12,5 +12,23 @@ export interface JoyConDevice {
   id: string;
   type: 'L' | 'R';
   battery: number;
+  charging?: boolean;
   buttons?: { [key: string]: boolean };
 }
+
+// 購読したストリームごとの更新
+export type JoyConTelemetryUpdate =
+  | { id: string; type: 'input'; buttons: { [key: string]: boolean } }
+  | { id: string; type: 'battery'; level: number; charging: boolean }
+  | { id: string; type: 'stick'; x: number; y: number };
+
+// サーバーからUIレートで届く更新フレームの型定義
+export interface JoyConFrame {
+  seq: number;
+  updates: JoyConTelemetryUpdate[];
+  devices: {
+    added: JoyConDevice[];
+    changed: (Partial<JoyConDevice> & { id: string })[];
+    removed: string[];
+  };
+}